@@ -0,0 +1,60 @@
+'''
+Generated, seeded corpora for the benchmarks: plain text, Word documents with headings and PDFs.
+'''
+
+import random
+
+WORDS = (
+    "policy employee leave claim approval manager department salary benefit insurance travel expense report "
+    "system access security password device network training compliance audit record retention contract "
+    "supplier invoice payment budget project schedule review quality safety incident procedure guideline"
+).split()
+
+
+def make_paragraph(rng, min_words=20, max_words=90):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    sentences, start = [], 0
+    while start < len(words):
+        end = start + rng.randint(6, 18)
+        sentences.append(" ".join(words[start:end]).capitalize() + ".")
+        start = end
+    return " ".join(sentences)
+
+
+def make_paragraphs(num_paragraphs, seed=0):
+    rng = random.Random(seed)
+    return [make_paragraph(rng) for _ in range(num_paragraphs)]
+
+
+def make_text(num_paragraphs, seed=0):
+    return "\n\n".join(make_paragraphs(num_paragraphs, seed))
+
+
+def make_docx(path, num_sections, paragraphs_per_section=8, seed=0):
+    from docx import Document
+    rng = random.Random(seed)
+    doc = Document()
+    doc.add_heading(f"Benchmark document {seed}", 0)
+    for i in range(num_sections):
+        doc.add_heading(f"{i + 1} {rng.choice(WORDS).capitalize()} {rng.choice(WORDS)}", 1)
+        for _ in range(paragraphs_per_section):
+            doc.add_paragraph(make_paragraph(rng))
+    doc.save(path)
+    return num_sections * (paragraphs_per_section + 1) + 1
+
+
+def make_pdf(path, num_pages, paragraphs_per_page=6, seed=0):
+    import fitz
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(num_pages):
+        page = doc.new_page()
+        rect = fitz.Rect(50, 50, page.rect.width - 50, 0)
+        for _ in range(paragraphs_per_page):
+            text = make_paragraph(rng, 15, 40)
+            height = 12 * (len(text) // 90 + 2)
+            rect = fitz.Rect(rect.x0, rect.y1 + 8, rect.x1, rect.y1 + 8 + height)
+            page.insert_textbox(rect, text, fontsize=9)
+    doc.save(path)
+    doc.close()
+    return num_pages
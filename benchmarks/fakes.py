@@ -0,0 +1,239 @@
+'''
+Deterministic local stand-ins for the external services, so the benchmarks run offline and give the same numbers
+for the same code. Every fake answers from a hash of its input and waits a configurable latency, optionally behind a
+requests-per-second limit, to model the service it replaces.
+
+Milvus and the Firebase bucket need no fake here: the benchmarks run with VECTOR_STORE=local and
+STORAGE_BACKEND=local, pointed at a temporary directory by configure_environment.
+'''
+
+import os
+import re
+import ast
+import time
+import zlib
+import asyncio
+import threading
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+import numpy as np
+
+EMBEDDING_DIM = 1536
+marker_line_pattern = re.compile(r'^【(\d+)†source】\s*(.*)$')
+table_block_pattern = re.compile(r'^\s*### (\S+)\n.*\nColumns: (\[.*?\])$', re.MULTILINE)
+columns_pattern = re.compile(r'has the following columns: (\[.*?\])')
+
+
+def configure_environment(tmp_dir):
+    # Must run before the repo's modules are imported, they read their settings at import time
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["VECTOR_STORE"] = "local"
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["LOCAL_VECTOR_STORE_PATH"] = os.path.join(tmp_dir, "vectors")
+    os.environ["LOCAL_STORAGE_PATH"] = os.path.join(tmp_dir, "storage")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(tmp_dir, "embeddings.sqlite3")
+    os.environ["SEGMENT_CACHE_PATH"] = os.path.join(tmp_dir, "segments.sqlite3")
+    os.environ["INGEST_JOB_DB_PATH"] = os.path.join(tmp_dir, "jobs.sqlite3")
+
+
+class RateLimiter:
+    # Spaces requests at least 1 / rate seconds apart, shared by threads and coroutines. rate <= 0 means unlimited.
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        # Reserve the next slot and return how long the caller has to wait for it
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            return slot - now
+
+
+class FakeOpenAIService:
+    # Latency model and counters shared by the sync and async fake clients: an embeddings request waits
+    # embedding_latency + per_item * inputs, a chat request waits chat_latency and then per_token between streamed tokens
+
+    def __init__(self, embedding_latency=0.05, chat_latency=0.5, per_item=0.0005, per_token=0.0, rate=0.0):
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.per_item = per_item
+        self.per_token = per_token
+        self.limiter = RateLimiter(rate)
+        self.requests = {"embeddings": 0, "chat": 0}
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, kind, wait):
+        with self._lock:
+            self.requests[kind] += 1
+            self.waited += wait
+
+    def embed(self, texts):
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=fake_embedding(text)) for i, text in enumerate(texts)])
+
+    def answer(self, messages):
+        return fake_answer(messages[-1]["content"])
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "rate_limited_seconds": round(self.waited, 3)}
+
+
+def fake_embedding(text):
+    vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_answer(prompt):
+    # Segmentation prompts get a "sections" code block choosing markers from the excerpt's content, column description
+    # prompts (single or packed tables) get one line per column, other prompts get a fixed length answer
+    if 'list of section markers' in prompt:
+        markers = []
+        for line in prompt.split('\n'):
+            match = marker_line_pattern.match(line)
+            if match and zlib.crc32(match.group(2).encode("utf-8")) % 5 == 0:
+                markers.append(f'【{match.group(1)}†source】')
+        return "```python\nsections = " + repr(markers) + "\n```"
+    tables = table_block_pattern.findall(prompt)
+    if tables:
+        return "\n".join(f"### {name}\n" + "\n".join(f"{column}: Values of {column}" for column in ast.literal_eval(columns)) for name, columns in tables)
+    columns = columns_pattern.search(prompt)
+    if columns:
+        return "\n".join(f"{column}: Values of {column}" for column in ast.literal_eval(columns.group(1)))
+    words = prompt.split()[:40]
+    return "Based on the provided information, " + " ".join(words)
+
+
+def _completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def _chunks(content):
+    return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))]) for token in re.findall(r'\S+\s*', content)]
+
+
+class FakeAsyncOpenAI:
+    # Duck types the parts of openai.AsyncOpenAI used by the app: embeddings.create and chat.completions.create
+
+    def __init__(self, service):
+        self.service = service
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+
+    async def _wait(self, kind, seconds):
+        wait = self.service.limiter.delay()
+        self.service._count(kind, wait)
+        await asyncio.sleep(wait + seconds)
+
+    async def _embeddings_create(self, input, model, **kwargs):
+        await self._wait("embeddings", self.service.embedding_latency + self.service.per_item * len(input))
+        return self.service.embed(input)
+
+    async def _chat_create(self, messages, model, stream=False, **kwargs):
+        await self._wait("chat", self.service.chat_latency)
+        content = self.service.answer(messages)
+        if not stream:
+            return _completion(content)
+
+        async def generate():
+            for chunk in _chunks(content):
+                if self.service.per_token:
+                    await asyncio.sleep(self.service.per_token)
+                yield chunk
+        return generate()
+
+
+class FakeOpenAI:
+    # Blocking counterpart of FakeAsyncOpenAI, for the thread pool embedding path
+
+    def __init__(self, service):
+        self.service = service
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+
+    def _wait(self, kind, seconds):
+        wait = self.service.limiter.delay()
+        self.service._count(kind, wait)
+        time.sleep(wait + seconds)
+
+    def _embeddings_create(self, input, model, **kwargs):
+        self._wait("embeddings", self.service.embedding_latency + self.service.per_item * len(input))
+        return self.service.embed(input)
+
+    def _chat_create(self, messages, model, stream=False, **kwargs):
+        self._wait("chat", self.service.chat_latency)
+        content = self.service.answer(messages)
+        return iter(_chunks(content)) if stream else _completion(content)
+
+
+def install_fake_openai(service):
+    # Replace the app's OpenAI clients in the client registry with the fakes
+    from clients import clients
+    clients.set("openai", FakeOpenAI(service))
+    clients.set("async_openai", FakeAsyncOpenAI(service))
+    clients.set("segment_openai", FakeAsyncOpenAI(service))
+
+
+class FakeMySQLCursor:
+
+    def __init__(self, database):
+        self.database = database
+        self._result = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, query, args=()):
+        await asyncio.sleep(self.database.latency)
+        tables = self.database.tables
+        if "information_schema.COLUMNS c" in query:
+            names = [name for name in (args or sorted(tables)) if name in tables]
+            self._result = [
+                {"TABLE_NAME": name, "COLUMN_NAME": column, "UPDATE_TIME": None}
+                for name in sorted(names) for column in tables[name]
+            ]
+        elif "information_schema.TABLES" in query:
+            self._result = [{"UPDATE_TIME": None}] if args[0] in tables else []
+        elif "information_schema.COLUMNS" in query:
+            self._result = [{"COLUMN_NAME": column} for column in tables.get(args[0], [])]
+        else:
+            name = re.search(r'FROM `?(\w+)`?', query).group(1)
+            limit = int(re.search(r'LIMIT (\d+)', query).group(1))
+            self._result = [{column: f"{column} value {i}" for column in tables[name]} for i in range(limit)]
+
+    async def fetchone(self):
+        return self._result[0] if self._result else None
+
+    async def fetchall(self):
+        return self._result
+
+
+class FakeMySQLPool:
+    # Stands in for sql.connection.ManagedPool: `tables` maps table names to their columns, every query waits `latency`
+
+    def __init__(self, tables, name="benchmark", latency=0.001, maxsize=10):
+        self.name = name
+        self.tables = tables
+        self.latency = latency
+        self.maxsize = maxsize
+        self._semaphore = asyncio.Semaphore(maxsize)
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._semaphore:
+            yield SimpleNamespace(cursor=lambda *args: FakeMySQLCursor(self))
+
+    def stats(self):
+        return {"maxsize": self.maxsize, "tables": len(self.tables)}
+
+    async def close(self):
+        pass
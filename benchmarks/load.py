@@ -0,0 +1,210 @@
+'''
+In-process load generator for the FastAPI app in main.py.
+
+Requests go through httpx's ASGI transport straight into the app, with its lifespan run around the test, so there is
+no server or network in the measurement. OpenAI and MySQL are the fakes from benchmarks/fakes.py, Milvus and Firebase
+the local vector store and blob store. While the load runs, a probe task measures how late the event loop wakes it up:
+blocking calls inside async routes show up there (and in the tail latencies) long before production.
+
+Usage (from the repository root):
+    python -m benchmarks.load --mix chat=6,sql=2,upload=1,split=1 --rate 50 --duration 30
+    python -m benchmarks.load --concurrency 32 --duration 30 --output load.json
+'''
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+ROUTES = ["chat", "split", "upload", "sql"]
+LAG_PROBE_INTERVAL = 0.01
+COLLECTION = "loadtest"
+PDF_ID = "loadtest-doc"
+
+
+async def probe_loop_lag(samples, stop):
+    # Sleep for a fixed interval and record how much later than asked the loop woke us up
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        samples.append(max(time.perf_counter() - start - LAG_PROBE_INTERVAL, 0.0))
+
+
+async def prepare(args, tmp_dir):
+    # Documents for the upload and split_doc requests, and an ingested collection for chat_with_pdf to search
+    from benchmarks.corpus import make_docx, make_paragraphs
+    from wordDoc.utils.process_data import process_sections_for_insert
+    from wordDoc.vectorstore.base import get_vector_store
+    from wordDoc.storage.base import get_blob_store
+
+    loop = asyncio.get_event_loop()
+    uploads = []
+    for i in range(args.upload_documents):
+        path = os.path.join(tmp_dir, f"upload{i}.docx")
+        make_docx(path, 5, seed=100 + i)
+        with open(path, "rb") as f:
+            uploads.append(f.read())
+
+    split_path = "wordDoc/loadtest.docx"
+    with open(os.path.join(tmp_dir, "upload0.docx"), "rb") as f:
+        await get_blob_store().upload(split_path, f, "application/octet-stream")
+
+    store = get_vector_store()
+    await store.create(COLLECTION)
+    contents = make_paragraphs(args.chat_rows, seed=1)
+    for i in range(0, len(contents), 500):
+        data = await loop.run_in_executor(None, process_sections_for_insert, contents[i:i + 500], PDF_ID)
+        await store.insert(COLLECTION, data)
+    return uploads, split_path
+
+
+def install_fake_mysql():
+    from benchmarks.fakes import FakeMySQLPool
+    from sql.connection import pool_manager
+    from sql.handler import TABLE_CONFIG_PATH
+    with open(TABLE_CONFIG_PATH) as f:
+        tables = {name: ["id", "name", "created_at", "value"] for name in json.load(f)}
+    pool_manager.databases = ["loadtest"]
+    pool_manager.pools["loadtest"] = FakeMySQLPool(tables, name="loadtest")
+    return list(tables)
+
+
+def request_factory(uploads, split_path, tables, rng):
+    # One function per route returning the (method, url, request kwargs) of the next request
+    questions = [f"What does the policy say about item {i}?" for i in range(50)]
+    return {
+        "chat": lambda: ("POST", "/api/chat_with_pdf", {"json": {"user_id": COLLECTION, "pdf_id": PDF_ID, "user_question": rng.choice(questions)}}),
+        "split": lambda: ("POST", "/api/split_doc", {"json": {"collection_name": "loadtest_split", "doc_path": split_path, "segmentation": "structure"}}),
+        "upload": lambda: ("POST", "/api/upload_doc", {"files": {"file": ("load.docx", rng.choice(uploads), "application/octet-stream")}}),
+        "sql": lambda: ("POST", "/api/sql_insights", {"json": {"table_name": rng.choice(tables)}})
+    }
+
+
+async def run_load(args, tmp_dir):
+    import httpx
+    from benchmarks.fakes import FakeOpenAIService, install_fake_openai
+    from main import app
+
+    service = FakeOpenAIService(
+        embedding_latency=args.embedding_latency_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        per_item=args.per_item_ms / 1000,
+        rate=args.rate_limit
+    )
+    install_fake_openai(service)
+
+    rng = random.Random(args.seed)
+    routes = [route for route, _ in args.mix]
+    weights = [weight for _, weight in args.mix]
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lag = []
+
+    async with app.router.lifespan_context(app):
+        tables = install_fake_mysql()
+        uploads, split_path = await prepare(args, tmp_dir)
+        factories = request_factory(uploads, split_path, tables, rng)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+
+            async def send(route):
+                method, url, kwargs = factories[route]()
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                    status = str(response.status_code)
+                    if response.status_code < 400 and isinstance(response.headers.get("content-type"), str) \
+                            and response.headers["content-type"].startswith("application/json") and "error" in response.json():
+                        status = "error_body"  # upload_doc reports failures in the body with a 200
+                except Exception as e:
+                    status = type(e).__name__
+                latencies[route].append(time.perf_counter() - start)
+                statuses[route][status] += 1
+
+            stop = asyncio.Event()
+            probe = asyncio.ensure_future(probe_loop_lag(lag, stop))
+            start = time.perf_counter()
+            deadline = start + args.duration
+            if args.concurrency:
+                # Closed loop: each worker sends its next request as soon as the previous one is answered
+                async def worker():
+                    while time.perf_counter() < deadline:
+                        await send(rng.choices(routes, weights)[0])
+                await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            else:
+                # Open loop: requests are started on schedule whether or not earlier ones finished
+                tasks = []
+                for i in range(int(args.rate * args.duration)):
+                    delay = start + i / args.rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    tasks.append(asyncio.ensure_future(send(rng.choices(routes, weights)[0])))
+                await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            await probe
+
+    from benchmarks.run import percentiles
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(sum(len(samples) for samples in latencies.values()) / elapsed, 3),
+        "routes": {
+            route: {
+                "requests": len(latencies[route]),
+                "errors": sum(count for status, count in statuses[route].items() if not status.startswith(("1", "2", "3"))),
+                "statuses": dict(statuses[route]),
+                "latency": percentiles(latencies[route], points=(0.5, 0.9, 0.99))
+            }
+            for route in routes if latencies[route]
+        },
+        "event_loop_lag": percentiles(lag, points=(0.5, 0.99)),
+        "fake_openai": service.stats()
+    }
+
+
+def parse_mix(mix):
+    weights = []
+    for part in mix.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route {route}, expected one of {ROUTES}")
+        weights.append((route, float(weight or 1)))
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the app in-process and report latency per route and event loop lag.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=6,sql=2,upload=1,split=1"), help=f"Route weights, out of {ROUTES}.")
+    parser.add_argument("--rate", type=float, default=20, help="Requests started per second (open loop).")
+    parser.add_argument("--concurrency", type=int, default=0, help="Concurrent clients (closed loop), overrides --rate.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load.")
+    parser.add_argument("--timeout", type=float, default=60, help="Request timeout in seconds.")
+    parser.add_argument("--chat-rows", type=int, default=2000, help="Rows in the collection searched by chat requests.")
+    parser.add_argument("--upload-documents", type=int, default=20, help="Distinct documents uploaded, repeats are duplicates.")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Latency of each fake embeddings request.")
+    parser.add_argument("--per-item-ms", type=float, default=0.5, help="Extra fake embeddings latency per input text.")
+    parser.add_argument("--chat-latency-ms", type=float, default=500, help="Latency of each fake chat completion.")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Fake OpenAI requests per second, 0 for no limit.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        from benchmarks.fakes import configure_environment
+        configure_environment(tmp_dir)
+        os.environ["MYSQL_DATABASES"] = ""  # the fake pool is installed once the lifespan has started
+        report = asyncio.get_event_loop().run_until_complete(run_load(args, tmp_dir))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
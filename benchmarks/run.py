@@ -0,0 +1,362 @@
+'''
+Offline benchmarks for ingestion, chunking, chat retrieval, schema insights and app startup.
+
+OpenAI and MySQL are replaced by the deterministic fakes in benchmarks/fakes.py, Milvus and Firebase by the local
+vector store and blob store, all kept in a temporary directory. Results are written as JSON, named after the current
+commit by default, and can be compared with an earlier run:
+
+Usage (from the repository root):
+    python -m benchmarks.run [--only ingest,chunking,chat,sql,startup] [--output results.json] [--compare baseline.json]
+'''
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+BENCHMARKS = ["ingest", "chunking", "chat", "sql", "startup"]
+STARTUP_SCRIPT = """
+import json, time, asyncio
+start = time.perf_counter()
+from main import app
+imported = time.perf_counter()
+
+async def lifespan():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+started = asyncio.get_event_loop().run_until_complete(lifespan())
+from clients import clients
+print(json.dumps({"import": imported - start, "lifespan": started - imported, "clients": clients.stats()}))
+"""
+
+
+def percentiles(samples, points=(0.5, 0.95)):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def at(p):
+        return round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 3)
+
+    summary = {"mean_ms": round(sum(samples) / len(samples) * 1000, 3)}
+    summary.update({f"p{round(p * 100)}_ms": at(p) for p in points})
+    summary["max_ms"] = at(1.0)
+    return summary
+
+
+def rate(count, seconds):
+    return round(count / seconds, 3) if seconds else None
+
+
+def clear_caches():
+    # Drop what earlier runs stored in the embedding and segment caches so the next run starts cold
+    from clients import embedding_cache, segment_cache
+    with embedding_cache()._connection() as conn:
+        conn.execute("DELETE FROM embeddings")
+    with segment_cache()._connection() as conn:
+        conn.execute("DELETE FROM segments")
+
+
+async def bench_ingest(args, tmp_dir):
+    # split_handler -> process_csv_for_insert -> vector store insert, stage by stage, then the streaming pipeline
+    import pandas as pd
+    from benchmarks.corpus import make_docx
+    from wordDoc.chunking.semantic.word import split_handler, iter_split_sections
+    from wordDoc.utils.process_data import process_csv_for_insert
+    from wordDoc.utils.pipeline import ingest_sections
+    from wordDoc.vectorstore.base import get_vector_store
+    from wordDoc.storage.base import get_blob_store
+
+    loop = asyncio.get_event_loop()
+    corpus_dir = os.path.join(tmp_dir, "corpus")
+    docs_in, docs_out = os.path.join(tmp_dir, "docs_in"), os.path.join(tmp_dir, "docs_out")
+    os.makedirs(corpus_dir)
+    os.makedirs(docs_in)
+    num_paragraphs = 0
+    for i in range(args.documents):
+        num_paragraphs += make_docx(os.path.join(corpus_dir, f"doc{i}.docx"), args.sections, seed=i)
+
+    # Upload to and download from the (local) bucket, as the API and the ingestion job do
+    start = time.perf_counter()
+    blob_store = get_blob_store()
+    for file in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, file), "rb") as f:
+            await blob_store.upload(f"wordDoc/{file}", f, "application/octet-stream")
+        await blob_store.download(f"wordDoc/{file}", os.path.join(docs_in, file))
+    transfer_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await split_handler(docs_in, docs_out)
+    split_seconds = time.perf_counter() - start
+    csv_path = os.path.join(docs_out, "combined.csv")
+    num_sections = len(pd.read_csv(csv_path))
+
+    start = time.perf_counter()
+    data = await loop.run_in_executor(None, process_csv_for_insert, csv_path, "benchmark-staged")
+    embed_seconds = time.perf_counter() - start
+
+    store = get_vector_store()
+    start = time.perf_counter()
+    await store.create("benchmark_staged")
+    await store.insert("benchmark_staged", data)
+    insert_seconds = time.perf_counter() - start
+    staged_seconds = split_seconds + embed_seconds + insert_seconds
+
+    results = {
+        "documents": args.documents,
+        "paragraphs": num_paragraphs,
+        "sections": num_sections,
+        "transfer_seconds": round(transfer_seconds, 3),
+        "staged": {
+            "split_sections_per_second": rate(num_sections, split_seconds),
+            "embed_sections_per_second": rate(num_sections, embed_seconds),
+            "insert_sections_per_second": rate(num_sections, insert_seconds),
+            "sections_per_second": rate(num_sections, staged_seconds),
+            "seconds": round(staged_seconds, 3)
+        }
+    }
+
+    # The streaming pipeline used by the ingestion jobs, first with cold caches and then re-ingesting the same corpus
+    for label, clear in (("pipeline_cold", True), ("pipeline_warm", False)):
+        if clear:
+            await loop.run_in_executor(None, clear_caches)
+        start = time.perf_counter()
+        await ingest_sections(iter_split_sections(docs_in), label, f"benchmark_{label}")
+        seconds = time.perf_counter() - start
+        results[label] = {"sections_per_second": rate(num_sections, seconds), "seconds": round(seconds, 3)}
+    return results
+
+
+async def bench_chunking(args, tmp_dir):
+    from benchmarks.corpus import make_text, make_docx, make_pdf
+    from wordDoc.chunking.brute_force.csv import chunk_text
+    from wordDoc.chunking.semantic.pdf import iter_pdf_paragraphs
+    from wordDoc.chunking.semantic.word import iter_document_sections, SEGMENT_CONCURRENCY
+
+    results = {}
+    text = make_text(args.paragraphs)
+    start = time.perf_counter()
+    chunks = chunk_text(text)
+    seconds = time.perf_counter() - start
+    results["brute_force"] = {
+        "megabytes": round(len(text.encode("utf-8")) / 1e6, 3),
+        "chunks": len(chunks),
+        "megabytes_per_second": rate(len(text.encode("utf-8")) / 1e6, seconds),
+        "chunks_per_second": rate(len(chunks), seconds)
+    }
+
+    pdf_path = os.path.join(tmp_dir, "benchmark.pdf")
+    make_pdf(pdf_path, args.pages)
+    start = time.perf_counter()
+    num_blocks = 0
+    async for _ in iter_pdf_paragraphs(pdf_path):
+        num_blocks += 1
+    extract_seconds = time.perf_counter() - start
+    results["pdf_extract"] = {"pages": args.pages, "blocks": num_blocks, "pages_per_second": rate(args.pages, extract_seconds)}
+
+    docx_path = os.path.join(tmp_dir, "benchmark.docx")
+    make_docx(docx_path, args.sections)
+    for name, path in (("pdf", pdf_path), ("docx", docx_path)):
+        for strategy in ("llm", "structure"):
+            semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+            start = time.perf_counter()
+            num_sections = 0
+            async for _ in iter_document_sections(path, semaphore, strategy):
+                num_sections += 1
+            seconds = time.perf_counter() - start
+            results[f"semantic_{name}_{strategy}"] = {"sections": num_sections, "sections_per_second": rate(num_sections, seconds), "seconds": round(seconds, 3)}
+    return results
+
+
+async def bench_chat(args, tmp_dir):
+    # Stage latencies of chat_with_pdf: embed the question, search, pack the context and stream the completion
+    from benchmarks.corpus import make_paragraphs
+    from wordDoc import routes
+    from clients import async_openai_client
+    from wordDoc.utils.process_data import aget_embedding, process_sections_for_insert
+    from wordDoc.utils.context import pack_context, CONTEXT_DEDUPLICATE
+    from wordDoc.vectorstore.base import get_vector_store
+
+    loop = asyncio.get_event_loop()
+    store = get_vector_store()
+    await store.create("benchmark_chat")
+    contents = make_paragraphs(args.chat_rows, seed=1)
+    for i in range(0, len(contents), 500):
+        data = await loop.run_in_executor(None, process_sections_for_insert, contents[i:i + 500], "benchmark-chat")
+        await store.insert("benchmark_chat", data)
+
+    output_fields = ["file_id", "content", "num_tokens"] + (["embedding"] if CONTEXT_DEDUPLICATE else [])
+    stages = {"embed": [], "search": [], "pack": [], "first_token": [], "completion": [], "total": []}
+    for question in make_paragraphs(args.questions, seed=2):
+        question = question[:200]
+        start = time.perf_counter()
+        vector = await aget_embedding(question)
+        embedded = time.perf_counter()
+        hits = await store.search("benchmark_chat", vector, "benchmark-chat", output_fields, 10)
+        searched = time.perf_counter()
+        context, _, _ = pack_context(hits)
+        packed = time.perf_counter()
+        messages = [
+            {"role": "system", "content": routes.build_system_prompt(context)},
+            {"role": "user", "content": "I want to know: " + question}
+        ]
+        first_token = None
+        completion = await async_openai_client().chat.completions.create(model=routes.chat_model, messages=messages, stream=True)
+        async for _ in completion:
+            if first_token is None:
+                first_token = time.perf_counter()
+        done = time.perf_counter()
+
+        stages["embed"].append(embedded - start)
+        stages["search"].append(searched - embedded)
+        stages["pack"].append(packed - searched)
+        stages["first_token"].append((first_token or done) - packed)
+        stages["completion"].append(done - packed)
+        stages["total"].append(done - start)
+    return {"rows": args.chat_rows, "questions": args.questions, "stages": {stage: percentiles(samples) for stage, samples in stages.items()}}
+
+
+async def bench_sql(args, tmp_dir):
+    from benchmarks.fakes import FakeMySQLPool
+    from sql.bulk import iter_bulk_insights
+    from sql.handler import TABLE_CONFIG_PATH
+    from clients import async_openai_client
+
+    tables = {f"table_{i}": [f"column_{j}" for j in range(4 + i % 12)] for i in range(args.tables)}
+    pool = FakeMySQLPool(tables, latency=args.mysql_latency_ms / 1000)
+    results = {"tables": args.tables}
+    for label in ("cold", "cached"):
+        start = time.perf_counter()
+        num_tables = 0
+        async for _ in iter_bulk_insights(pool, async_openai_client(), TABLE_CONFIG_PATH):
+            num_tables += 1
+        seconds = time.perf_counter() - start
+        results[label] = {"tables_per_second": rate(num_tables, seconds), "seconds": round(seconds, 3)}
+    return results
+
+
+async def bench_startup(args, tmp_dir):
+    # Fresh interpreters importing main and running its lifespan startup, as every uvicorn worker does.
+    # The real OpenAI clients and tokenizer are created (neither connects), MySQL is left out.
+    env = dict(os.environ, MYSQL_DATABASES="")
+    samples = {"process": [], "import": [], "lifespan": []}
+    clients = {}
+    for _ in range(args.startup_runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], env=env, check=True, capture_output=True).stdout
+        samples["process"].append(time.perf_counter() - start)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        samples["import"].append(result["import"])
+        samples["lifespan"].append(result["lifespan"])
+        for name, seconds in result["clients"].items():
+            clients.setdefault(name, []).append(seconds)
+    results = {name: percentiles(values) for name, values in samples.items()}
+    results["clients"] = {name: percentiles(values) for name, values in clients.items()}
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, threshold=0.1):
+    # Print every numeric result which moved by more than threshold compared with the baseline run
+    def walk(old, new, path):
+        if isinstance(new, dict):
+            for key, value in new.items():
+                if isinstance(old, dict) and key in old:
+                    walk(old[key], value, path + [key])
+        elif isinstance(new, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (new - old) / old
+            if abs(change) > threshold:
+                print(f"{'.'.join(path)}: {old} -> {new} ({change:+.0%})")
+
+    walk(baseline.get("results", {}), results["results"], [])
+
+
+async def run(args, tmp_dir):
+    from benchmarks.fakes import FakeOpenAIService, install_fake_openai
+    service = FakeOpenAIService(
+        embedding_latency=args.embedding_latency_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        per_item=args.per_item_ms / 1000,
+        per_token=args.per_token_ms / 1000,
+        rate=args.rate_limit
+    )
+    install_fake_openai(service)
+
+    benchmarks = {"ingest": bench_ingest, "chunking": bench_chunking, "chat": bench_chat, "sql": bench_sql, "startup": bench_startup}
+    results = {}
+    for name in args.only:
+        print(f"Running {name} benchmark")
+        start = time.perf_counter()
+        results[name] = await benchmarks[name](args, tmp_dir)
+        results[name]["wall_seconds"] = round(time.perf_counter() - start, 3)
+    return results, service.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks and write their results as JSON.")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"Comma separated benchmarks to run, out of {BENCHMARKS}.")
+    parser.add_argument("--output", default=None, help="Result file (default: benchmarks/results/<commit>.json).")
+    parser.add_argument("--compare", default=None, help="Earlier result file to compare with.")
+    parser.add_argument("--documents", type=int, default=4, help="Word documents ingested.")
+    parser.add_argument("--sections", type=int, default=40, help="Headed sections per generated Word document.")
+    parser.add_argument("--paragraphs", type=int, default=5000, help="Paragraphs of text for the brute force chunker.")
+    parser.add_argument("--pages", type=int, default=100, help="Pages of the generated PDF.")
+    parser.add_argument("--chat-rows", type=int, default=2000, help="Rows in the collection searched by the chat benchmark.")
+    parser.add_argument("--questions", type=int, default=50, help="Questions asked in the chat benchmark.")
+    parser.add_argument("--tables", type=int, default=300, help="Tables described by the sql benchmark.")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Latency of each fake embeddings request.")
+    parser.add_argument("--per-item-ms", type=float, default=0.5, help="Extra fake embeddings latency per input text.")
+    parser.add_argument("--chat-latency-ms", type=float, default=500, help="Latency of each fake chat completion.")
+    parser.add_argument("--per-token-ms", type=float, default=0, help="Delay between streamed fake completion tokens.")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Fake OpenAI requests per second, 0 for no limit.")
+    parser.add_argument("--startup-runs", type=int, default=5, help="App processes started by the startup benchmark.")
+    parser.add_argument("--mysql-latency-ms", type=float, default=1, help="Latency of each fake MySQL query.")
+    args = parser.parse_args()
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks {sorted(unknown)}")
+
+    commit = current_commit()
+    output = args.output or os.path.join("benchmarks", "results", f"{(commit or 'local')[:12]}.json")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        from benchmarks.fakes import configure_environment
+        configure_environment(tmp_dir)
+        results, openai_stats = asyncio.get_event_loop().run_until_complete(run(args, tmp_dir))
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "fake_openai": openai_stats,
+        "results": results
+    }
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+'''
+Clients of the external services, the tokenizer, the caches and the job store, one shared instance of each per process, created on first use.
+
+Importing the app connects to nothing. The lifespan in main.py creates the clients its configuration needs
+(STARTUP_CLIENTS) on a worker thread before serving, anything else is created by the first call that needs it, so
+forked workers never inherit a connection opened by their parent. Use clients.set(name, instance) to replace one,
+eg. with the fakes of the benchmarks.
+'''
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from wordDoc.vectorstore.base import VECTOR_STORE
+from wordDoc.storage.base import STORAGE_BACKEND
+from dotenv import load_dotenv
+load_dotenv()
+
+
+TOKENIZER_MODEL = "gpt-3.5-turbo"  # all the chat and embedding models used here share its cl100k_base encoding
+SEGMENT_TIMEOUT = 10.0  # seconds, the segmentation retries LLM requests which take longer
+STARTUP_CLIENTS = [name.strip() for name in os.getenv(
+    "STARTUP_CLIENTS",
+    ",".join(["openai", "async_openai", "tokenizer", "embedding_cache", "segment_cache", "job_store"] + (["milvus"] if VECTOR_STORE == "milvus" else []) + (["firebase"] if STORAGE_BACKEND == "firebase" else []))
+).split(",") if name.strip()]
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+
+    def __init__(self):
+        self._factories = {}
+        self._closers = {}
+        self._locks = {}
+        self._instances = {}
+        self._created = set()  # names of the instances made by their factory, the others are not closed by stop()
+        self.init_seconds = {}
+
+    def register(self, name, factory, close=None):
+        # close(instance) may be a coroutine function, it is called by stop()
+        self._factories[name] = factory
+        self._locks[name] = threading.Lock()
+        if close is not None:
+            self._closers[name] = close
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        # One lock per client, so a slow connection does not hold up the others
+        with self._locks[name]:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self._created.add(name)
+                self.init_seconds[name] = time.perf_counter() - start
+        return self._instances[name]
+
+    def set(self, name, instance):
+        self._instances[name] = instance
+        self._created.discard(name)
+
+    async def start(self, names=STARTUP_CLIENTS):
+        # Clients which fail to start are logged and created again on first use
+        loop = asyncio.get_event_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(None, self.get, name) for name in names), return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning("Could not start client %s: %s", name, result)
+
+    async def stop(self):
+        instances, created = self._instances, self._created
+        self._instances, self._created = {}, set()
+        for name, instance in instances.items():
+            close = self._closers.get(name)
+            if close is None or name not in created:
+                continue
+            try:
+                result = close(instance)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.warning("Could not close client %s: %s", name, e)
+
+    def stats(self):
+        return {name: round(seconds, 6) for name, seconds in self.init_seconds.items()}
+
+
+def _openai():
+    from openai import OpenAI
+    return OpenAI()
+
+
+def _async_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI()
+
+
+def _segment_openai():
+    # Same connection pool as async_openai, only the timeout differs
+    return clients.get("async_openai").with_options(timeout=SEGMENT_TIMEOUT)
+
+
+def _tokenizer():
+    import tiktoken
+    return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+
+
+def _embedding_cache():
+    # Opening it creates .cache/ and the SQLite file, which importing the app must not do
+    from wordDoc.utils.embedding_cache import EmbeddingCache
+    return EmbeddingCache()
+
+
+def _segment_cache():
+    from wordDoc.chunking.semantic.segment_cache import SegmentCache
+    return SegmentCache()
+
+
+def _job_store():
+    from wordDoc.jobs import JobStore
+    return JobStore()
+
+
+def _milvus():
+    from wordDoc.milvus.insert import connect
+    return connect()
+
+
+def _firebase():
+    from firebase.connection import connect
+    return connect()
+
+
+clients = ClientRegistry()
+clients.register("openai", _openai, close=lambda client: client.close())
+clients.register("async_openai", _async_openai, close=lambda client: client.close())
+clients.register("segment_openai", _segment_openai)  # closed with async_openai
+clients.register("tokenizer", _tokenizer)
+clients.register("embedding_cache", _embedding_cache)
+clients.register("segment_cache", _segment_cache)
+clients.register("job_store", _job_store)
+clients.register("milvus", _milvus, close=lambda connections: connections.disconnect("default"))
+clients.register("firebase", _firebase)
+
+
+def openai_client():
+    return clients.get("openai")
+
+
+def async_openai_client():
+    return clients.get("async_openai")
+
+
+def segment_openai_client():
+    return clients.get("segment_openai")
+
+
+def tokenizer():
+    return clients.get("tokenizer")
+
+
+def embedding_cache():
+    return clients.get("embedding_cache")
+
+
+def segment_cache():
+    return clients.get("segment_cache")
+
+
+def job_store():
+    return clients.get("job_store")
+
+
+def milvus():
+    return clients.get("milvus")
+
+
+def firebase():
+    return clients.get("firebase")
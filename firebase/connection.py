@@ -1,14 +1,19 @@
 import firebase_admin
 from firebase_admin import credentials, storage, db
+from collections import namedtuple
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
-cred = credentials.Certificate(os.getenv('FIREBASE_ADMIN_KEY'))
-firebase_admin.initialize_app(cred, {
-    'storageBucket': 'chuanai-c4de2.appspot.com',
-    'databaseURL': 'https://chuanai-c4de2-default-rtdb.asia-southeast1.firebasedatabase.app'
-})
+FirebaseClients = namedtuple('FirebaseClients', ['bucket', 'db_ref'])
 
-bucket = storage.bucket()
-db_ref = db.reference('/')
\ No newline at end of file
+
+def connect():
+    # Called once per process through clients.firebase(), see clients.py
+    cred = credentials.Certificate(os.getenv('FIREBASE_ADMIN_KEY'))
+    firebase_admin.initialize_app(cred, {
+        'storageBucket': 'chuanai-c4de2.appspot.com',
+        'databaseURL': 'https://chuanai-c4de2-default-rtdb.asia-southeast1.firebasedatabase.app'
+    })
+
+    return FirebaseClients(storage.bucket(), db.reference('/'))
@@ -0,0 +1,253 @@
+'''
+In-process metrics and traces, without a client library.
+
+Counters and histograms live in `registry` and are rendered in the Prometheus text format by the /metrics route of
+main.py. Every app process keeps its own numbers, scrape each uvicorn worker (or run one worker per container).
+
+`span(stage)` times a block of work into rag_stage_seconds. Work done inside a traced request or ingestion job is also
+added to its trace, which is logged as one JSON line on the "trace" logger when it ends: every request with the header
+"x-trace: 1", a TRACE_SAMPLE_RATE fraction of all requests and every job if TRACE_JOBS=1. Spans recorded from worker
+threads only reach the histograms, time the await of the executor call instead to see them in a trace.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))  # fraction of requests traced without the x-trace header
+TRACE_JOBS = os.getenv("TRACE_JOBS", "0") == "1"
+CONTENT_TYPE = "text/plain; version=0.0.4"  # starlette adds the charset
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+trace_logger = logging.getLogger("trace")
+if not trace_logger.handlers:
+    # uvicorn does not configure the root logger, give the traces a handler of their own
+    trace_logger.addHandler(logging.StreamHandler(sys.stdout))
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    # Cumulative buckets are computed at render time, observe only bumps one bucket
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [counts per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, labels=()):
+        metric = Gauge(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.histogram(
+    "rag_stage_seconds", "Time spent in each stage: download, parse, segment, embed, tokenize, insert, search, completion", ["stage"]
+)
+http_request_seconds = registry.histogram("rag_http_request_seconds", "Latency of HTTP requests until the response is sent", ["method", "route", "status"])
+openai_requests = registry.counter("rag_openai_requests_total", "OpenAI API requests", ["kind"])
+openai_tokens = registry.counter("rag_openai_tokens_total", "Tokens sent to (in) and received from (out) OpenAI", ["kind", "direction"])
+retries = registry.counter("rag_retries_total", "Retried calls", ["operation"])
+cache_lookups = registry.counter("rag_cache_lookups_total", "Cache lookups", ["cache", "result"])
+startup_seconds = registry.gauge("rag_startup_seconds", "Time taken to start this process: import of the app, lifespan startup and each client", ["phase"])
+milvus_rpc_seconds = registry.histogram("rag_milvus_rpc_seconds", "Latency of Milvus calls, measured on the Milvus executor", ["operation"])
+
+
+def record_stage(stage, seconds, **details):
+    # For work timed by the caller, eg. a generator whose time is spread over many iterations
+    stage_seconds.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["spans"].append({"stage": stage, "ms": round(seconds * 1000, 3), **details})
+
+
+@contextmanager
+def span(stage, **details):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, **details)
+
+
+def record_openai_call(kind, tokens_in=0, tokens_out=0):
+    # kind is "embeddings" or "chat", token counts are added when they are known
+    openai_requests.inc(kind=kind)
+    if tokens_in:
+        openai_tokens.inc(tokens_in, kind=kind, direction="in")
+    if tokens_out:
+        openai_tokens.inc(tokens_out, kind=kind, direction="out")
+
+
+def record_usage(kind, response):
+    # Embeddings and non streamed completions report their token usage, streamed answers are counted by the caller
+    usage = getattr(response, "usage", None)
+    record_openai_call(kind, getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+
+
+def record_cache(cache, hits, misses):
+    if hits:
+        cache_lookups.inc(hits, cache=cache, result="hit")
+    if misses:
+        cache_lookups.inc(misses, cache=cache, result="miss")
+
+
+@contextmanager
+def trace(name, enabled=True, **details):
+    # Spans recorded by this task (and the tasks it creates) until the block exits are logged as one line
+    if not enabled:
+        yield None
+        return
+    current = {"trace": name, **details, "spans": []}
+    token = _current_trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current["ms"] = round((time.perf_counter() - start) * 1000, 3)
+        trace_logger.info(json.dumps(current, default=str))
+
+
+def _route_path(scope):
+    # Label requests with the route template, not the raw path, so job ids do not make a series each
+    from starlette.routing import Match
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    # ASGI middleware timing every HTTP request until its last body chunk is sent, so streamed responses are
+    # measured in full, and tracing the sampled ones
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        traced = (b"x-trace", b"1") in scope["headers"] or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)
+        start = time.perf_counter()
+        try:
+            with trace("request", traced, method=scope["method"], path=scope["path"]) as current:
+                await self.app(scope, receive, send_and_record)
+                if current is not None:
+                    current["status"] = status[0]
+        finally:
+            http_request_seconds.observe(time.perf_counter() - start, method=scope["method"], route=_route_path(scope), status=status[0])
@@ -1,8 +1,46 @@
+import time
+import_start = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from wordDoc.routes import router as document_router
+from wordDoc.jobs import ingest_jobs
 from sql.routes import router as sql_router
+from sql.connection import pool_manager
+from clients import clients
+from instrumentation import registry, MetricsMiddleware, CONTENT_TYPE, startup_seconds
+
+import_seconds = time.perf_counter() - import_start
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Clients are created here rather than at import, once per worker process, see clients.py
+    start = time.perf_counter()
+    await clients.start()
+    await pool_manager.start()
+    await ingest_jobs.start()
+    startup_seconds.set(import_seconds, phase="import")
+    startup_seconds.set(time.perf_counter() - start, phase="lifespan")
+    for name, seconds in clients.stats().items():
+        startup_seconds.set(seconds, phase=f"client_{name}")
+    try:
+        yield
+    finally:
+        await ingest_jobs.stop()
+        await pool_manager.stop()
+        await clients.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(document_router)
 app.include_router(sql_router)
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format, see instrumentation.py
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
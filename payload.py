@@ -1,12 +1,19 @@
+from typing import List, Literal, Optional
 from pydantic import BaseModel
 
 
 class SplitDocQueryPayload(BaseModel):
     collection_name: str
     doc_path: str
+    segmentation: Optional[Literal['llm', 'structure']] = None  # defaults to SEGMENT_STRATEGY
 
 class SQLQueryPayload(BaseModel):
     table_name: str
+    database: Optional[str] = None  # one of MYSQL_DATABASES, defaults to the first
+
+class SQLBulkInsightsPayload(BaseModel):
+    database: Optional[str] = None  # one of MYSQL_DATABASES, defaults to the first
+    table_names: Optional[List[str]] = None  # every table of the database if not given
 
 class ChatWithPDFPayload(BaseModel):
     user_id: str
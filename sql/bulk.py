@@ -0,0 +1,211 @@
+'''
+Column descriptions for many tables at once, streamed back per table.
+
+The column lists of all requested tables come from one information_schema query. Tables whose cached descriptions
+are still current (see metadata_cache) are answered straight away, the others get a small data sample and are packed
+into prompts of at most SQL_BULK_PROMPT_TOKENS tokens, SQL_BULK_CONCURRENCY of which run at a time. A prompt is sent
+as soon as the samples filling it have arrived, and a table whose sample query fails gets an error of its own.
+'''
+
+import os
+import re
+import asyncio
+import aiomysql
+from clients import tokenizer
+from sql.metadata_cache import metadata_cache
+from instrumentation import span, record_usage, record_cache
+from dotenv import load_dotenv
+load_dotenv()
+
+
+SQL_BULK_PROMPT_TOKENS = int(os.getenv("SQL_BULK_PROMPT_TOKENS", 6000))  # table metadata and samples packed into one prompt
+SQL_BULK_PROMPT_COLUMNS = int(os.getenv("SQL_BULK_PROMPT_COLUMNS", 150))  # bounds the length of each answer
+SQL_BULK_CONCURRENCY = int(os.getenv("SQL_BULK_CONCURRENCY", 4))  # prompts, and separately sample queries, in flight per request
+SQL_BULK_SAMPLE_ROWS = int(os.getenv("SQL_BULK_SAMPLE_ROWS", 5))
+MAX_SAMPLE_VALUE_LEN = 100
+model = "gpt-3.5-turbo-1106"
+table_header_pattern = re.compile(r'^#+\s*`?([^`\s]+)`?\s*$')
+
+
+async def fetch_schema(cursor, table_names=None):
+    # {table name: (UPDATE_TIME, [column names])} of the current database in one query, optionally limited to table_names
+    query = """
+        SELECT c.TABLE_NAME, c.COLUMN_NAME, t.UPDATE_TIME
+        FROM information_schema.COLUMNS c
+        JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+        WHERE c.TABLE_SCHEMA = DATABASE()
+    """
+    args = ()
+    if table_names:
+        query += f" AND c.TABLE_NAME IN ({', '.join(['%s'] * len(table_names))})"
+        args = tuple(table_names)
+    await cursor.execute(query + " ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION", args)
+
+    schema = {}
+    for row in await cursor.fetchall():
+        update_time, columns = schema.setdefault(row["TABLE_NAME"], (row["UPDATE_TIME"], []))
+        columns.append(row["COLUMN_NAME"])
+    return schema
+
+
+def describe_table_block(table_name, table_description, columns, rows):
+    # Text describing one table in a packed prompt, sample values are shortened so wide text columns do not eat the budget
+    samples = [{column: str(value)[:MAX_SAMPLE_VALUE_LEN] for column, value in row.items()} for row in rows]
+    return f"### {table_name}\nDescription: {table_description}\nColumns: {columns}\nExample data: {samples}\n"
+
+
+class TablePacker:
+    # Greedily groups (table name, block text, num columns) into prompts under both budgets as the blocks arrive,
+    # a table bigger than the budget gets a prompt of its own
+
+    def __init__(self, token_budget=SQL_BULK_PROMPT_TOKENS, column_budget=SQL_BULK_PROMPT_COLUMNS):
+        self.token_budget = token_budget
+        self.column_budget = column_budget
+        self.curr, self.curr_tokens, self.curr_columns = [], 0, 0
+
+    def add(self, table_name, block, num_columns, num_tokens=None):
+        # Returns the previous pack once the block does not fit in it any more, None otherwise
+        if num_tokens is None:
+            num_tokens = len(tokenizer().encode(block, disallowed_special=()))
+        full = None
+        if self.curr and (self.curr_tokens + num_tokens > self.token_budget or self.curr_columns + num_columns > self.column_budget):
+            full = self.finish()
+        self.curr.append((table_name, block))
+        self.curr_tokens += num_tokens
+        self.curr_columns += num_columns
+        return full
+
+    def finish(self):
+        # The pack being filled, None if it is empty
+        pack = self.curr or None
+        self.curr, self.curr_tokens, self.curr_columns = [], 0, 0
+        return pack
+
+
+def pack_tables(blocks, token_budget=SQL_BULK_PROMPT_TOKENS, column_budget=SQL_BULK_PROMPT_COLUMNS):
+    # All the packs of a list of blocks at once
+    token_counts = [len(tokens) for tokens in tokenizer().encode_batch([block for _, block, _ in blocks], disallowed_special=())]
+    packer = TablePacker(token_budget, column_budget)
+    packs = [packer.add(table_name, block, num_columns, num_tokens) for (table_name, block, num_columns), num_tokens in zip(blocks, token_counts)]
+    packs.append(packer.finish())
+    return [pack for pack in packs if pack is not None]
+
+
+def parse_packed_descriptions(response):
+    # {table name: [{column: description}, ...]} from an answer made of "### <table>" sections of "<column>: <description>" lines
+    descriptions, curr = {}, None
+    for line in response.strip().split("\n"):
+        header = table_header_pattern.match(line.strip())
+        if header:
+            curr = descriptions.setdefault(header.group(1), [])
+            continue
+        key_value = line.strip().lstrip("-* ").split(": ", 1)
+        if curr is not None and len(key_value) == 2:
+            curr.append({key_value[0].strip('`'): key_value[1]})
+    return descriptions
+
+
+async def describe_pack(pack, openai_client):
+    tables = "\n".join(block for _, block in pack)
+    prompt = f"""You are given the following tables, each starting with "### <table name>", with their description, columns and some example data:
+
+    {tables}
+    Based on the given data, could you generate a description for each column of each table on what the column is about.
+    Just tell me the descriptions without further elaboration. For every table, write "### <table name>" on its own line followed by one line per column in this format: <column_name>: <column description>
+    """
+    with span("completion", tables=len(pack)):
+        completion = await openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are an expert data analyst, skilled in explaining complex SQL tables to non-business users on what the table data is about."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+    record_usage("chat", completion)
+    return parse_packed_descriptions(completion.choices[0].message.content)
+
+
+async def iter_bulk_insights(db_pool, openai_client, config_path, table_names=None):
+    # Yields {"table": ..., "descriptions": [...]} (or "error") for each table as soon as its prompt is answered
+    config = metadata_cache.config(config_path)
+    config_mtime, table_data = config if config is not None else (None, {})
+
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            schema = await fetch_schema(cursor, table_names)
+
+    for table_name in table_names or []:
+        if table_name not in schema:
+            yield {"table": table_name, "error": f"Table {table_name} does not exist"}
+
+    # Tables which have not changed since they were last described need no LLM call
+    stale = []
+    for table_name, (update_time, columns) in schema.items():
+        key = (config_path, db_pool.name, table_name)
+        cached = metadata_cache.cached(key)
+        if cached is not None and cached.config_mtime == config_mtime and cached.update_time == update_time and cached.columns == tuple(columns):
+            yield {"table": table_name, "descriptions": cached.descriptions, "cached": True}
+        else:
+            stale.append(table_name)
+    record_cache("sql_metadata", len(schema) - len(stale), len(stale))
+    if not stale:
+        return
+
+    # Separate limits, so the prompts do not queue behind the sample queries of every table
+    sample_semaphore = asyncio.Semaphore(SQL_BULK_CONCURRENCY)
+    prompt_semaphore = asyncio.Semaphore(SQL_BULK_CONCURRENCY)
+
+    async def sample(table_name):
+        async with sample_semaphore:
+            try:
+                async with db_pool.acquire() as conn:
+                    async with conn.cursor(aiomysql.DictCursor) as cursor:
+                        # The table name comes from information_schema
+                        await cursor.execute(f"SELECT * FROM `{table_name}` LIMIT {SQL_BULK_SAMPLE_ROWS}")
+                        return "sample", (table_name, await cursor.fetchall(), None)
+            except Exception as e:
+                return "sample", (table_name, None, str(e))
+
+    async def run(pack):
+        async with prompt_semaphore:
+            try:
+                return "pack", (pack, await describe_pack(pack, openai_client), None)
+            except Exception as e:
+                return "pack", (pack, {}, str(e))
+
+    packer = TablePacker()
+    pending = {asyncio.ensure_future(sample(table_name)) for table_name in stale}
+    samples_left = len(stale)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                kind, result = task.result()
+                if kind == "sample":
+                    samples_left -= 1
+                    table_name, rows, error = result
+                    if error is not None:
+                        yield {"table": table_name, "error": f"Could not sample {table_name}: {error}"}
+                    else:
+                        columns = schema[table_name][1]
+                        table_description = table_data.get(table_name, {}).get("description", "This table has no description.")
+                        full = packer.add(table_name, describe_table_block(table_name, table_description, columns, rows), len(columns))
+                        if full is not None:
+                            pending.add(asyncio.ensure_future(run(full)))
+                    if not samples_left:
+                        last = packer.finish()
+                        if last is not None:
+                            pending.add(asyncio.ensure_future(run(last)))
+                    continue
+
+                pack, descriptions, error = result
+                for table_name, _ in pack:
+                    if table_name in descriptions:
+                        update_time, columns = schema[table_name]
+                        metadata_cache.put((config_path, db_pool.name, table_name), config_mtime, update_time, columns, descriptions[table_name])
+                        yield {"table": table_name, "descriptions": descriptions[table_name], "cached": False}
+                    else:
+                        yield {"table": table_name, "error": error or "No descriptions were returned for this table"}
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,13 +1,142 @@
+import os
+import time
+import asyncio
+import logging
 import aiomysql
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from dotenv import load_dotenv
+load_dotenv()
 
-async def get_conn_pool(database, host='localhost', port=3306, user='root', password=None):
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
+MYSQL_DATABASES = [name.strip() for name in os.getenv("MYSQL_DATABASES", "employees").split(",") if name.strip()]  # the first one is the default
+MYSQL_POOL_MINSIZE = int(os.getenv("MYSQL_POOL_MINSIZE", 2))  # connections opened at startup and kept open
+MYSQL_POOL_MAXSIZE = int(os.getenv("MYSQL_POOL_MAXSIZE", 10))  # maximum number of connections that can be opened on a pool simultaneously
+MYSQL_POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE", 3600))  # seconds before an idle connection is reopened, keep below MySQL's wait_timeout
+MYSQL_ACQUIRE_TIMEOUT = float(os.getenv("MYSQL_ACQUIRE_TIMEOUT", 10))  # seconds a request waits for a free connection before failing with 503
+MYSQL_CONNECT_TIMEOUT = float(os.getenv("MYSQL_CONNECT_TIMEOUT", 5))  # seconds to open a connection, an unreachable database holds up startup that long
+logger = logging.getLogger(__name__)
+
+
+async def get_conn_pool(database, host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                        minsize=MYSQL_POOL_MINSIZE, maxsize=MYSQL_POOL_MAXSIZE, pool_recycle=MYSQL_POOL_RECYCLE,
+                        connect_timeout=MYSQL_CONNECT_TIMEOUT):
+    # aiomysql opens minsize connections before returning, so the first requests do not pay for connecting
     conn_pool = await aiomysql.create_pool(
         host=host,
         port=port,
         user=user,
         password=password,
         db=database,
-        maxsize=10  # maximum number of connections that can be opened on this pool simulatneously
+        minsize=minsize,
+        maxsize=maxsize,
+        pool_recycle=pool_recycle,
+        connect_timeout=connect_timeout
     )
 
     return conn_pool
+
+
+class ManagedPool:
+    # An aiomysql pool which records how long requests wait for a connection and how many are waiting,
+    # so pool starvation shows up in /api/sql_pool_stats instead of as slow or failing requests
+
+    def __init__(self, name, pool, acquire_timeout=MYSQL_ACQUIRE_TIMEOUT):
+        self.name = name
+        self.pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.waiters = 0
+        self.in_use = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.acquire_seconds = 0.0
+        self.max_acquire_seconds = 0.0
+        self._recent = deque(maxlen=1024)  # latest acquire latencies, for percentiles
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.waiters += 1
+        start = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(status_code=503, detail=f"No database connection available for {self.name}")
+        finally:
+            self.waiters -= 1
+
+        seconds = time.perf_counter() - start
+        self.acquired += 1
+        self.acquire_seconds += seconds
+        self.max_acquire_seconds = max(self.max_acquire_seconds, seconds)
+        self._recent.append(seconds)
+        self.in_use += 1
+        try:
+            yield conn
+        finally:
+            self.in_use -= 1
+            self.pool.release(conn)
+
+    def stats(self):
+        recent = sorted(self._recent)
+
+        def percentile(p):
+            return recent[min(int(len(recent) * p), len(recent) - 1)] * 1000 if recent else 0.0
+
+        return {
+            "size": self.pool.size,
+            "minsize": self.pool.minsize,
+            "maxsize": self.pool.maxsize,
+            "in_use": self.in_use,
+            "idle": self.pool.freesize,
+            "waiters": self.waiters,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "acquire_ms": {
+                "avg": self.acquire_seconds / self.acquired * 1000 if self.acquired else 0.0,
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": self.max_acquire_seconds * 1000
+            }
+        }
+
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+
+
+class PoolManager:
+    # Named pools, one per database in MYSQL_DATABASES, opened and closed by the app lifespan
+
+    def __init__(self, databases=MYSQL_DATABASES):
+        self.databases = databases
+        self.pools = {}
+
+    async def start(self):
+        # All the pools at once, so an unreachable database costs startup one connect timeout rather than one each
+        results = await asyncio.gather(*(get_conn_pool(database) for database in self.databases), return_exceptions=True)
+        for database, result in zip(self.databases, results):
+            if isinstance(result, BaseException):
+                # The document endpoints do not need MySQL, keep serving them and answer SQL requests with 503
+                logger.warning("Could not open a connection pool for database %s: %s", database, result)
+            else:
+                self.pools[database] = ManagedPool(database, result)
+
+    async def stop(self):
+        pools, self.pools = self.pools, {}
+        await asyncio.gather(*(pool.close() for pool in pools.values()), return_exceptions=True)
+
+    def get(self, database=None):
+        # Returns the pool of the database (the default one if None), None if it is not available
+        return self.pools.get(database or (self.databases[0] if self.databases else None))
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+pool_manager = PoolManager()
@@ -1,72 +1,102 @@
 from fastapi import HTTPException
 import aiomysql
-import os
-import json
+from sql.metadata_cache import metadata_cache
+from instrumentation import span, record_usage, record_cache
 
 
+TABLE_CONFIG_PATH = "sql/db_configs/employees.json"
 
-async def get_column_descriptions(rows, column_names, table_name, openai_client):
-    filepath = "sql/db_configs/employees.json"
-    if not os.path.exists(filepath):
-        raise HTTPException(status_code=401, detail="Table file cannot be found")
-
-    f = open(filepath)
-    table_data = json.load(f)
-    if table_name not in table_data:
-        raise HTTPException(status_code=401, detail="Table cannot be found in the database")
 
-    table_description = table_data[table_name].get("description", "This table has no description.")
-    
+async def get_column_descriptions(rows, column_names, table_name, table_description, openai_client):
     prompt = f"""You are given the following table named: {table_name}. The table has the following description: {table_description}.
     The table "{table_name}" has the following columns: {column_names}. And here are some of the example data each column has: {rows}.
     Based on the given data from the table, could you generate a description for each of the column on what the column is about.
     Just tell me the descriptions for each column without further elaboration. Present in this format: <column_name>: <column description>
     """
 
-    completion = openai_client.chat.completions.create(
-        model="gpt-3.5-turbo-1106",
-        messages=[
-            {"role": "system", "content": "You are an expert data analyst, skilled in explaining complex SQL tables to non-business users on what the table data is about."},
-            {"role": "user", "content": prompt}
-        ]
-    )
+    with span("completion", table=table_name):
+        completion = await openai_client.chat.completions.create(
+            model="gpt-3.5-turbo-1106",
+            messages=[
+                {"role": "system", "content": "You are an expert data analyst, skilled in explaining complex SQL tables to non-business users on what the table data is about."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+    record_usage("chat", completion)
 
     bot_response = completion.choices[0].message.content
     return bot_response
 
 
+def parse_column_descriptions(column_descriptions):
+    data_list = [line.split(": ", 1) for line in column_descriptions.strip().split("\n")]
+    return [{key_value[0]: key_value[1]} for key_value in data_list if len(key_value) == 2]
+
 
-async def sql_handler(table_name, db_pool, openai_client):
-    # db_pool variable has been set in main.py as global variable
+async def fetch_table_version(cursor, table_name):
+    # (UPDATE_TIME, column names) of the table, UPDATE_TIME is None for tables MySQL has no modification time for
+    await cursor.execute(
+        "SELECT UPDATE_TIME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table_name,)
+    )
+    table = await cursor.fetchone()
+    if table is None:
+        raise HTTPException(status_code=401, detail=f"Table {table_name} does not exist")
+
+    await cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+        (table_name,)
+    )
+    columns = await cursor.fetchall()
+    return table["UPDATE_TIME"], [column["COLUMN_NAME"] for column in columns]
+
+
+async def sql_handler(table_name, db_pool, openai_client, config_path=TABLE_CONFIG_PATH):
+    # db_pool is the ManagedPool of the database, opened by the app lifespan
     if db_pool is None:
         raise HTTPException(status_code=401, detail="Database connection pool is not available")
     if openai_client is None:
         raise HTTPException(status_code=401, detail="OpenAI connection is not available")
 
+    config = metadata_cache.config(config_path)
+    if config is None:
+        raise HTTPException(status_code=401, detail="Table file cannot be found")
+    config_mtime, table_data = config
+    if table_name not in table_data:
+        raise HTTPException(status_code=401, detail="Table cannot be found in the database")
+
+    key = (config_path, db_pool.name, table_name)
+    metadata = metadata_cache.get(key, config_mtime)
+    record_cache("sql_metadata", metadata is not None, metadata is None)
+    if metadata is None:
+        async with metadata_cache.lock(key):
+            # Another request may have refreshed the table while we were waiting
+            metadata = metadata_cache.get(key, config_mtime)
+            if metadata is None:
+                metadata = await refresh_table_metadata(key, config_mtime, table_data[table_name], db_pool, openai_client)
+
+    return {
+        "code": 200,
+        "descriptions": metadata.descriptions
+    }
+
+
+async def refresh_table_metadata(key, config_mtime, table_config, db_pool, openai_client):
+    _, _, table_name = key
     async with db_pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
-            try:
-                # Get all column names
-                await cursor.execute(f"SHOW COLUMNS FROM {table_name}")
-            except:
-                raise Exception(f"Table {table_name} does not exist")
-            
-            columns = await cursor.fetchall()
-            column_names = [column["Field"] for column in columns]
-
-            # Get the top 100 rows of the table
-            await cursor.execute(f"SELECT * FROM {table_name} LIMIT 100")
-            rows = await cursor.fetchall()
+            update_time, column_names = await fetch_table_version(cursor, table_name)
 
-            print(column_names, rows)
+            cached = metadata_cache.cached(key)
+            if cached is not None and cached.config_mtime == config_mtime and cached.update_time == update_time and cached.columns == tuple(column_names):
+                # Unchanged since the descriptions were generated, only restart the TTL
+                return metadata_cache.put(key, config_mtime, update_time, column_names, cached.descriptions)
 
-            # # Feed the data to ChatGPT and get descriptions for each column
-            # output is a pd dataframe with 2 columns: column_name and column_description
-            column_descriptions = await get_column_descriptions(rows, column_names, table_name, openai_client)
-            data_list =  [line.split(": ") for line in column_descriptions.strip().split("\n")]
-            data_dict_list = [{key_value[0]: key_value[1]} for key_value in data_list]
+            # Get the top 100 rows of the table, the table name was checked against information_schema above
+            await cursor.execute(f"SELECT * FROM `{table_name}` LIMIT 100")
+            rows = await cursor.fetchall()
 
-    return {
-        "code": 200,
-        "descriptions": data_dict_list
-    }
\ No newline at end of file
+    # # Feed the data to ChatGPT and get descriptions for each column
+    table_description = table_config.get("description", "This table has no description.")
+    column_descriptions = await get_column_descriptions(rows, column_names, table_name, table_description, openai_client)
+    return metadata_cache.put(key, config_mtime, update_time, column_names, parse_column_descriptions(column_descriptions))
@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import asyncio
+from collections import namedtuple
+from dotenv import load_dotenv
+load_dotenv()
+
+
+SQL_METADATA_TTL = float(os.getenv("SQL_METADATA_TTL", 60))  # seconds a cached table is served before it is checked against the database
+
+# update_time and columns identify the version of the table the descriptions were generated for
+TableMetadata = namedtuple("TableMetadata", ["config_mtime", "update_time", "columns", "descriptions", "checked_at"])
+
+
+class MetadataCache:
+    # Table configs, column lists and LLM generated column descriptions, kept in memory per process.
+    # A config is re-read when its file's mtime changes. A table's descriptions are regenerated when the config changes,
+    # or when information_schema reports a new UPDATE_TIME or a different column set, which is checked every
+    # SQL_METADATA_TTL seconds, so repeated requests for an unchanged table need neither the database nor the LLM.
+
+    def __init__(self, ttl=SQL_METADATA_TTL):
+        self.ttl = ttl
+        self._configs = {}  # path -> (mtime, parsed json)
+        self._tables = {}  # (config path, database, table name) -> TableMetadata
+        self._locks = {}
+
+    def config(self, path):
+        # Returns (mtime, table configs) of a db_configs file, None if it does not exist
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        cached = self._configs.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                cached = (mtime, json.load(f))
+            self._configs[path] = cached
+        return cached
+
+    def get(self, key, config_mtime):
+        # Cached metadata which can be served without asking the database, None if it has to be (re)validated
+        metadata = self._tables.get(key)
+        if metadata is not None and metadata.config_mtime == config_mtime and time.monotonic() - metadata.checked_at < self.ttl:
+            return metadata
+        return None
+
+    def cached(self, key):
+        return self._tables.get(key)
+
+    def put(self, key, config_mtime, update_time, columns, descriptions):
+        metadata = TableMetadata(config_mtime, update_time, tuple(columns), descriptions, time.monotonic())
+        self._tables[key] = metadata
+        return metadata
+
+    def lock(self, key):
+        # One refresh per table at a time, concurrent requests wait for it instead of all calling the LLM
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+
+metadata_cache = MetadataCache()
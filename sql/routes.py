@@ -1,6 +1,11 @@
+import json
 from fastapi import APIRouter, HTTPException
-from payload import SQLQueryPayload
-from sql.handler import sql_handler
+from fastapi.responses import StreamingResponse
+from payload import SQLQueryPayload, SQLBulkInsightsPayload
+from sql.connection import pool_manager
+from sql.handler import sql_handler, TABLE_CONFIG_PATH
+from sql.bulk import iter_bulk_insights
+from clients import async_openai_client  # async so that describing the columns does not block the event loop
 
 
 router = APIRouter()
@@ -9,9 +14,29 @@ router = APIRouter()
 @router.post("/api/sql_insights")
 async def get_sql_insights(payload: SQLQueryPayload):
     # table_name and question validation performed by FastAPI through the Pydantic library
-    global db_pool, openai_client
     table_name = payload.table_name
+    # Pools are opened by the app lifespan in main.py, one per database in MYSQL_DATABASES
+    db_pool = pool_manager.get(payload.database)
     if db_pool is None:
         raise HTTPException(status_code=503, detail="Database connection is not available")
     
-    return await sql_handler(table_name, db_pool, openai_client)
\ No newline at end of file
+    return await sql_handler(table_name, db_pool, async_openai_client())
+
+
+@router.post("/api/sql_insights/bulk")
+async def get_bulk_sql_insights(payload: SQLBulkInsightsPayload):
+    # Describes every table of the database (or the given ones), one JSON object per line as each table is done
+    db_pool = pool_manager.get(payload.database)
+    if db_pool is None:
+        raise HTTPException(status_code=503, detail="Database connection is not available")
+
+    async def generate():
+        async for result in iter_bulk_insights(db_pool, async_openai_client(), TABLE_CONFIG_PATH, payload.table_names):
+            yield json.dumps(result, default=str) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.get("/api/sql_pool_stats")
+async def sql_pool_stats():
+    return pool_manager.stats()
@@ -0,0 +1,41 @@
+'''
+Unit tests run offline: the settings point every cache, store and job database at a temporary directory before the
+app's modules are imported (they read them at import time) and the tokenizer is replaced by a word splitter, so no
+OpenAI key, tiktoken download, Milvus, MySQL or Firebase is needed.
+
+Run from the repository root with `python -m pytest tests`.
+'''
+
+import os
+import re
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import configure_environment  # noqa: E402
+
+configure_environment(tempfile.mkdtemp(prefix="ragtests"))
+
+
+class WordTokenizer:
+    # Counts words and punctuation as tokens, enough for the code paths which only need token counts. Like tiktoken,
+    # it refuses text containing a special token unless disallowed_special=() is passed.
+
+    def encode(self, text, disallowed_special="all"):
+        if disallowed_special and "<|endoftext|>" in text:
+            raise ValueError("Encountered text corresponding to disallowed special token '<|endoftext|>'")
+        return re.findall(r'\w+|[^\w\s]', text)
+
+    def encode_batch(self, texts, disallowed_special="all"):
+        return [self.encode(text, disallowed_special) for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer():
+    from clients import clients
+    clients.set("tokenizer", WordTokenizer())
+    yield
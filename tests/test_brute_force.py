@@ -0,0 +1,35 @@
+from wordDoc.chunking.brute_force.csv import chunk_directory, chunk_text, split_by_sentences
+
+
+def test_split_by_sentences_keeps_the_splitters():
+    sentences, splitters = split_by_sentences("First one. Second one?  Third")
+    assert sentences == ["First one.", "Second one?", "Third"]
+    assert "".join(s + p for s, p in zip(sentences, splitters + [""])) == "First one. Second one?  Third"
+
+
+def test_chunks_stay_under_the_token_limit_and_overlap():
+    text = " ".join(f"Sentence number {i} is here." for i in range(40))  # 6 tokens per sentence
+    chunks = chunk_text(text, token_limit=30, overlap_percentage=0.34)
+    assert len(chunks) == 8
+    assert chunks[0].startswith("Sentence number 0 is here.")
+    assert chunks[0].endswith("Sentence number 5 is here.")  # 5 sentences and the first of the next chunk
+    assert all(chunk.startswith(f" Sentence number {i * 5}") for i, chunk in enumerate(chunks) if i)
+
+
+def test_sentence_over_the_limit_falls_back_to_words():
+    chunks = chunk_text(" ".join(["word"] * 50), token_limit=20, overlap_percentage=0)
+    assert len(chunks) == 3
+    assert "".join(chunks).split() == ["word"] * 50
+
+
+def test_chunk_directory_keeps_files_with_the_same_stem_apart(tmp_path):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    (input_dir / "sub").mkdir(parents=True)
+    (input_dir / "a.txt").write_text("From the text file.")
+    (input_dir / "a.md").write_text("From the markdown file.")
+    (input_dir / "sub" / "a.txt").write_text("From the sub directory.")
+    num_chunks = chunk_directory(str(input_dir), str(output_dir), workers=1)
+    assert sum(num_chunks.values()) == 3
+    assert (output_dir / "a.txt.csv").read_text().splitlines() == ["chunks", "From the text file."]
+    assert (output_dir / "a.md.csv").read_text().splitlines() == ["chunks", "From the markdown file."]
+    assert (output_dir / "sub" / "a.txt.csv").exists()
@@ -0,0 +1,6 @@
+from wordDoc.routes import count_chat_tokens
+
+
+def test_special_token_text_is_counted_as_plain_text():
+    messages = [{"role": "system", "content": "Context here."}, {"role": "user", "content": "What is <|endoftext|>?"}]
+    assert count_chat_tokens(messages, "It ends the text <|endoftext|>") == (11, 9)
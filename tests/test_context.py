@@ -0,0 +1,50 @@
+import numpy as np
+from wordDoc.vectorstore.base import Hit
+from wordDoc.utils.context import duplicate_mask, pack_context, trim_to_sentences
+
+
+def hit(id, content, num_tokens, embedding=None):
+    return Hit(id, 0.0, {"content": content, "num_tokens": num_tokens, "embedding": embedding})
+
+
+def sentences(count, words=9):
+    # Each sentence is `words` words and a full stop, ie. words + 1 tokens for the test tokenizer
+    return " ".join(" ".join(["word"] * words) + "." for _ in range(count))
+
+
+def test_duplicate_mask_only_drops_the_lower_ranked_copy():
+    a, b = np.eye(4)[0], np.eye(4)[1]
+    near_a = a + np.array([0, 0.01, 0, 0])
+    assert duplicate_mask([a, b, near_a, b], threshold=0.95).tolist() == [False, False, True, True]
+
+
+def test_pack_context_skips_near_duplicates():
+    a, b = [1.0, 0.0], [0.0, 1.0]
+    context, ids, tokens = pack_context([hit(1, "first", 150, a), hit(2, "copy", 150, a), hit(3, "second", 150, b)], token_budget=1000)
+    assert ids == [1, 3]
+    assert context == "first\nsecond\n" and tokens == 300
+
+
+def test_chunk_too_large_does_not_stop_smaller_ones():
+    hits = [hit(1, "a", 600), hit(2, sentences(5), 900), hit(3, "c", 300)]
+    _, ids, tokens = pack_context(hits, token_budget=1000)
+    assert ids == [1, 3] and tokens == 900
+
+
+def test_last_chunk_is_cut_at_a_sentence_boundary():
+    content = sentences(30)  # 300 tokens in 30 sentences
+    context, ids, tokens = pack_context([hit(1, "a", 700), hit(2, content, 300)], token_budget=955)
+    assert ids == [1, 2]
+    assert tokens == 700 + 11 * 23  # whole sentences and a separator each, within the 255 tokens left
+    assert context.endswith("word.\n") and context.count(".") == 23
+
+
+def test_budget_left_under_the_minimum_is_not_filled():
+    _, ids, tokens = pack_context([hit(1, "a", 950), hit(2, sentences(30), 300)], token_budget=1000)
+    assert ids == [1] and tokens == 950
+
+
+def test_trim_to_sentences():
+    assert trim_to_sentences("One two. Three four five. Six.", 9) == ("One two. Three four five.", 9)
+    assert trim_to_sentences("One two. Three four five. Six.", 8) == ("One two.", 4)
+    assert trim_to_sentences("One two.", 3) == ("", 0)
@@ -0,0 +1,45 @@
+import docx
+from wordDoc.chunking.semantic.docx_reader import iter_docx_paragraphs
+
+
+def make_document(path):
+    doc = docx.Document()
+    doc.add_heading("Leave policy", 0)
+    doc.add_heading("1 Annual leave", 1)
+    doc.add_paragraph("Employees get twenty days.")
+    paragraph = doc.add_paragraph("Column one")
+    paragraph.add_run().add_tab()
+    paragraph.add_run("column two")
+    paragraph.add_run().add_break()
+    paragraph.add_run("next line")
+    table = doc.add_table(rows=1, cols=1)
+    table.cell(0, 0).text = "Inside a table"
+    doc.add_heading("1.1 Carrying over", 2)
+    doc.add_paragraph("")
+    doc.add_paragraph("Up to five days.", style="List Bullet")
+    doc.save(path)
+
+
+def test_same_paragraphs_as_python_docx(tmp_path):
+    path = str(tmp_path / "policy.docx")
+    make_document(path)
+    expected = [(p.text, p.style.name) for p in docx.Document(path).paragraphs]
+    assert [(p.text, p.style) for p in iter_docx_paragraphs(path)] == expected
+
+
+def test_text_of_tabs_and_breaks_and_no_tables(tmp_path):
+    path = str(tmp_path / "policy.docx")
+    make_document(path)
+    texts = [p.text for p in iter_docx_paragraphs(path)]
+    assert "Column one\tcolumn two\nnext line" in texts
+    assert "Inside a table" not in texts
+
+
+def test_outline_levels_come_from_the_heading_styles(tmp_path):
+    path = str(tmp_path / "policy.docx")
+    make_document(path)
+    levels = {p.text: p.outline_level for p in iter_docx_paragraphs(path)}
+    assert levels["1 Annual leave"] == 0
+    assert levels["1.1 Carrying over"] == 1
+    assert levels["Employees get twenty days."] is None
+    assert levels["Up to five days."] is None
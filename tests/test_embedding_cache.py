@@ -0,0 +1,77 @@
+import os
+from wordDoc.utils.embedding_cache import EmbeddingCache, cache_key
+
+MODEL = "text-embedding-ada-002"
+
+
+def make_cache(tmp_path, **kwargs):
+    return EmbeddingCache(path=os.path.join(tmp_path, "embeddings.sqlite3"), **kwargs)
+
+
+def last_used(cache, text):
+    row = cache._connection().execute("SELECT last_used FROM embeddings WHERE key = ?", (cache_key(MODEL, text),)).fetchone()
+    return row[0] if row else None
+
+
+def test_miss_then_hit(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get_many(MODEL, ["a", "b"]) == {}
+    cache.put_many(MODEL, ["a"], [[0.5, 1.0]], api_seconds=0.2)
+    assert cache.get_many(MODEL, ["b", "a", "a"]) == {1: [0.5, 1.0], 2: [0.5, 1.0]}
+    assert cache.hits == 2 and cache.misses == 1
+
+
+def test_whitespace_does_not_change_the_key(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put_many(MODEL, ["some  text\nhere"], [[1.0]])
+    assert cache.get_many(MODEL, ["some text here"]) == {0: [1.0]}
+    assert cache.get_many("other-model", ["some text here"]) == {}
+
+
+def test_lookups_do_not_write_until_the_usage_is_due(tmp_path):
+    cache = make_cache(tmp_path, usage_interval=3600, usage_batch=3)
+    cache.put_many(MODEL, ["a", "b", "c"], [[1.0], [2.0], [3.0]])
+    before = last_used(cache, "a")
+    conn = cache._connection()
+    changes = conn.total_changes
+
+    cache.get_many(MODEL, ["a", "missing"])
+    cache.get_many(MODEL, ["missing"])
+    assert conn.total_changes == changes
+    assert last_used(cache, "a") == before
+
+    cache.get_many(MODEL, ["b", "c"])  # third distinct key hit reaches usage_batch
+    assert last_used(cache, "a") > before
+    assert cache.stats()["total"]["hits"] == 3
+
+
+def test_stats_include_unwritten_hits(tmp_path):
+    cache = make_cache(tmp_path, usage_interval=3600)
+    cache.put_many(MODEL, ["a"], [[1.0]], api_seconds=0.5)
+    cache.get_many(MODEL, ["a", "a"])
+    stats = cache.stats()
+    assert stats["total"]["hits"] == 2 and stats["total"]["misses"] == 1
+    assert stats["process"]["estimated_seconds_saved"] == 1.0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_entries=10, usage_interval=0)
+    texts = [f"text {i}" for i in range(10)]
+    for text in texts:
+        cache.put_many(MODEL, [text], [[1.0]])
+    cache.get_many(MODEL, texts[:3])  # the oldest three become the most recently used
+
+    cache.put_many(MODEL, ["new"], [[1.0]])
+    assert cache.stats()["entries"] == 9  # evicted down to 90% of max_entries
+    kept = cache.get_many(MODEL, texts + ["new"])
+    assert sorted(kept) == [0, 1, 2, 5, 6, 7, 8, 9, 10]
+
+
+def test_eviction_counts_rows_inserted_by_other_processes(tmp_path):
+    first = make_cache(tmp_path, max_entries=10)
+    second = make_cache(tmp_path, max_entries=10)
+    first.put_many(MODEL, ["a"], [[1.0]])
+    second.put_many(MODEL, [f"text {i}" for i in range(10)], [[1.0]] * 10)
+    assert second.stats()["entries"] == 9
+    first.put_many(MODEL, [f"more {i}" for i in range(9)], [[1.0]] * 9)
+    assert first.stats()["entries"] <= 10
@@ -0,0 +1,44 @@
+from instrumentation import Registry
+
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["kind"])
+    startup = registry.gauge("startup_seconds", "Startup", ["phase"])
+    requests.inc(kind="chat")
+    requests.inc(2, kind="chat")
+    requests.inc(kind='say "hi"\n')
+    startup.set(1.5, phase="import")
+    startup.set(0.5, phase="import")
+    assert registry.render() == "\n".join([
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{kind="chat"} 3',
+        'requests_total{kind="say \\"hi\\"\\n"} 1',
+        "# HELP startup_seconds Startup",
+        "# TYPE startup_seconds gauge",
+        'startup_seconds{phase="import"} 0.5',
+    ]) + "\n"
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(1.0, 0.1))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, stage="embed")
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="embed",le="0.1"} 2',
+        'latency_seconds_bucket{stage="embed",le="1.0"} 3',
+        'latency_seconds_bucket{stage="embed",le="+Inf"} 4',
+        'latency_seconds_sum{stage="embed"} 3.65',
+        'latency_seconds_count{stage="embed"} 4',
+    ]
+
+
+def test_metrics_without_labels_or_values():
+    registry = Registry()
+    registry.counter("empty_total", "Nothing yet")
+    registry.gauge("up", "Up").set(1)
+    assert registry.render().splitlines() == ["# HELP empty_total Nothing yet", "# TYPE empty_total counter", "# HELP up Up", "# TYPE up gauge", "up 1"]
@@ -0,0 +1,111 @@
+import os
+import time
+import asyncio
+import sqlite3
+from wordDoc import jobs
+from wordDoc.jobs import JobStore, IngestJobQueue, remove_document
+from wordDoc.vectorstore.base import get_vector_store
+
+
+def make_store(tmp_path):
+    return JobStore(path=os.path.join(tmp_path, "jobs.sqlite3"))
+
+
+def expire_lease(store, job_id):
+    store._connection().execute("UPDATE jobs SET updated_at = 0 WHERE id = ?", (job_id,))
+
+
+def test_claim_takes_the_oldest_queued_job_once(tmp_path):
+    store = make_store(tmp_path)
+    first = store.create({"n": 1})
+    time.sleep(0.001)
+    second = store.create({"n": 2})
+
+    job = store.claim()
+    assert job["id"] == first and job["status"] == "running" and job["attempts"] == 1
+    assert store.get(first)["attempts"] == 1
+    assert store.claim()["id"] == second
+    assert store.claim() is None
+
+
+def test_stale_jobs_are_requeued_until_max_attempts(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.create({})
+    for attempt in range(1, 3):
+        assert store.claim()["attempts"] == attempt
+        assert store.requeue_stale(max_attempts=3) == 0  # lease still valid
+        expire_lease(store, job_id)
+        assert store.requeue_stale(max_attempts=3) == 1
+        assert store.get(job_id)["status"] == "queued"
+
+    store.claim()
+    expire_lease(store, job_id)
+    assert store.requeue_stale(max_attempts=3) == 0
+    job = store.get(job_id)
+    assert job["status"] == "failed" and "3 attempts" in job["error"]
+    assert store.claim() is None
+
+
+def test_retried_job_replaces_the_rows_of_the_crashed_attempt(tmp_path):
+    collection = "jobs_test"
+    payload = {"collection_name": collection, "doc_path": "wordDoc/doc-1234.docx"}
+    store = make_store(tmp_path)
+    vector_store = get_vector_store()
+
+    async def handler(payload, progress):
+        await vector_store.create(collection)
+        await vector_store.insert(collection, [["doc-1234"] * 3, [[1.0] + [0.0] * 1535] * 3, ["a", "b", "c"], [1, 1, 1], [0, 0, 0]])
+
+    def num_rows():
+        return len(vector_store.collection(collection)._candidate_positions("doc-1234"))
+
+    async def run():
+        queue = IngestJobQueue(store, handler=handler, workers=0, cleanup=remove_document)
+        job_id = await queue.submit(payload)
+
+        # The first attempt inserts, then its process dies before marking the job done
+        assert (await queue._store("claim"))["attempts"] == 1
+        await handler(payload, None)
+        expire_lease(store, job_id)
+        assert await queue._store("requeue_stale") == 1
+
+        job = await queue._store("claim")
+        assert job["attempts"] == 2
+        await queue._run(job)
+        return await queue.get(job_id)
+
+    job = asyncio.run(run())
+    assert job["status"] == "done"
+    assert num_rows() == 3
+
+
+def test_worker_survives_store_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "INGEST_POLL_SECONDS", 0.01)
+    store = make_store(tmp_path)
+    claim = store.claim
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_claim():
+        if failures:
+            raise failures.pop()
+        return claim()
+
+    store.claim = flaky_claim
+    done = []
+
+    async def handler(payload, progress):
+        done.append(payload)
+
+    async def run():
+        queue = IngestJobQueue(store, handler=handler, workers=1, cleanup=None)
+        await queue.start()
+        job_id = await queue.submit({"n": 1})
+        for _ in range(100):
+            if (await queue.get(job_id))["status"] == "done":
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return await queue.get(job_id)
+
+    assert asyncio.run(run())["status"] == "done"
+    assert done == [{"n": 1}] and not failures
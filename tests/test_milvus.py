@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("pymilvus")
+
+from wordDoc.milvus import registry  # noqa: E402
+from wordDoc.milvus.registry import CollectionRegistry, CollectionState  # noqa: E402
+
+
+class FakeCollection:
+
+    def __init__(self, partitions=()):
+        self.partitions = set(partitions)
+        self.checks = 0
+
+    def has_partition(self, name):
+        self.checks += 1
+        return name in self.partitions
+
+    def create_partition(self, name):
+        self.partitions.add(name)
+
+
+def make_registry(collection):
+    collection_registry = CollectionRegistry()
+    collection_registry._states["docs"] = CollectionState(collection)
+    return collection_registry
+
+
+def test_missing_partitions_are_remembered_for_a_while(monkeypatch):
+    collection = FakeCollection()
+    collection_registry = make_registry(collection)
+    assert not collection_registry.has_partition("docs", "doc_legacy")
+    assert not collection_registry.has_partition("docs", "doc_legacy")
+    assert collection.checks == 1
+
+    monkeypatch.setattr(registry, "MILVUS_MISSING_PARTITION_TTL", 0)
+    collection.partitions.add("doc_legacy")  # created by another process
+    assert collection_registry.has_partition("docs", "doc_legacy")
+    assert collection.checks == 2
+
+
+def test_creating_a_partition_ignores_the_missing_entry():
+    collection = FakeCollection()
+    collection_registry = make_registry(collection)
+    assert not collection_registry.has_partition("docs", "doc_new")
+    assert collection_registry.has_partition("docs", "doc_new", create=True)
+    assert collection_registry.has_partition("docs", "doc_new")
+    assert collection.partitions == {"doc_new"}
@@ -0,0 +1,160 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+pytest.importorskip("pymilvus")
+
+from wordDoc.milvus.registry import CollectionState, build_schema, collection_registry  # noqa: E402
+from wordDoc.milvus.insert import align_to_schema, batch_by_bytes, estimate_row_bytes  # noqa: E402
+from wordDoc.milvus.bulk_insert import BulkInserter  # noqa: E402
+
+
+class FakeCollection:
+    # Records the insert requests it gets, the schema is the app's
+
+    def __init__(self, name="docs"):
+        self.name = name
+        self.schema = build_schema()
+        self.partitions = set()
+        self.inserts = []  # (partition name, rows)
+        self.flushes = 0
+
+    def has_partition(self, name):
+        return name in self.partitions
+
+    def create_partition(self, name):
+        self.partitions.add(name)
+
+    def insert(self, batch, partition_name=None):
+        self.inserts.append((partition_name, len(batch[0])))
+
+    def flush(self):
+        self.flushes += 1
+
+    def has_index(self):
+        return True
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setitem(collection_registry._states, "docs", CollectionState(collection))
+    return collection
+
+
+def rows(file_id, count, content="text", dim=1536):
+    # Columns in the order of FIELDS
+    return [[file_id] * count, [[0.0] * dim] * count, [content] * count, [1] * count, [0] * count]
+
+
+def test_batch_by_bytes():
+    assert batch_by_bytes([4, 4, 4, 4, 4], max_bytes=10) == [(0, 2), (2, 4), (4, 5)]
+    assert batch_by_bytes([3, 20, 3, 3], max_bytes=10) == [(0, 1), (1, 2), (2, 4)]
+    assert batch_by_bytes([], max_bytes=10) == []
+
+
+def test_align_to_schema_follows_the_collection_order():
+    collection = FakeCollection()
+    aligned = align_to_schema(rows("a", 2), collection)
+    # file_id, description, embedding, content, num_tokens, page_number
+    assert aligned[0] == ["a", "a"] and aligned[1] == ["", ""] and aligned[3] == ["text", "text"]
+    assert len(aligned) == 6 and len(aligned[2][0]) == 1536
+    assert len(estimate_row_bytes(aligned, collection)) == 2
+
+
+@pytest.mark.parametrize("data,message", [
+    (rows("a", 2)[:4], "Expected the 5 columns"),
+    (rows("a", 2)[:2] + [["text"]] + rows("a", 2)[3:], "Column content has 1 rows"),
+    (rows("a", 2, dim=3), "Row 0 of embedding has 3 dimensions"),
+    (rows("a", 2, content="x" * 30001), "Row 0 of content is longer than 30000 bytes"),
+])
+def test_align_to_schema_rejects_bad_rows(data, message):
+    with pytest.raises(ValueError, match=message):
+        align_to_schema(data, FakeCollection())
+
+
+def test_writes_of_a_collection_are_coalesced_per_partition(collection):
+    inserter = BulkInserter(linger=0.05, flush_rows=10 ** 6, executor=ThreadPoolExecutor(2))
+
+    async def run():
+        await asyncio.gather(
+            inserter.insert("docs", rows("a", 2), "doc_a"),
+            inserter.insert("docs", rows("b", 3), "doc_b"),
+            inserter.insert("docs", rows("a", 4), "doc_a"),
+        )
+
+    asyncio.run(run())
+    assert sorted(collection.inserts) == [("doc_a", 6), ("doc_b", 3)]
+    assert collection.partitions == {"doc_a", "doc_b"}
+
+
+def test_large_writes_are_split_by_bytes(collection):
+    inserter = BulkInserter(batch_bytes=3 * 7000, linger=0, flush_rows=10 ** 6, executor=ThreadPoolExecutor(2))
+    asyncio.run(inserter.insert("docs", rows("a", 7), "doc_a"))
+    # A row is about 6.2KB: 1536 floats and the short strings
+    assert [count for _, count in collection.inserts] == [3, 3, 1]
+
+
+def test_bad_write_only_fails_its_caller(collection):
+    inserter = BulkInserter(linger=0.05, flush_rows=10 ** 6, executor=ThreadPoolExecutor(2))
+
+    async def run():
+        return await asyncio.gather(
+            inserter.insert("docs", rows("a", 2), "doc_a"),
+            inserter.insert("docs", rows("a", 2, dim=3), "doc_a"),
+            return_exceptions=True,
+        )
+
+    good, bad = asyncio.run(run())
+    assert good is None and isinstance(bad, ValueError)
+    assert collection.inserts == [("doc_a", 2)]
+
+
+def test_flush_does_not_wait_for_the_linger(collection):
+    inserter = BulkInserter(linger=10, flush_rows=10 ** 6, executor=ThreadPoolExecutor(2))
+
+    async def run():
+        insert = asyncio.ensure_future(inserter.insert("docs", rows("a", 2), "doc_a"))
+        await asyncio.sleep(0.01)
+        await inserter.flush("docs")
+        await asyncio.wait_for(insert, 1)
+
+    asyncio.run(run())
+    assert collection.inserts == [("doc_a", 2)]
+
+
+def test_collection_is_flushed_every_flush_rows(collection):
+    inserter = BulkInserter(linger=0, flush_rows=5, executor=ThreadPoolExecutor(2))
+
+    async def run():
+        await inserter.insert("docs", rows("a", 3), "doc_a")
+        assert collection.flushes == 0
+        await inserter.insert("docs", rows("a", 3), "doc_a")
+        assert collection.flushes == 1
+        await inserter.flush("docs")  # nothing inserted since
+
+    asyncio.run(run())
+    assert collection.flushes == 1
+
+
+def test_sending_early_cancels_the_linger_timer(collection):
+    inserter = BulkInserter(linger=0.2, flush_rows=10 ** 6, executor=ThreadPoolExecutor(2))
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        first = asyncio.ensure_future(inserter.insert("docs", rows("a", 2), "doc_a"))
+        await asyncio.sleep(0.01)
+        await inserter.flush("docs")
+        await first
+        assert not inserter._timers
+
+        # The next write waits for a linger of its own, not for what was left of the first timer
+        start = loop.time()
+        await inserter.insert("docs", rows("a", 1), "doc_a")
+        assert loop.time() - start >= 0.19
+        assert len(inserter._sends) == 1  # held until the task is done
+        await asyncio.gather(*inserter._sends)
+        assert not inserter._sends
+
+    asyncio.run(run())
+    assert collection.inserts == [("doc_a", 2), ("doc_a", 1)]
@@ -0,0 +1,19 @@
+import asyncio
+from benchmarks.corpus import make_pdf
+from wordDoc.chunking.semantic.pdf import count_pages, extract_page_range, get_extract_executor, iter_pdf_paragraphs
+
+
+def test_paragraphs_come_back_in_page_order(tmp_path):
+    path = str(tmp_path / "manual.pdf")
+    make_pdf(path, num_pages=7, paragraphs_per_page=3)
+    assert count_pages(path) == 7
+
+    async def collect():
+        # The app's pool, its workers are spawned processes
+        return [para async for para in iter_pdf_paragraphs(path, executor=get_extract_executor(), pages_per_task=2)]
+
+    paras = asyncio.run(collect())
+    assert paras == extract_page_range(path, 0, 7)
+    assert [page for _, page in paras] == sorted(page for _, page in paras)
+    assert {page for _, page in paras} == set(range(1, 8))
+    assert get_extract_executor()._mp_context.get_start_method() == "spawn"
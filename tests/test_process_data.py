@@ -0,0 +1,27 @@
+from wordDoc.utils.process_data import batch_by_token_limit
+
+
+def test_batches_stay_under_the_token_limit():
+    assert batch_by_token_limit([4, 4, 4, 4, 4], token_limit=10) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_batch_may_reach_the_limit_exactly():
+    assert batch_by_token_limit([5, 5, 5], token_limit=10) == [(0, 2), (2, 3)]
+
+
+def test_text_over_the_limit_is_sent_on_its_own():
+    assert batch_by_token_limit([3, 50, 3], token_limit=10) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_batches_respect_the_size_limit():
+    assert batch_by_token_limit([1] * 5, token_limit=100, size_limit=2) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_batches_cover_every_text_in_order():
+    counts = [7, 1, 9, 3, 3, 12, 2, 8]
+    batches = batch_by_token_limit(counts, token_limit=12)
+    assert [i for start, end in batches for i in range(start, end)] == list(range(len(counts)))
+
+
+def test_no_texts_no_batches():
+    assert batch_by_token_limit([]) == []
@@ -0,0 +1,43 @@
+import os
+from wordDoc.chunking.semantic.segment_cache import SegmentCache
+
+MODEL = "gpt-4-1106-preview"
+
+
+def make_cache(tmp_path, **kwargs):
+    return SegmentCache(path=os.path.join(tmp_path, "segments.sqlite3"), **kwargs)
+
+
+def test_miss_then_hit(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get(MODEL, 1, "【0†source】 text") is None
+    cache.put(MODEL, 1, "【0†source】  text\n", ["【0†source】"])
+    assert cache.get(MODEL, 1, "【0†source】 text") == ["【0†source】"]
+    assert cache.get(MODEL, 2, "【0†source】 text") is None
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_lookups_do_not_write_until_the_usage_is_due(tmp_path):
+    cache = make_cache(tmp_path, usage_interval=3600, usage_batch=2)
+    cache.put(MODEL, 1, "a", ["【0†source】"])
+    cache.put(MODEL, 1, "b", ["【1†source】"])
+    conn = cache._connection()
+    changes = conn.total_changes
+    cache.get(MODEL, 1, "a")
+    cache.get(MODEL, 1, "a")
+    assert conn.total_changes == changes
+    cache.get(MODEL, 1, "b")  # second distinct key reaches usage_batch
+    assert conn.total_changes == changes + 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_entries=10, usage_interval=0)
+    excerpts = [f"excerpt {i}" for i in range(10)]
+    for excerpt in excerpts:
+        cache.put(MODEL, 1, excerpt, [])
+    cache.get(MODEL, 1, excerpts[0])  # the oldest becomes the most recently used
+
+    cache.put(MODEL, 1, "new", [])
+    assert cache.stats()["entries"] == 9
+    assert cache.get(MODEL, 1, excerpts[0]) == [] and cache.get(MODEL, 1, excerpts[1]) is None
@@ -0,0 +1,174 @@
+import random
+import asyncio
+import httpx
+import openai
+from collections import deque
+from types import SimpleNamespace
+import pytest
+from benchmarks.corpus import make_paragraphs
+from benchmarks.fakes import FakeOpenAIService, FakeAsyncOpenAI
+from clients import clients
+from instrumentation import openai_tokens
+from wordDoc.chunking.semantic import word
+from wordDoc.chunking.semantic.word import iter_sections, request_section_markers, parse_section_markers
+
+
+@pytest.fixture
+def fake_llm():
+    # Picks boundaries from the text of each paragraph only, whatever excerpt it comes in
+    service = FakeOpenAIService(chat_latency=0.0)
+    clients.set("segment_openai", FakeAsyncOpenAI(service))
+    return service
+
+
+def make_document(num_paragraphs, seed):
+    # Long paragraphs with short ones in between, so some boundaries fall under min_section_len and are merged
+    rng = random.Random(seed)
+    return [text if rng.random() < 0.7 else f"Item {i}." for i, text in enumerate(make_paragraphs(num_paragraphs, seed))]
+
+
+async def sequential_sections(texts, size):
+    # The carry-over loop split_handler used before excerpts were segmented concurrently: the paragraphs after the
+    # last section boundary of an excerpt are sent again at the start of the next one. Its deque had a maxlen, which
+    # dropped paragraphs from the excerpts (and failed later) after an excerpt without boundaries, that is left out.
+    semaphore = asyncio.Semaphore(1)
+    sections = {}
+    paras = deque()
+    result = []
+    for j, text in enumerate(texts):
+        marker = f'【{j}†source】'
+        sections[marker] = text
+        paras.append(f'{marker} {text}')
+        if j == len(texts) - 1 or len(paras) >= size:
+            section_markers = await request_section_markers('\n'.join(paras), semaphore)
+            if not section_markers:
+                continue
+            section_marker_iter = iter(section_markers)
+            curr_section_marker = next(section_marker_iter)
+            curr_section_list = []
+            to_delete_markers = []
+            text_len = 0
+            try:
+                for marker, content in list(sections.items()):
+                    if marker == curr_section_marker:
+                        if curr_section_list and text_len > word.min_section_len:
+                            result.append('\n'.join(curr_section_list))
+                            curr_section_list.clear()
+                            text_len = 0
+                            for m in to_delete_markers:
+                                del sections[m]
+                                paras.popleft()
+                            to_delete_markers.clear()
+                        curr_section_marker = next(section_marker_iter)
+                    text_len += len(content)
+                    curr_section_list.append(content)
+                    to_delete_markers.append(marker)
+            except StopIteration:
+                pass
+    if sections:
+        result.append('\n'.join(sections.values()))
+    return result
+
+
+async def concurrent_sections(texts, size, overlap):
+    return [content async for content, _ in iter_sections(texts, asyncio.Semaphore(4), size=size, overlap=overlap)]
+
+
+@pytest.mark.parametrize("num_paragraphs,size,overlap", [(400, 150, 50), (230, 20, 5), (61, 30, 10), (12, 150, 50)])
+def test_same_sections_as_the_sequential_carry_over(fake_llm, num_paragraphs, size, overlap):
+    texts = make_document(num_paragraphs, seed=num_paragraphs)
+    expected = asyncio.run(sequential_sections(texts, size))
+    assert len(expected) > 1
+    assert asyncio.run(concurrent_sections(texts, size, overlap)) == expected
+
+
+def test_sections_keep_every_paragraph_in_order(fake_llm):
+    texts = make_document(300, seed=3)
+    sections = asyncio.run(concurrent_sections(texts, 40, 10))
+    assert '\n'.join(sections).split('\n') == texts
+
+
+class ScriptedLLM:
+    # Answers the segmentation requests with the given responses in turn
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, messages, model, stream=False, **kwargs):
+        content = self.responses[min(self.requests, len(self.responses) - 1)]
+        self.requests += 1
+
+        async def generate():
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+        return generate()
+
+
+def test_parse_section_markers():
+    assert parse_section_markers("```python\nsections = ['【1†source】', '【4†source】']\n```") == ['【1†source】', '【4†source】']
+    assert parse_section_markers("no code block") is None
+    assert parse_section_markers("```python\nsections = ['【1†source】',\n```") is None
+    assert parse_section_markers("```python\nsections = open('x')\n```") is None
+
+
+def test_unparseable_answers_are_retried(tmp_path):
+    llm = ScriptedLLM(["```python\nsections = ['【1†source】'\n```", "```python\nsections = ['【2†source】']\n```"])
+    clients.set("segment_openai", llm)
+    markers = asyncio.run(request_section_markers(f"【0†source】 retried {tmp_path}", asyncio.Semaphore(1)))
+    assert markers == ['【2†source】'] and llm.requests == 2
+
+
+def test_gives_up_after_max_attempts_without_caching(tmp_path):
+    llm = ScriptedLLM(["I cannot help with that."])
+    clients.set("segment_openai", llm)
+    excerpt = f"【0†source】 never answered {tmp_path}"
+
+    async def run():
+        semaphore = asyncio.Semaphore(1)
+        markers = await request_section_markers(excerpt, semaphore, max_attempts=3)
+        assert not semaphore.locked()
+        return markers
+
+    assert asyncio.run(run()) == []
+    assert llm.requests == 3
+    assert word.segment_cache().get(word.MODEL, word.PROMPT_VERSION, excerpt) is None
+
+
+def test_usage_counts_prompt_and_answer_tokens(tmp_path):
+    answer = "```python\nsections = ['【0†source】']\n```"
+    clients.set("segment_openai", ScriptedLLM([answer]))
+    excerpt = f"【0†source】 counted {tmp_path}"
+    before = dict(openai_tokens._values)
+    asyncio.run(request_section_markers(excerpt, asyncio.Semaphore(1)))
+    added = {key: value - before.get(key, 0) for key, value in openai_tokens._values.items()}
+    assert added[("chat", "out")] == len(clients.get("tokenizer").encode(answer))
+    assert added[("chat", "in")] > len(clients.get("tokenizer").encode(excerpt))
+
+
+class FailingLLM(ScriptedLLM):
+    # Raises the given errors in turn, then answers like ScriptedLLM
+
+    def __init__(self, errors, responses):
+        super().__init__(responses)
+        self.errors = list(errors)
+
+    async def create(self, messages, model, stream=False, **kwargs):
+        if self.errors:
+            self.requests += 1
+            raise self.errors.pop(0)
+        return await super().create(messages, model, stream, **kwargs)
+
+
+def test_client_errors_count_against_the_attempts(tmp_path):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    errors = [openai.APITimeoutError(request=request), openai.APIConnectionError(request=request), httpx.ReadTimeout("stalled")]
+    llm = FailingLLM(errors, ["```python\nsections = ['【0†source】']\n```"])
+    clients.set("segment_openai", llm)
+    markers = asyncio.run(request_section_markers(f"【0†source】 recovered {tmp_path}", asyncio.Semaphore(1)))
+    assert markers == ['【0†source】'] and llm.requests == 4
+
+    llm = FailingLLM([openai.APITimeoutError(request=request)] * 3, [])
+    clients.set("segment_openai", llm)
+    assert asyncio.run(request_section_markers(f"【0†source】 timed out {tmp_path}", asyncio.Semaphore(1), max_attempts=3)) == []
+    assert llm.requests == 3
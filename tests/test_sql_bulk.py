@@ -0,0 +1,91 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+from benchmarks.fakes import FakeMySQLPool, FakeMySQLCursor, FakeOpenAIService, FakeAsyncOpenAI
+from sql.bulk import pack_tables, parse_packed_descriptions, iter_bulk_insights
+
+
+def block(name, num_tokens, num_columns):
+    # A block of num_tokens words for the test tokenizer
+    return (name, " ".join(["word"] * num_tokens), num_columns)
+
+
+def test_pack_tables_respects_both_budgets():
+    blocks = [block("a", 40, 2), block("b", 40, 2), block("c", 40, 2), block("d", 10, 9), block("e", 10, 1)]
+    packs = pack_tables(blocks, token_budget=100, column_budget=10)
+    assert [[name for name, _ in pack] for pack in packs] == [["a", "b"], ["c"], ["d", "e"]]
+
+
+def test_pack_tables_gives_oversized_tables_their_own_prompt():
+    blocks = [block("a", 10, 1), block("big", 500, 1), block("c", 10, 1)]
+    packs = pack_tables(blocks, token_budget=100, column_budget=10)
+    assert [[name for name, _ in pack] for pack in packs] == [["a"], ["big"], ["c"]]
+    assert pack_tables([], token_budget=100, column_budget=10) == []
+
+
+def test_parse_packed_descriptions():
+    response = """Here you go:
+### `orders`
+- id: The order number
+* `total`: Amount paid: taxes included
+## customers
+name: Customer name
+not a column line
+"""
+    assert parse_packed_descriptions(response) == {
+        "orders": [{"id": "The order number"}, {"total": "Amount paid: taxes included"}],
+        "customers": [{"name": "Customer name"}],
+    }
+
+
+class SamplingPool(FakeMySQLPool):
+    # Sample queries of the `slow` tables wait that many more seconds, those of the `broken` tables fail
+
+    def __init__(self, tables, slow=None, broken=()):
+        super().__init__(tables, name=f"bulk{id(self)}", latency=0.0)
+        self.slow = slow or {}
+        self.broken = set(broken)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield SimpleNamespace(cursor=lambda *args: SamplingCursor(self))
+
+
+class SamplingCursor(FakeMySQLCursor):
+
+    async def execute(self, query, args=()):
+        for name, delay in self.database.slow.items():
+            if f"FROM `{name}`" in query:
+                await asyncio.sleep(delay)
+        for name in self.database.broken:
+            if f"FROM `{name}`" in query:
+                raise RuntimeError("Lost connection")
+        await super().execute(query, args)
+
+
+async def collect(pool, tmp_path):
+    started = time.monotonic()
+    results = []
+    async for result in iter_bulk_insights(pool, FakeAsyncOpenAI(FakeOpenAIService(chat_latency=0.0)), str(tmp_path / "missing.json")):
+        results.append((time.monotonic() - started, result))
+    return results
+
+
+def test_failed_sample_is_a_table_error(tmp_path):
+    pool = SamplingPool({"a": ["id", "name"], "b": ["id"], "c": ["id", "total"]}, broken={"b"})
+    results = {result["table"]: result for _, result in asyncio.run(collect(pool, tmp_path))}
+    assert results["b"]["error"] == "Could not sample b: Lost connection"
+    assert results["a"]["descriptions"] == [{"id": "Values of id"}, {"name": "Values of name"}]
+    assert results["c"]["descriptions"] == [{"id": "Values of id"}, {"total": "Values of total"}]
+
+
+def test_prompts_start_before_every_sample_is_back(tmp_path):
+    # Tables of 100 columns do not share a prompt, the first ones are described while the slow sample is running
+    columns = [f"col{i}" for i in range(100)]
+    pool = SamplingPool({"a": columns, "b": columns, "c": columns, "slow": columns}, slow={"slow": 0.5})
+    results = asyncio.run(collect(pool, tmp_path))
+    assert sorted(result["table"] for _, result in results) == ["a", "b", "c", "slow"]
+    assert all("descriptions" in result for _, result in results)
+    elapsed, first = results[0]
+    assert first["table"] != "slow" and elapsed < 0.4
@@ -0,0 +1,22 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from sql import connection
+from sql.connection import PoolManager
+
+
+def test_pools_are_opened_concurrently_and_failures_are_skipped(monkeypatch):
+    async def get_conn_pool(database):
+        await asyncio.sleep(0.2)
+        if database == "unreachable":
+            raise OSError("Can't connect to MySQL server")
+        return SimpleNamespace(database=database)
+
+    monkeypatch.setattr(connection, "get_conn_pool", get_conn_pool)
+    manager = PoolManager(["employees", "unreachable", "sales"])
+    start = time.perf_counter()
+    asyncio.run(manager.start())
+    assert time.perf_counter() - start < 0.5
+    assert sorted(manager.pools) == ["employees", "sales"]
+    assert manager.get().pool.database == "employees"
+    assert manager.get("unreachable") is None
@@ -0,0 +1,33 @@
+import asyncio
+from wordDoc.chunking.semantic.structure import heading_level, iter_structure_sections
+
+BODY = "The policy applies to every employee of the company and to contractors working on site for more than a month, from their first day."
+
+
+def test_heading_level():
+    assert heading_level("anything", outline_level=2) == 2
+    assert heading_level("Annual leave", style="Heading 1") == 0
+    assert heading_level("Leave policy", style="Title") == 0
+    assert heading_level("2.3 Installation") == 1
+    assert heading_level("4 Scope") == 0
+    assert heading_level("2.3 Installation is done by the IT department.") is None  # a sentence, not a heading
+    assert heading_level("12 employees took leave") is None
+    assert heading_level(BODY) is None
+
+
+def test_sections_start_at_headings():
+    paragraphs = [("1 Scope", 1), (BODY, 1), (BODY, 2), ("2 Leave", 2), ("2.1 Annual", 3), (BODY, 3), ("3 End", 4), (BODY, 4)]
+
+    async def run():
+        async def source():
+            for text, page in paragraphs:
+                yield text, page, heading_level(text)
+        return [section async for section in iter_structure_sections(source())]
+
+    sections = asyncio.run(run())
+    # "2 Leave" is too short to stand alone and is kept with its first subsection
+    assert sections == [
+        ("\n".join(["1 Scope", BODY, BODY]), 1),
+        ("\n".join(["2 Leave", "2.1 Annual", BODY]), 2),
+        ("\n".join(["3 End", BODY]), 4)
+    ]
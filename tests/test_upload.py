@@ -0,0 +1,44 @@
+import asyncio
+import hashlib
+import httpx
+import pytest
+from main import app
+from wordDoc.storage.base import get_blob_store
+
+
+def post(files=None, **kwargs):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/api/upload_doc", files=files, **kwargs)
+    return asyncio.run(run())
+
+
+def test_upload_is_stored_once_per_content(tmp_path):
+    content = b"PK\x03\x04 not really a docx " + bytes(range(256)) * 4000  # crosses several network chunks
+    first = post({"file": ("policy.docx", content, "application/octet-stream")}).json()
+    second = post({"file": ("renamed.docx", content, "application/octet-stream")}).json()
+    assert first["duplicate"] is False
+    assert second == {**first, "duplicate": True}
+
+    local_path = str(tmp_path / "copy.docx")
+    asyncio.run(get_blob_store().download(f"wordDoc/{first['file_uuid']}.docx", local_path))
+    with open(local_path, "rb") as f:
+        assert hashlib.sha256(f.read()).digest() == hashlib.sha256(content).digest()
+
+
+def test_other_fields_are_ignored():
+    content = b"%PDF-1.4 another document"
+    response = post({"comment": (None, "hello"), "file": ("report.pdf", content, "application/pdf")}, data={"x": "1"})
+    assert response.json()["duplicate"] is False
+
+
+@pytest.mark.parametrize("files,status", [
+    ({"file": ("notes.txt", b"plain text", "text/plain")}, 401),
+    ({"other": ("policy.docx", b"data", "application/octet-stream")}, 422)
+])
+def test_rejected_uploads(files, status):
+    assert post(files).status_code == status
+
+
+def test_body_must_be_multipart():
+    assert post(content=b"{}", headers={"content-type": "application/json"}).status_code == 400
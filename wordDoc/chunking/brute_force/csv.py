@@ -5,38 +5,36 @@ In extreme cases of badly formatted docs (eg. the whole doc is a sentence and ha
 the "sentence" will be broken down into words and even characters if needed.
 Token limit (approx) for each chunk is set with TOKEN_LIMIT.
 Don't set TOKEN_LIMIT too close to model limit, eg. if model limit is 4096, TOKEN_LIMIT should be <= 3800.
+
+Every sentence is tokenized once (with encode_batch) and its token count is carried along with it,
+the overlap between chunks is then computed from those counts instead of re-encoding the next chunk.
+
+Usage (from the repository root, so this file does not shadow the standard csv module):
+    python -m wordDoc.chunking.brute_force.csv <input_file_or_dir> <output_file_or_dir> [--workers N]
 '''
 
+import os
 import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import regex as re
-import tiktoken
 import pandas as pd
-
-parser = argparse.ArgumentParser(
-    description="Preprocess a given file and output to a directory."
-)
-parser.add_argument("input_file", help="Path to the input file.")
-parser.add_argument("output_file", help="Path to the output directory.")
-args = parser.parse_args()
-
-input_file = args.input_file
-output_file = args.output_file
-model = 'gpt-3.5-turbo'
-enc = tiktoken.encoding_for_model(model)  # For counting tokens when feeding the corresponding text into model
+from clients import tokenizer  # loaded once per worker process, on its first use
 
 TOKEN_LIMIT = 1000           # Max token length for each chunk
-WORD_LIMIT = TOKEN_LIMIT     # For splitting single "sentence" into word units if the sentence by itself is longer than token limit (likely badly formatted document)
-CHAR_LIMIT = WORD_LIMIT * 4  # For splitting single "word" into characters units if the word length is longer than word limit (likely badly formatted document)
+OVERLAP_PERCENTAGE = 0.34
 
+# Regex pattern for matching "sentence splitters", eg. '!' characters
+sent_splitter = re.compile(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!\:)\s+|\p{Cc}+|\p{Cf}+')
 
-OVERLAP_PERCENTAGE = 0.34
-OVERLAP_TOKEN_LIMIT = int(TOKEN_LIMIT * OVERLAP_PERCENTAGE)
-OVERLAP_WORD_LIMIT = OVERLAP_TOKEN_LIMIT
-OVERLAP_CHAR_LIMIT = OVERLAP_WORD_LIMIT * 4
+# token: max token length of a chunk
+# word: for splitting single "sentence" into word units if the sentence by itself is longer than token limit (likely badly formatted document)
+# char: for splitting single "word" into characters units if the word length is longer than word limit (likely badly formatted document)
+ChunkLimits = namedtuple('ChunkLimits', ['token', 'word', 'char'])
 
 
-# Regex pattern for matching "sentence splitters", eg. '!' characters
-sent_splitter = re.compile('(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!\:)\s+|\p{Cc}+|\p{Cf}+')
+def make_limits(token_limit):
+    return ChunkLimits(token_limit, token_limit, token_limit * 4)
 
 
 def split_by_sentences(text):
@@ -52,63 +50,110 @@ def split_by_sentences(text):
     return sentences, split_patterns
 
 
-def split_by_words_limit(text, limit=WORD_LIMIT):
+def split_by_words_limit(text, limits):
     words = text.split(' ')
-    chunks = list(' '.join(words[i: i + limit]) for i in range(0, len(words), limit))
+    chunks = list(' '.join(words[i: i + limits.word]) for i in range(0, len(words), limits.word))
     return chunks, [' ' for _ in range(len(chunks) - 1)]
 
 
-def split_by_chars_limit(text, limit=CHAR_LIMIT):
-    chunks = list(text[i: i + limit] for i in range(0, len(text), limit))
+def split_by_chars_limit(text, limits):
+    chunks = list(text[i: i + limits.char] for i in range(0, len(text), limits.char))
     return chunks, ['' for _ in range(len(chunks) - 1)]
 
 
-def update_chunks(chunks, curr_chunk, curr_len, texts, split_patterns=[], fallback_splitter=[]):
-    for i, text in enumerate(texts):
-        if i > 0:
-            text = split_patterns[i - 1] + text
-        text_len = len(enc.encode(text))
-        if text_len + curr_len > TOKEN_LIMIT:
+FALLBACK_SPLITTERS = (split_by_words_limit, split_by_chars_limit)
+
+
+def to_pieces(texts, split_patterns):
+    # Re-attach each splitter to the text after it and count the tokens of all pieces in one batch
+    texts = [text if i == 0 else split_patterns[i - 1] + text for i, text in enumerate(texts)]
+    return list(zip(texts, (len(tokens) for tokens in tokenizer().encode_batch(texts, disallowed_special=()))))
+
+
+def update_chunks(chunks, curr_chunk, curr_len, pieces, limits, fallback_splitter=FALLBACK_SPLITTERS):
+    # pieces are (text, num_tokens) pairs, chunks and curr_chunk are lists of pieces
+    for text, text_len in pieces:
+        if text_len + curr_len > limits.token:
             if curr_chunk:
-                chunks.append(''.join(curr_chunk))
+                chunks.append(curr_chunk)
             # Fallback logic if single text exceeding token limit
-            if text_len > TOKEN_LIMIT and fallback_splitter:
+            if text_len > limits.token and fallback_splitter:
                 splitter = fallback_splitter[0]
-                curr_chunk, curr_len = update_chunks(chunks, [], 0, *splitter(text), fallback_splitter[1:])
+                curr_chunk, curr_len = update_chunks(chunks, [], 0, to_pieces(*splitter(text, limits)), limits, fallback_splitter[1:])
                 if curr_chunk:
-                    chunks.append(''.join(curr_chunk))
+                    chunks.append(curr_chunk)
                     curr_chunk = []
                     curr_len = 0
             else:
-                curr_chunk = [text]
+                curr_chunk = [(text, text_len)]
                 curr_len = text_len
         else:
-            curr_chunk.append(text)
+            curr_chunk.append((text, text_len))
             curr_len += text_len
     return curr_chunk, curr_len
 
 
-chunks = []
-with open(input_file) as f:
-    doc = f.read()
-    sentences, split_patterns = split_by_sentences(doc)
-    curr_chunk, curr_len = update_chunks(chunks, [], 0, sentences, split_patterns, fallback_splitter=[split_by_words_limit, split_by_chars_limit])
+def chunk_text(doc, token_limit=TOKEN_LIMIT, overlap_percentage=OVERLAP_PERCENTAGE):
+    limits = make_limits(token_limit)
+    chunks = []
+    curr_chunk, curr_len = update_chunks(chunks, [], 0, to_pieces(*split_by_sentences(doc)), limits)
     if curr_chunk:  # Left over chunk not appended
-        chunks.append(''.join(curr_chunk))
+        chunks.append(curr_chunk)
 
-    if OVERLAP_PERCENTAGE > 0:
-        TOKEN_LIMIT = OVERLAP_TOKEN_LIMIT
-        WORD_LIMIT = OVERLAP_WORD_LIMIT
-        CHAR_LIMIT = OVERLAP_CHAR_LIMIT
-        for i, chunk in enumerate(chunks[:-1]):
+    texts = [''.join(text for text, _ in chunk) for chunk in chunks]
+    if overlap_percentage > 0:
+        # Append the start of the next chunk to every chunk, reusing the token counts of its pieces
+        overlap_limits = make_limits(int(token_limit * overlap_percentage))
+        for i, next_chunk in enumerate(chunks[1:]):
             overlap_chunks = []
-            chunk_sentences, chunk_split_patterns = split_by_sentences(chunks[i + 1])
-            curr_chunk, curr_len = update_chunks(overlap_chunks, [], 0, chunk_sentences, chunk_split_patterns, fallback_splitter=[split_by_words_limit, split_by_chars_limit])
+            curr_chunk, _ = update_chunks(overlap_chunks, [], 0, next_chunk, overlap_limits)
             if curr_chunk:
-                overlap_chunks.append(''.join(curr_chunk))
+                overlap_chunks.append(curr_chunk)
             if overlap_chunks:
-                chunks[i] = ''.join([chunk, overlap_chunks[0]])
+                texts[i] = ''.join([texts[i], *(text for text, _ in overlap_chunks[0])])
+    return texts
+
+
+def chunk_file(input_file, output_file, token_limit=TOKEN_LIMIT, overlap_percentage=OVERLAP_PERCENTAGE):
+    with open(input_file) as f:
+        chunks = chunk_text(f.read(), token_limit, overlap_percentage)
+
+    df = pd.DataFrame(chunks, columns=['chunks'])
+    df.to_csv(output_file, index=False)
+    return len(df)
+
+
+def chunk_directory(input_dir, output_dir, workers=None, token_limit=TOKEN_LIMIT, overlap_percentage=OVERLAP_PERCENTAGE):
+    # Chunk every file under input_dir on a process pool, writing <output_dir>/<relative path>.csv for each
+    jobs = []
+    for root, _, files in os.walk(input_dir):
+        outdir = os.path.join(output_dir, os.path.relpath(root, input_dir))
+        os.makedirs(outdir, exist_ok=True)
+        for file in files:
+            jobs.append((os.path.join(root, file), os.path.join(outdir, f'{file}.csv')))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(chunk_file, input_file, output_file, token_limit, overlap_percentage) for input_file, output_file in jobs]
+        return {input_file: future.result() for (input_file, _), future in zip(jobs, futures)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Preprocess a given file (or every file in a directory) and output to a file (or directory)."
+    )
+    parser.add_argument("input_file", help="Path to the input file or directory.")
+    parser.add_argument("output_file", help="Path to the output file or directory.")
+    parser.add_argument("--token-limit", type=int, default=TOKEN_LIMIT, help="Max token length for each chunk.")
+    parser.add_argument("--overlap", type=float, default=OVERLAP_PERCENTAGE, help="Fraction of the token limit taken from the next chunk.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used in directory mode (default: number of cores).")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input_file):
+        num_chunks = chunk_directory(args.input_file, args.output_file, args.workers, args.token_limit, args.overlap)
+        print(f'No. of files: {len(num_chunks)}, No. of chunks: {sum(num_chunks.values())}')
+    else:
+        print(f'No. of chunks: {chunk_file(args.input_file, args.output_file, args.token_limit, args.overlap)}')
+
 
-df = pd.DataFrame(chunks, columns=['chunks'])
-df.to_csv(output_file, index=False)
-print(f'No. of chunks: {len(df)}')
+if __name__ == '__main__':
+    main()
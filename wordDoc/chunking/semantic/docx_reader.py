@@ -0,0 +1,109 @@
+'''
+Streaming paragraph reader for .docx files.
+
+python-docx parses the whole of word/document.xml into an object tree before the first paragraph can be read.
+Here word/document.xml is read straight out of the zip with an incremental parser and every body paragraph is
+dropped from the tree as soon as it has been yielded, so memory stays flat however large the document is.
+Images and other parts of the package are never opened, so they are not decompressed either.
+
+The text and style names match python-docx's Document(path).paragraphs: only paragraphs directly in the body are
+read (not those inside tables or text boxes) and the text is made of the w:t, w:tab, w:br and w:cr children of
+the paragraph's runs.
+'''
+
+import zipfile
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DOCUMENT_PART = 'word/document.xml'
+STYLES_PART = 'word/styles.xml'
+
+# python-docx shows these built-in style names capitalised, as Word's UI does
+STYLE_ALIASES = {'caption': 'Caption', 'footer': 'Footer', 'header': 'Header'}
+STYLE_ALIASES.update({f'heading {i}': f'Heading {i}' for i in range(1, 10)})
+
+# outline_level is the paragraph's level in the document outline (0 for top level headings), None for body text
+DocxParagraph = namedtuple('DocxParagraph', ['text', 'style', 'outline_level'])
+
+
+def _outline_level(ppr):
+    # w:outlineLvl 9 is Word's "Body Text" level
+    level = ppr.find(W + 'outlineLvl') if ppr is not None else None
+    if level is None:
+        return None
+    level = int(level.get(W + 'val', 9))
+    return level if level < 9 else None
+
+
+def read_paragraph_styles(archive):
+    # Map the paragraph style ids to their (name, outline level), styles.xml is small so it is parsed in one go
+    styles, based_on, default_id = {}, {}, None
+    if STYLES_PART not in archive.namelist():
+        return styles, (None, None)
+    with archive.open(STYLES_PART) as f:
+        for _, elem in iterparse(f):
+            if elem.tag == W + 'style' and elem.get(W + 'type') == 'paragraph':
+                style_id = elem.get(W + 'styleId')
+                name = elem.find(W + 'name')
+                name = name.get(W + 'val') if name is not None else None
+                parent = elem.find(W + 'basedOn')
+                if parent is not None:
+                    based_on[style_id] = parent.get(W + 'val')
+                styles[style_id] = (STYLE_ALIASES.get(name, name), _outline_level(elem.find(W + 'pPr')))
+                if elem.get(W + 'default') in ('1', 'true', 'on'):
+                    default_id = style_id
+                elem.clear()
+
+    # Styles without an outline level of their own inherit the one of the style they are based on
+    def inherited_level(style_id, seen=()):
+        name, level = styles.get(style_id, (None, None))
+        if level is None and style_id in based_on and style_id not in seen:
+            return inherited_level(based_on[style_id], seen + (style_id,))
+        return level
+
+    styles = {style_id: (name, inherited_level(style_id)) for style_id, (name, _) in styles.items()}
+    return styles, styles.get(default_id, (None, None))
+
+
+def _run_text(run, parts):
+    for child in run:
+        if child.tag == W + 't':
+            parts.append(child.text or '')
+        elif child.tag == W + 'tab':
+            parts.append('\t')
+        elif child.tag in (W + 'br', W + 'cr'):
+            parts.append('\n')
+
+
+def iter_docx_paragraphs(doc_inpath):
+    # Yield a DocxParagraph(text, style, outline_level) for every paragraph of the document body, in order
+    with zipfile.ZipFile(doc_inpath) as archive:
+        styles, default_style = read_paragraph_styles(archive)
+        with archive.open(DOCUMENT_PART) as f:
+            depth = 0
+            body = None
+            for event, elem in iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and elem.tag == W + 'body':
+                        body = elem
+                    continue
+
+                depth -= 1
+                # depth 2 elements are the children of w:body, by now they are complete
+                if depth == 2 and body is not None:
+                    if elem.tag == W + 'p':
+                        parts = []
+                        for run in elem.iterfind(W + 'r'):
+                            _run_text(run, parts)
+                        ppr = elem.find(W + 'pPr')
+                        style_id = ppr.find(W + 'pStyle') if ppr is not None else None
+                        style, level = styles.get(style_id.get(W + 'val'), default_style) if style_id is not None else default_style
+                        # direct formatting on the paragraph wins over its style
+                        direct_level = ppr.find(W + 'outlineLvl') if ppr is not None else None
+                        if direct_level is not None:
+                            level = _outline_level(ppr)
+                        yield DocxParagraph(''.join(parts), style, level)
+                    # Drop what has been read so the tree never grows past one paragraph or table
+                    body.clear()
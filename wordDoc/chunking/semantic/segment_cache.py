@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import hashlib
+from wordDoc.utils.embedding_cache import normalize_text
+from wordDoc.utils.sqlite_cache import SQLiteCache, USAGE_BATCH
+from dotenv import load_dotenv
+load_dotenv()
+
+
+SEGMENT_CACHE_PATH = os.getenv("SEGMENT_CACHE_PATH", os.path.join(".cache", "segments.sqlite3"))
+SEGMENT_CACHE_MAX_ENTRIES = int(os.getenv("SEGMENT_CACHE_MAX_ENTRIES", 50000))
+SEGMENT_CACHE_USAGE_INTERVAL = float(os.getenv("SEGMENT_CACHE_USAGE_INTERVAL", 30))  # seconds between writes of last_used
+
+
+def segment_cache_key(model, prompt_version, excerpt):
+    return hashlib.sha256(f"{model}\0{prompt_version}\0{normalize_text(excerpt)}".encode("utf-8")).hexdigest()
+
+
+class SegmentCache(SQLiteCache):
+    # Section markers returned by the LLM for each excerpt, stored in SQLite the same way as the embedding cache.
+    # Excerpts are numbered from 0 in every window, so an unchanged window hits even when the paragraphs before it changed.
+
+    table = "segments"
+
+    def __init__(self, path=SEGMENT_CACHE_PATH, max_entries=SEGMENT_CACHE_MAX_ENTRIES,
+                 usage_interval=SEGMENT_CACHE_USAGE_INTERVAL, usage_batch=USAGE_BATCH):
+        self.hits = 0
+        self.misses = 0
+        super().__init__(path, max_entries, usage_interval, usage_batch)
+
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS segments (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                markers TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used)")
+
+    def get(self, model, prompt_version, excerpt):
+        # Returns the cached section markers of the excerpt, None if it was never segmented
+        key = segment_cache_key(model, prompt_version, excerpt)
+        row = self._connection().execute("SELECT markers FROM segments WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        self._record_usage([key], 1)
+        return json.loads(row[0])
+
+    def put(self, model, prompt_version, excerpt, markers):
+        key = segment_cache_key(model, prompt_version, excerpt)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO segments (key, model, markers, last_used) VALUES (?, ?, ?, ?)",
+                (key, model, json.dumps([str(marker) for marker in markers]), time.time())
+            )
+            self._write_usage(conn)
+            self._evict(conn, 1)
+
+    def stats(self):
+        conn = self._connection()
+        with conn:
+            self._write_usage(conn)
+        entries = self._count(conn)
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
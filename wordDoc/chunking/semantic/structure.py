@@ -0,0 +1,115 @@
+'''
+LLM-free segmentation, selected with SEGMENT_STRATEGY=structure (or "segmentation": "structure" in the split_doc payload).
+
+Sections start at headings: paragraphs with an outline level (Word's heading styles and anything the author put in
+the navigation pane) or short numbered lines such as "2.3 Installation" for documents without styles, like PDFs.
+Stretches without headings that grow past max_section_len are cut where the vocabulary of neighbouring paragraphs
+changes the most, comparing hashed bag-of-words vectors, so no model or network call is needed and a document is
+segmented in milliseconds.
+'''
+
+import os
+import re
+import zlib
+import numpy as np
+
+max_section_len = int(os.getenv('STRUCTURE_MAX_SECTION_LEN', 4000))  # characters, longer sections are cut at similarity drops
+min_section_len = 128  # sections shorter than this are merged into the next one, as in the LLM strategy
+similarity_window = 3  # paragraphs compared on each side of a possible cut
+hash_dim = 2048
+max_block_paras = 150  # paragraphs buffered without a heading before the buffer is cut
+word_pattern = re.compile(r'\w+')
+numbered_heading_pattern = re.compile(r'^(\d+(?:\.\d+)*)\.?\s+[A-Z]')
+heading_style_pattern = re.compile(r'^(?:Heading (\d)|Title)$')
+max_heading_len = 120
+
+
+def heading_level(text, outline_level=None, style=None):
+    # Outline level of a paragraph which starts a section, None for body text
+    if outline_level is not None:
+        return outline_level
+    match = heading_style_pattern.match(style or '')
+    if match:
+        return int(match.group(1)) - 1 if match.group(1) else 0
+    match = numbered_heading_pattern.match(text)
+    if match and len(text) <= max_heading_len and not text.rstrip().endswith(('.', ':', ';', ',')):
+        return match.group(1).count('.')
+    return None
+
+
+def hashed_vectors(texts):
+    # Unit length bag-of-words vectors, words are hashed into hash_dim buckets
+    vectors = np.zeros((len(texts), hash_dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        buckets = [zlib.crc32(word.encode()) % hash_dim for word in word_pattern.findall(text.lower())]
+        np.add.at(vectors[i], buckets, 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+def gap_similarities(texts):
+    # similarities[i] compares the paragraphs just before paragraph i + 1 with those starting at it
+    vectors = hashed_vectors(texts)
+    totals = np.vstack([np.zeros((1, hash_dim), dtype=np.float32), np.cumsum(vectors, axis=0)])
+    gaps = np.arange(1, len(texts))
+    left = totals[gaps] - totals[np.maximum(gaps - similarity_window, 0)]
+    right = totals[np.minimum(gaps + similarity_window, len(texts))] - totals[gaps]
+    norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+    return np.einsum('ij,ij->i', left, right) / np.maximum(norms, 1e-9)
+
+
+def split_block(texts):
+    # Cut texts into (start, end) ranges of at most max_section_len characters where possible, always cutting at the
+    # least similar gap which leaves at least min_section_len characters on both sides
+    if not texts:
+        return []
+    offsets = np.cumsum([0] + [len(text) for text in texts])
+    similarities = None
+    ranges, pending = [], [(0, len(texts))]
+    while pending:
+        start, end = pending.pop()
+        if offsets[end] - offsets[start] <= max_section_len or end - start < 2:
+            ranges.append((start, end))
+            continue
+        if similarities is None:
+            similarities = gap_similarities(texts)
+        cuts = np.arange(start + 1, end)
+        valid = (offsets[cuts] - offsets[start] >= min_section_len) & (offsets[end] - offsets[cuts] >= min_section_len)
+        if not valid.any():
+            ranges.append((start, end))
+            continue
+        candidates = cuts[valid]
+        cut = int(candidates[np.argmin(similarities[candidates - 1])])
+        pending.extend([(cut, end), (start, cut)])
+    return sorted(ranges)
+
+
+async def iter_structure_sections(paragraphs):
+    # Yield the (content, page_number) sections of one document from its (text, page_number, level) paragraphs,
+    # level being the heading_level of the paragraph. Only the paragraphs since the last heading are buffered.
+    block = []
+
+    def flush(keep_last=False):
+        ranges = split_block([text for text, _ in block])
+        if keep_last:
+            # The last range may continue in the paragraphs still to come
+            ranges, last = ranges[:-1], ranges[-1]
+        sections = [('\n'.join(text for text, _ in block[start:end]), block[start][1]) for start, end in ranges]
+        del block[:last[0] if keep_last else len(block)]
+        return sections
+
+    block_len = 0
+    async for text, page_num, level in paragraphs:
+        if level is not None and block and block_len > min_section_len:
+            for section in flush():
+                yield section
+            block_len = 0
+        block.append((text, page_num))
+        block_len += len(text)
+        if len(block) % max_block_paras == 0:
+            for section in flush(keep_last=True):
+                yield section
+            block_len = sum(len(text) for text, _ in block)
+
+    for section in flush():
+        yield section
@@ -1,22 +1,38 @@
 import os
 import re
-import sys
-from docx import Document
+import ast
+import time
+import zlib
 import asyncio
+import logging
+import openai
 import pandas as pd
 from collections import deque
 from httpx import ReadTimeout
-from openai import AsyncClient
+from wordDoc.chunking.semantic.docx_reader import iter_docx_paragraphs
+from wordDoc.chunking.semantic.structure import heading_level, iter_structure_sections
+from wordDoc.utils.embedding_cache import normalize_text
+from wordDoc.utils.process_data import count_chat_tokens
+from clients import segment_openai_client, segment_cache
+from instrumentation import record_stage, record_cache, record_openai_call, retries
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # MODEL = 'gpt-3.5-turbo-1106'
 MODEL = 'gpt-4-1106-preview'
-client = AsyncClient(api_key=os.getenv('OPENAI_API_KEY'), timeout=10.0)
-orig_para_group_size = 150
-para_group_size = orig_para_group_size
-code_pattern = re.compile('``` ?[Pp]ython\n(?:(?!```)[\S\s])+\n```')
+PROMPT_VERSION = 1  # bump when the segmentation prompt changes, cached markers of older prompts are then ignored
+para_group_size = 150
+para_group_overlap = int(os.getenv('SEGMENT_WINDOW_OVERLAP', 50))  # paragraphs shared by neighbouring excerpts
+SEGMENT_CONCURRENCY = int(os.getenv('SEGMENT_CONCURRENCY', 4))  # excerpts being segmented by the LLM at once
+SEGMENT_MAX_ATTEMPTS = int(os.getenv('SEGMENT_MAX_ATTEMPTS', 5))  # LLM requests per excerpt before giving up on its boundaries
+SEGMENT_RETRIED_ERRORS = (ReadTimeout, openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)
+SEGMENT_STRATEGIES = ('llm', 'structure')  # see structure.py for the LLM-free one
+SEGMENT_STRATEGY = os.getenv('SEGMENT_STRATEGY', 'llm')
+min_section_len = 128  # sections shorter than this are merged into the next one
+code_pattern = re.compile(r'``` ?[Pp]ython\n(?:(?!```)[\S\s])+\n```')
+marker_pattern = re.compile(r'【(\d+)†source】')
+logger = logging.getLogger(__name__)
 
 
 
@@ -27,97 +43,254 @@ def cleanup_python_response(response):
         
     return response
 
-async def split_handler(docs_inpath, docs_outpath):
-    global para_group_size
-    all_splitted_sections = []
-    os.makedirs(docs_outpath, exist_ok=True)
-    all_doc_outpath = os.path.join(docs_outpath, 'combined.csv')
+
+def parse_section_markers(response):
+    # The list assigned to "sections" in the last Python code block of the response, None if there is no valid one
+    section_markers = None
+    code_segments = code_pattern.findall(response)
+    for code_segment in code_segments:
+        code_segment = cleanup_python_response(code_segment)
+        if code_segment.startswith('sections'):
+            try:
+                markers = ast.literal_eval(code_segment[8:].lstrip()[1:].lstrip())
+            except (ValueError, SyntaxError):
+                logger.debug('Unparseable sections: %s', code_segment)
+                continue
+            if isinstance(markers, (list, tuple)):
+                section_markers = list(markers)
+                logger.debug('Sections: %s', section_markers)
+    return section_markers
+
+
+async def request_section_markers(excerpt, semaphore, max_attempts=SEGMENT_MAX_ATTEMPTS):
+    # Ask the LLM which markers in the excerpt start a new section, retrying until we get a "sections" list back.
+    # After max_attempts answers without one (or failed requests, see SEGMENT_RETRIED_ERRORS) the excerpt gets no
+    # boundaries, its paragraphs then join the sections around them, and nothing is cached so the next run asks again.
+    # Excerpts segmented before (eg. the unchanged parts of a re-uploaded document) are answered from the cache.
+    loop = asyncio.get_event_loop()
+    section_markers = await loop.run_in_executor(None, lambda: segment_cache().get(MODEL, PROMPT_VERSION, excerpt))
+    record_cache('segment', section_markers is not None, section_markers is None)
+    if section_markers is not None:
+        return section_markers
+
+    async with semaphore:
+        start = time.perf_counter()
+        logger.debug('Excerpt:\n%s\n', excerpt)
+        messages = [
+            {
+                'role': 'user',
+                'content': f'{excerpt}\n\nIntructions: Split the text excerpt above into sections based on the content and give me the list of section markers in the form "[\'【i†source】\', \'【j†source】\', ...]" where i, j are selected such that the corresponding markers indicate the start of a new section, not just a new paragraph. Thus, non-qualifying markers should be ignored. Put the sections into a Python list named "sections" inside a Python code block. Start by specifying the code block as Python code block.'
+            }
+        ]
+        for attempt in range(max_attempts):
+            if attempt:
+                retries.inc(operation='segment')
+            try:
+                completion = await segment_openai_client().chat.completions.create(
+                    messages=messages,
+                    model=MODEL,
+                    temperature=0.0,
+                    stream=True
+                )
+                response = []
+                async for chunk in completion:
+                    part = chunk.choices[0].delta
+                    if part.content is not None:
+                        response.append(part.content)
+                # Streamed answers carry no usage, both sides are counted with the tokenizer
+                response = ''.join(response)
+                tokens_in, tokens_out = await loop.run_in_executor(None, count_chat_tokens, messages, response)
+                record_openai_call('chat', tokens_in=tokens_in, tokens_out=tokens_out)
+                logger.debug('Response:\n%s', response)
+                section_markers = parse_section_markers(response)
+                if section_markers is not None:
+                    record_stage('segment', time.perf_counter() - start)
+                    await loop.run_in_executor(None, lambda: segment_cache().put(MODEL, PROMPT_VERSION, excerpt, section_markers))
+                    return section_markers
+            except SEGMENT_RETRIED_ERRORS as e:
+                # ReadTimeout is a stall while the answer streams in, the others come out of the client once its
+                # own retries are used up
+                logger.info('Segmentation attempt %d of %d failed: %r', attempt + 1, max_attempts, e)
+        logger.warning('No section markers after %d attempts, keeping the excerpt without boundaries:\n%.200s', max_attempts, excerpt)
+        record_stage('segment', time.perf_counter() - start)
+        return []
+
+
+async def _aiter_paragraphs(paragraphs):
+    # Accept plain or async iterables of paragraphs, each either a text or a (text, page_number) pair
+    if hasattr(paragraphs, '__aiter__'):
+        async for para in paragraphs:
+            yield (para, None) if isinstance(para, str) else para
+    else:
+        for para in paragraphs:
+            yield (para, None) if isinstance(para, str) else para
+
+
+def anchor_window_start(texts, first, last):
+    # Content defined start of the next excerpt: the paragraph in texts[first:last + 1] with the smallest hash.
+    # After an edit the excerpts after it fall back onto the same paragraphs, so they are cache hits again.
+    return min(range(first, last + 1), key=lambda j: (zlib.crc32(normalize_text(texts[j]).encode('utf-8')), j))
+
+
+async def iter_sections(paragraphs, semaphore, size=para_group_size, overlap=para_group_overlap, lookahead=SEGMENT_CONCURRENCY):
+    # Yield the (content, page_number) sections of one document in order, page_number being the page of the first paragraph.
+    # The paragraphs are split into overlapping excerpts of at most `size` paragraphs, read from the source as they are
+    # needed, and up to `lookahead` excerpts are in flight. Each excerpt only keeps the boundaries the LLM found in its
+    # part of the document: overlaps are cut in the middle so every kept boundary was decided with some context on both
+    # sides. A section is yielded as soon as the excerpts covering it have come back.
+    # These are not the excerpts of the original sequential loop, which re-sent the paragraphs after the last boundary
+    # with the next ones and so had to wait for each answer. The sections are the same as long as the LLM decides on
+    # a paragraph the same way whatever surrounds it (see tests/test_segmentation.py); with a real LLM the boundaries
+    # near the edges of the excerpts can differ.
+    # Markers are numbered from 0 in every excerpt and each excerpt starts up to a quarter of a stride early, at a
+    # paragraph picked from the content (see anchor_window_start), so that unchanged excerpts hit the segment cache.
+    stride = max(size - overlap, 1)
+    anchor_span = stride // 4
+    source = _aiter_paragraphs(paragraphs)
+    texts, page_nums = [], []
+    base = 0  # index of texts[0], paragraphs before it are no longer needed
+    exhausted = False
+    tasks = deque()
+    next_start = 0
+    own_start = 0
+
+    async def read_until(num_paras):
+        nonlocal exhausted
+        while not exhausted and base + len(texts) < num_paras:
+            try:
+                text, page_num = await source.__anext__()
+            except StopAsyncIteration:
+                exhausted = True
+                break
+            texts.append(text)
+            page_nums.append(page_num)
+
+    async def schedule():
+        nonlocal next_start, own_start
+        while len(tasks) < lookahead and next_start is not None:
+            # Read one paragraph past the window to know whether another window follows
+            await read_until(next_start + size + 1)
+            num_paras = base + len(texts)
+            end = min(next_start + size, num_paras)
+            if end <= next_start:
+                next_start = None
+                break
+            has_next = num_paras > next_start + size
+            if has_next:
+                following = base + anchor_window_start(texts, next_start + stride - anchor_span - base, next_start + stride - base)
+            own_end = (following + end) // 2 if has_next else num_paras
+            excerpt = '\n'.join(f'【{j - next_start}†source】 {texts[j - base]}' for j in range(next_start, end))
+            tasks.append((next_start, own_start, own_end, asyncio.ensure_future(request_section_markers(excerpt, semaphore))))
+            own_start = own_end
+            next_start = following if has_next else None
+
+    curr_section_list = []
+    curr_page_num = None
+    text_len = 0
+    await schedule()
+    try:
+        while tasks:
+            offset, window_start, window_end, task = tasks.popleft()
+            section_markers = await task
+            boundaries = set()
+            for marker in section_markers:
+                match = marker_pattern.search(str(marker))
+                if match:
+                    boundaries.add(offset + int(match.group(1)))
+
+            for j in range(window_start, window_end):
+                if j in boundaries and curr_section_list and text_len > min_section_len:
+                    yield '\n'.join(curr_section_list), curr_page_num
+                    curr_section_list = []
+                    text_len = 0
+                if not curr_section_list:
+                    curr_page_num = page_nums[j - base]
+                text_len += len(texts[j - base])
+                curr_section_list.append(texts[j - base])
+
+            # Drop the paragraphs which are neither assembled nor part of an excerpt still to be sent
+            keep_from = window_end if next_start is None else min(window_end, next_start)
+            del texts[:keep_from - base]
+            del page_nums[:keep_from - base]
+            base = keep_from
+            await schedule()
+    finally:
+        for _, _, _, task in tasks:
+            task.cancel()
+
+    if curr_section_list:
+        yield '\n'.join(curr_section_list), curr_page_num
+
+
+def _read_docx(doc_inpath):
+    # Paragraphs are streamed out of the .docx one at a time, see docx_reader. Only the time spent reading them is
+    # recorded as the parse stage, not the time the consumer holds on to each paragraph.
+    parse_seconds = 0.0
+    start = time.perf_counter()
+    for para in iter_docx_paragraphs(doc_inpath):
+        text = para.text.strip()
+        if text and not text.startswith('<image: '):
+            parse_seconds += time.perf_counter() - start
+            yield text, para
+            start = time.perf_counter()
+    record_stage('parse', parse_seconds + time.perf_counter() - start)
+
+
+def read_paragraphs(doc_inpath):
+    for text, _ in _read_docx(doc_inpath):
+        yield text
+
+
+async def read_leveled_paragraphs(doc_inpath):
+    # (text, page_number, heading level) paragraphs for the structure strategy
+    if doc_inpath.lower().endswith('.pdf'):
+        from wordDoc.chunking.semantic.pdf import iter_pdf_paragraphs
+        async for text, page_num in iter_pdf_paragraphs(doc_inpath):
+            yield text, page_num, heading_level(text)
+    else:
+        for text, para in _read_docx(doc_inpath):
+            yield text, None, heading_level(text, para.outline_level, para.style)
+
+
+def iter_document_sections(doc_inpath, semaphore, strategy=None):
+    # Pick the segmentation strategy and the paragraph source from the file type, PDFs are read page by page on a process pool
+    strategy = strategy or SEGMENT_STRATEGY
+    if strategy not in SEGMENT_STRATEGIES:
+        raise ValueError(f'Unknown segmentation strategy {strategy!r}, expected one of {SEGMENT_STRATEGIES}')
+    if strategy == 'structure':
+        return iter_structure_sections(read_leveled_paragraphs(doc_inpath))
+    if doc_inpath.lower().endswith('.pdf'):
+        from wordDoc.chunking.semantic.pdf import iter_pdf_paragraphs, pdf_para_group_size
+        return iter_sections(iter_pdf_paragraphs(doc_inpath), semaphore, size=pdf_para_group_size, overlap=pdf_para_group_size // 3)
+    return iter_sections(read_paragraphs(doc_inpath), semaphore)
+
+
+async def split_document(doc_inpath, semaphore, strategy=None):
+    return [section async for section in iter_document_sections(doc_inpath, semaphore, strategy)]
+
+
+async def iter_split_sections(docs_inpath, concurrency=SEGMENT_CONCURRENCY, strategy=None):
+    # Streaming version of split_handler, yields [documentTitle, referenceMarker, content, pageNumber] rows as they are segmented
+    semaphore = asyncio.Semaphore(concurrency)
+    num_sections = 0
     for root, _, files in os.walk(docs_inpath):
         for file in files:
-            doc_inpath = os.path.join(root, file)
-            # outfile = f'{os.path.splitext(file)[0]}.csv'
-            outdir = os.path.join(docs_outpath, os.path.relpath(root, docs_inpath))
-            os.makedirs(outdir, exist_ok=True)
-            # doc_outpath = os.path.join(outdir, outfile)
-            paras = deque(maxlen=para_group_size)
-            # page_nums = deque(maxlen=para_group_size)
-            sections = {}
-            # splitted_sections = []
-            all_paras = Document(doc_inpath).paragraphs
-            num_paras = len(all_paras)
-            j = 0
-            for i, para in enumerate(all_paras):
-                text = para.text.strip()
-                if text and not text.startswith('<image: '):
-                    marker = f'【{j}†source】'
-                    j += 1
-                    sections[marker] = text
-                    paras.append(f'{marker} {text}')
-                    if i == num_paras - 1 or len(paras) == para_group_size:  # End of doc or group big enough to process
-                        excerpt = '\n'.join(paras)
-                        print(f'Excerpt:\n{excerpt}\n')
-                        response = []
-                        while True:
-                            try:
-                                completion = await client.chat.completions.create(
-                                    messages=[
-                                        {
-                                            'role': 'user',
-                                            'content': f'{excerpt}\n\nIntructions: Split the text excerpt above into sections based on the content and give me the list of section markers in the form "[\'【i†source】\', \'【j†source】\', ...]" where i, j are selected such that the corresponding markers indicate the start of a new section, not just a new paragraph. Thus, non-qualifying markers should be ignored. Put the sections into a Python list named "sections" inside a Python code block. Start by specifying the code block as Python code block.'
-                                        }
-                                    ],
-                                    model=MODEL,
-                                    temperature=0.0,
-                                    stream=True
-                                )
-                                async for chunk in completion:
-                                    part = chunk.choices[0].delta
-                                    if part.content is not None:
-                                        sys.stdout.write(part.content)
-                                        sys.stdout.flush()
-                                        response.append(part.content)
-                                sys.stdout.write('\n')
-                                sys.stdout.flush()
-                                response = ''.join(response)
-                                section_markers = None
-                                code_segments = code_pattern.findall(response)
-                                for code_segment in code_segments:
-                                    code_segment = cleanup_python_response(code_segment)
-                                    if code_segment.startswith('sections'):
-                                        print(f'Code: {code_segment}')
-                                        section_markers = eval(code_segment[8:].lstrip()[1:].lstrip())
-                                        print(f'Sections: {section_markers}')
-                                if section_markers is not None:
-                                    break
-                            except ReadTimeout:
-                                pass
-                        if section_markers:
-                            section_marker_iter = iter(section_markers)
-                            curr_section_marker = next(section_marker_iter)
-                            curr_section_list = []
-                            to_delete_markers = []
-                            text_len = 0
-                            try:
-                                for marker, content in list(sections.items()):
-                                    if marker == curr_section_marker:
-                                        if curr_section_list and text_len > 128:
-                                            all_splitted_sections.append([file, f'【{len(all_splitted_sections)}†source】', '\n'.join(curr_section_list)])
-                                            curr_section_list.clear()
-                                            text_len = 0
-                                            for m in to_delete_markers:
-                                                del sections[m]
-                                                paras.popleft()
-                                            to_delete_markers.clear()
-                                        curr_section_marker = next(section_marker_iter)
-                                    text_len += len(content)
-                                    curr_section_list.append(content)
-                                    to_delete_markers.append(marker)
-                            except StopIteration:
-                                pass
-                        else:
-                            para_group_size = para_group_size + (orig_para_group_size >> 1)
-            if sections:
-                all_splitted_sections.append([file, f'【{len(all_splitted_sections)}†source】', '\n'.join(sections.values())])
-
-    pd.DataFrame.from_records(all_splitted_sections, index=None, columns=['documentTitle', 'referenceMarker', 'content']).to_csv(all_doc_outpath, index=None)
+            async for content, page_num in iter_document_sections(os.path.join(root, file), semaphore, strategy):
+                yield [file, f'【{num_sections}†source】', content, page_num]
+                num_sections += 1
+
+
+async def split_handler(docs_inpath, docs_outpath, concurrency=SEGMENT_CONCURRENCY, strategy=None):
+    # All files are segmented at the same time, sharing one limit on the number of LLM requests in flight
+    semaphore = asyncio.Semaphore(concurrency)
+    files = [(file, os.path.join(root, file)) for root, _, files in os.walk(docs_inpath) for file in files]
+    splitted_files = await asyncio.gather(*(split_document(doc_inpath, semaphore, strategy) for _, doc_inpath in files))
 
+    all_splitted_sections = []
+    for (file, _), sections in zip(files, splitted_files):
+        for content, page_num in sections:
+            all_splitted_sections.append([file, f'【{len(all_splitted_sections)}†source】', content, page_num])
+
+    os.makedirs(docs_outpath, exist_ok=True)
+    all_doc_outpath = os.path.join(docs_outpath, 'combined.csv')
+    pd.DataFrame.from_records(all_splitted_sections, index=None, columns=['documentTitle', 'referenceMarker', 'content', 'pageNumber']).to_csv(all_doc_outpath, index=None)
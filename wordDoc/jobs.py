@@ -0,0 +1,316 @@
+import os
+import json
+import logging
+import time
+import uuid
+import sqlite3
+import asyncio
+import tempfile
+import threading
+import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from wordDoc.storage.base import get_blob_store
+from wordDoc.vectorstore.base import get_vector_store
+from wordDoc.chunking.semantic.word import iter_split_sections
+from wordDoc.utils.pipeline import ingest_sections
+from clients import job_store
+from instrumentation import span, trace, TRACE_JOBS
+from dotenv import load_dotenv
+load_dotenv()
+
+
+INGEST_JOB_DB_PATH = os.getenv("INGEST_JOB_DB_PATH", os.path.join(".cache", "jobs.sqlite3"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))  # documents ingested at the same time by each app process
+INGEST_JOB_LEASE_SECONDS = int(os.getenv("INGEST_JOB_LEASE_SECONDS", 300))  # running jobs without a heartbeat for this long are retried
+INGEST_JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", 3))  # jobs whose lease expired this many times are failed
+INGEST_POLL_SECONDS = 2
+STAGES = ['download', 'segment', 'embed', 'insert']
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    # Ingestion jobs are kept in SQLite so that they survive a restart and every uvicorn worker sees the same queue.
+    # The methods block (up to the 30s busy timeout when processes contend), call them from IngestJobQueue's executor.
+
+    def __init__(self, path=INGEST_JOB_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    sections_done INTEGER NOT NULL DEFAULT 0,
+                    sections_total INTEGER NOT NULL DEFAULT 0,
+                    stage_seconds TEXT NOT NULL DEFAULT '{}',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, payload):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (id, payload, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, json.dumps(payload), now, now)
+        )
+        return job_id
+
+    def claim(self):
+        # Atomically move the oldest queued job to running, so two processes never pick up the same job
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (time.time(), row["id"])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return dict(row, status='running', attempts=row["attempts"] + 1)
+
+    def update(self, job_id, **fields):
+        if "stage_seconds" in fields:
+            fields["stage_seconds"] = json.dumps(fields["stage_seconds"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def requeue_stale(self, lease_seconds=INGEST_JOB_LEASE_SECONDS, max_attempts=INGEST_JOB_MAX_ATTEMPTS):
+        # Jobs left running by a process that died (no heartbeat within the lease) go back to the queue, unless they
+        # already had max_attempts, so a document which kills its worker is not retried forever
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                (f"Lease expired after {max_attempts} attempts", now, now - lease_seconds, max_attempts)
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                (now - lease_seconds,)
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["stage_seconds"] = json.loads(job["stage_seconds"])
+        return job
+
+
+class JobProgress:
+    # Collects the progress reported by the pipeline and writes it to the store at most every flush_interval seconds.
+    # The writes go to `executor` without being awaited, it has a single thread so they land in order.
+
+    def __init__(self, store, job_id, flush_interval=1.0, executor=None):
+        self.store = store
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.executor = executor
+        self.stage = None
+        self.finished_stages = set()
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.sections_done = 0
+        self.sections_total = 0
+        self.last_flush = 0.0
+
+    def start_stage(self, stage):
+        self.stage = stage
+        self.flush(force=True)
+
+    def record(self, stage, seconds, num_sections, finished=False):
+        self.stage_seconds[stage] += seconds
+        if stage == 'segment':
+            self.sections_total += num_sections
+        elif stage == 'insert':
+            self.sections_done += num_sections
+        if finished:
+            self.finished_stages.add(stage)
+        # Stages overlap, report the earliest one which is still running
+        self.stage = next((s for s in STAGES[1:] if s not in self.finished_stages), 'insert')
+        self.flush(force=finished)
+
+    def flush(self, force=False):
+        now = time.time()
+        if force or now - self.last_flush >= self.flush_interval:
+            self.last_flush = now
+            update = partial(
+                self.store.update,
+                self.job_id,
+                stage=self.stage,
+                sections_done=self.sections_done,
+                sections_total=self.sections_total,
+                stage_seconds={stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()}
+            )
+            if self.executor is None:
+                update()
+            else:
+                asyncio.get_event_loop().run_in_executor(self.executor, update).add_done_callback(_log_failed_update)
+
+
+def _log_failed_update(future):
+    # Progress is only informative, a failed write is logged and the next one catches up
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Could not save job progress: %s", future.exception())
+
+
+def document_id(payload):
+    # The file name without its extension is the document's uuid
+    return os.path.splitext(os.path.basename(payload['doc_path']))[0]
+
+
+async def ingest_document(payload, progress):
+    # download document from cloud storage into a tmp dir
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        progress.start_stage('download')
+        start = time.perf_counter()
+        file_uuid = document_id(payload)
+        ext = os.path.splitext(payload['doc_path'])[1]
+
+        # keep the extension, the splitter picks the word or pdf reader from it
+        local_file_path = os.path.join(tmp_dir, "temp_doc" + ext)
+        with span('download'):
+            await get_blob_store().download(payload['doc_path'], local_file_path)
+        progress.record('download', time.perf_counter() - start, 0, finished=True)
+
+        # split the document and stream each section into milvus as soon as it is segmented
+        progress.start_stage('segment')
+        await ingest_sections(
+            iter_split_sections(tmp_dir, strategy=payload.get('segmentation')), file_uuid, payload['collection_name'], on_progress=progress.record
+        )
+
+
+async def remove_document(payload):
+    # Delete what an earlier attempt of the job inserted, so a retry does not store the document's chunks twice
+    vector_store = get_vector_store()
+    await vector_store.create(payload['collection_name'])
+    await vector_store.delete(payload['collection_name'], document_id(payload))
+
+
+class IngestJobQueue:
+    # Runs ingestion jobs from the store on a fixed number of asyncio workers. A job run again after its lease expired
+    # first goes through `cleanup` (eg. remove_document) to undo the previous attempt.
+    # The store is only called from a single thread executor, so SQLite waits never block the event loop.
+    # Without a store the app's one is used, created by the lifespan or the first call (see clients.py).
+
+    def __init__(self, store=None, handler=ingest_document, workers=INGEST_WORKERS, cleanup=remove_document):
+        self._job_store = store
+        self.handler = handler
+        self.workers = workers
+        self.cleanup = cleanup
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        self._tasks = []
+        self._wakeup = None
+
+    @property
+    def store(self):
+        return self._job_store if self._job_store is not None else job_store()
+
+    async def _store(self, method, *args, **kwargs):
+        # Calls the store's method by name, the store is looked up on the executor too as creating it opens the file
+        return await asyncio.get_event_loop().run_in_executor(self.executor, lambda: getattr(self.store, method)(*args, **kwargs))
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        await self._store("requeue_stale")
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Running jobs are left as "running" and picked up again once their lease expires
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload):
+        job_id = await self._store("create", payload)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id):
+        return await self._store("get", job_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self._store("claim")
+                if job is None:
+                    # Nothing queued, wait for a local submit or poll for jobs queued by other processes
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), INGEST_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        await self._store("requeue_stale")
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # eg. "database is locked", or the job could not be marked failed. Keep the worker alive, a job left
+                # running is picked up again once its lease expires
+                logger.exception("Ingestion worker error, retrying in %s seconds", INGEST_POLL_SECONDS)
+                await asyncio.sleep(INGEST_POLL_SECONDS)
+
+    async def _run(self, job):
+        progress = JobProgress(self.store, job["id"], executor=self.executor)
+        heartbeat = asyncio.ensure_future(self._heartbeat(job["id"]))
+        try:
+            payload = json.loads(job["payload"])
+            with trace("job", TRACE_JOBS, job_id=job["id"], attempt=job["attempts"]):
+                if job["attempts"] > 1 and self.cleanup is not None:
+                    await self.cleanup(payload)
+                await self.handler(payload, progress)
+            progress.flush(force=True)
+            await self._store("update", job["id"], status='done', stage='done')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self._store("update", job["id"], status='failed', error=traceback.format_exc())
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id):
+        # Keep the lease alive while a long LLM call reports no progress
+        while True:
+            await asyncio.sleep(INGEST_JOB_LEASE_SECONDS / 3)
+            await self._store("update", job_id)
+
+
+ingest_jobs = IngestJobQueue()
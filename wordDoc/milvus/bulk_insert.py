@@ -0,0 +1,170 @@
+'''
+Inserts of the app into Milvus: split into requests of at most MILVUS_INSERT_BATCH_BYTES, with at most
+MILVUS_INSERT_CONCURRENCY requests in flight per process whichever job they come from, so a large document neither
+goes over the gRPC message limit nor takes every Milvus thread away from the searches.
+
+Writes to the same collection arriving within MILVUS_INSERT_LINGER_MS of each other are collected and sent together
+when the first one's linger is over. An insert request targets one partition and every document has its own (see
+partitions.py), so they are split by partition at that point: the writes of each partition are merged into one write,
+and the partitions are sent concurrently, still within MILVUS_INSERT_CONCURRENCY, so concurrent jobs share one timer
+and one round of requests per collection. If a merged write fails validation against the schema (before anything is
+sent), its writes are sent one by one so a bad write only fails its own caller.
+
+Segments are flushed on purpose instead of whenever the server decides: when a caller is done with a collection
+(flush) and after every MILVUS_FLUSH_ROWS rows, so a long ingestion gets indexed as it goes.
+'''
+
+import os
+import time
+import asyncio
+import logging
+from itertools import chain
+from wordDoc.milvus.registry import collection_registry
+from wordDoc.milvus.query import milvus_executor
+from wordDoc.milvus.insert import align_to_schema, estimate_row_bytes, batch_by_bytes, flush_collection, MILVUS_INSERT_BATCH_BYTES
+from instrumentation import milvus_rpc_seconds, retries
+from dotenv import load_dotenv
+load_dotenv()
+
+
+MILVUS_INSERT_CONCURRENCY = int(os.getenv("MILVUS_INSERT_CONCURRENCY", 2))  # keep below MILVUS_SEARCH_CONCURRENCY, they share milvus_executor
+MILVUS_INSERT_LINGER_MS = float(os.getenv("MILVUS_INSERT_LINGER_MS", 10))  # 0 sends every write on its own
+MILVUS_FLUSH_ROWS = int(os.getenv("MILVUS_FLUSH_ROWS", 20000))  # rows inserted into a collection before it is flushed unasked
+logger = logging.getLogger(__name__)
+
+
+class BulkInserter:
+
+    def __init__(self, batch_bytes=MILVUS_INSERT_BATCH_BYTES, concurrency=MILVUS_INSERT_CONCURRENCY,
+                 linger=MILVUS_INSERT_LINGER_MS / 1000, flush_rows=MILVUS_FLUSH_ROWS, executor=milvus_executor):
+        self.batch_bytes = batch_bytes
+        self.concurrency = concurrency
+        self.linger = linger
+        self.flush_rows = flush_rows
+        self.executor = executor
+        self._pending = {}  # collection_name -> [(partition_name, data, future)] waiting to be sent
+        self._timers = {}  # collection_name -> TimerHandle of its linger, cancelled when the writes are sent earlier
+        self._sends = set()  # tasks started by the timers, referenced until they are done
+        self._unflushed = {}  # collection_name -> rows inserted since its last flush
+        self._flush_locks = {}
+        self._semaphore = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def insert(self, collection_name, data, partition_name=None):
+        # data holds the columns in the order of FIELDS, returns once every row is inserted
+        if self.linger <= 0:
+            await self._insert((collection_name, partition_name), data)
+        else:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            if collection_name not in self._pending:
+                self._pending[collection_name] = []
+                self._timers[collection_name] = loop.call_later(self.linger, self._linger_over, collection_name)
+            self._pending[collection_name].append((partition_name, data, future))
+            await future
+
+        self._unflushed[collection_name] = self._unflushed.get(collection_name, 0) + len(data[0])
+        if self._unflushed[collection_name] >= self.flush_rows:
+            await self.flush(collection_name)
+
+    def _linger_over(self, collection_name):
+        self._timers.pop(collection_name, None)
+        task = asyncio.ensure_future(self._send(collection_name))
+        self._sends.add(task)
+        task.add_done_callback(self._send_done)
+
+    def _send_done(self, task):
+        self._sends.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # The callers got their own errors, this is a failure of _send itself
+            logger.error("Sending the pending Milvus writes failed", exc_info=task.exception())
+
+    async def _send(self, collection_name):
+        # Everything waiting for the collection, one merged write per partition
+        timer = self._timers.pop(collection_name, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(collection_name, None)
+        if not pending:
+            return
+        by_partition = {}
+        for partition_name, data, future in pending:
+            by_partition.setdefault(partition_name, []).append((data, future))
+        await asyncio.gather(*(self._send_partition((collection_name, partition_name), writes) for partition_name, writes in by_partition.items()))
+
+    async def _send_partition(self, key, writes):
+        try:
+            if len(writes) > 1:
+                try:
+                    await self._insert(key, [list(chain.from_iterable(columns)) for columns in zip(*(data for data, _ in writes))])
+                except ValueError:
+                    # Rejected by align_to_schema, nothing was sent: find the write at fault instead of failing all of them
+                    retries.inc(len(writes), operation="milvus_insert")
+                    await asyncio.gather(*(self._send_one(key, data, future) for data, future in writes))
+                    return
+            else:
+                await self._insert(key, writes[0][0])
+        except Exception as e:
+            for _, future in writes:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in writes:
+            if not future.done():
+                future.set_result(None)
+
+    async def _send_one(self, key, data, future):
+        try:
+            await self._insert(key, data)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    def _prepare(self, collection_name, partition_name, data):
+        # Validated columns in schema order and the (start, end) rows of each request
+        if partition_name is not None:
+            collection_registry.has_partition(collection_name, partition_name, create=True)
+        collection = collection_registry.get(collection_name, create=True)
+        aligned = align_to_schema(data, collection)
+        return aligned, batch_by_bytes(estimate_row_bytes(aligned, collection), self.batch_bytes)
+
+    def _insert_batch(self, collection_name, partition_name, batch):
+        start = time.perf_counter()
+        try:
+            collection_registry.call(collection_name, lambda collection: collection.insert(batch, partition_name=partition_name), create=True)
+        finally:
+            milvus_rpc_seconds.observe(time.perf_counter() - start, operation="insert")
+
+    async def _insert(self, key, data):
+        collection_name, partition_name = key
+        if self._semaphore is None:
+            # Created on first use so it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        aligned, batches = await self._run(self._prepare, collection_name, partition_name, data)
+
+        async def send(start, end):
+            async with self._semaphore:
+                await self._run(self._insert_batch, collection_name, partition_name, [column[start:end] for column in aligned])
+
+        await asyncio.gather(*(send(start, end) for start, end in batches))
+
+    async def flush(self, collection_name):
+        # Send what is still waiting for the collection, then seal its segments so they get indexed
+        await self._send(collection_name)
+        if collection_name not in self._flush_locks:
+            self._flush_locks[collection_name] = asyncio.Lock()
+        async with self._flush_locks[collection_name]:
+            if not self._unflushed.get(collection_name):
+                return  # flushed by someone else in the meantime
+            self._unflushed[collection_name] = 0
+            start = time.perf_counter()
+            try:
+                await self._run(flush_collection, collection_name)
+            finally:
+                milvus_rpc_seconds.observe(time.perf_counter() - start, operation="flush")
+
+
+bulk_inserter = BulkInserter()
@@ -1,12 +1,9 @@
 import os
-from pymilvus import (
-    connections,
-    FieldSchema,
-    CollectionSchema,
-    DataType,
-    Collection,
-    utility
-)
+import asyncio
+from pymilvus import connections, DataType
+from wordDoc.milvus.registry import collection_registry, INDEX_PARAMS
+from wordDoc.milvus.query import milvus_executor
+from wordDoc.vectorstore.base import FIELDS
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -14,45 +11,142 @@ load_dotenv()
 
 host = os.getenv('MILVUS_HOST', 'localhost')
 port = os.getenv('MILVUS_PORT', '19530')
-connections.connect("default", host=host, port=port)
+MILVUS_INSERT_BATCH_BYTES = int(os.getenv('MILVUS_INSERT_BATCH_BYTES', 16 * 1024 * 1024))  # per insert request, well under the 64MB gRPC message limit
+ROW_OVERHEAD_BYTES = 16  # protobuf framing per row, on top of the field values
+
+
+def connect():
+    # Called once per process through clients.milvus(), see clients.py
+    connections.connect("default", host=host, port=port)
+    return connections
 
 
 def sanitise_collection_name(collection_name):
     return ''.join(e for e in collection_name if e.isalnum() or e == '_')
 
 
+def ensure_collection(collection_name):
+    # Creates, indexes and loads the collection the first time this process sees it, then it is a dictionary lookup
+    collection_registry.get(collection_name, create=True)
+
+
+def align_to_schema(data, collection):
+    # data holds the columns in the order of FIELDS, Milvus wants them in the order of the collection's schema.
+    # Collections created before page numbers were stored simply do not get that column. Rows Milvus would reject
+    # are reported here with their index, before anything is sent.
+    if len(data) != len(FIELDS):
+        raise ValueError(f"Expected the {len(FIELDS)} columns {FIELDS}, got {len(data)}")
+    num_rows = len(data[0])
+    for name, column in zip(FIELDS, data):
+        if len(column) != num_rows:
+            raise ValueError(f"Column {name} has {len(column)} rows, expected {num_rows}")
+
+    columns = dict(zip(FIELDS, data))
+    aligned = []
+    for field in collection.schema.fields:
+        if field.is_primary and field.auto_id:
+            continue
+        if field.name in columns:
+            column = columns[field.name]
+        elif field.name == "description":
+            column = [""] * num_rows  # not generated yet, see the TODO in process_sections_for_insert
+        else:
+            raise ValueError(f"No data for field {field.name} of collection {collection.name}")
+
+        if field.dtype == DataType.FLOAT_VECTOR:
+            dim = int(field.params["dim"])
+            for i, vector in enumerate(column):
+                if len(vector) != dim:
+                    raise ValueError(f"Row {i} of {field.name} has {len(vector)} dimensions, expected {dim}")
+        elif field.dtype == DataType.VARCHAR:
+            max_length = int(field.params["max_length"])
+            for i, value in enumerate(column):
+                if len(value.encode("utf-8")) > max_length:
+                    raise ValueError(f"Row {i} of {field.name} is longer than {max_length} bytes")
+        aligned.append(column)
+    return aligned
+
+
+def estimate_row_bytes(aligned, collection):
+    # Approximate size of every row in an insert request, aligned being the output of align_to_schema
+    fields = [field for field in collection.schema.fields if not (field.is_primary and field.auto_id)]
+    row_bytes = [ROW_OVERHEAD_BYTES] * len(aligned[0])
+    for field, column in zip(fields, aligned):
+        if field.dtype == DataType.FLOAT_VECTOR:
+            size = 4 * int(field.params["dim"])
+            row_bytes = [total + size for total in row_bytes]
+        elif field.dtype == DataType.VARCHAR:
+            row_bytes = [total + len(value.encode("utf-8")) + 4 for total, value in zip(row_bytes, column)]
+        else:
+            row_bytes = [total + 8 for total in row_bytes]
+    return row_bytes
+
+
+def batch_by_bytes(row_bytes, max_bytes=MILVUS_INSERT_BATCH_BYTES):
+    # Group consecutive rows into (start, end) ranges of at most max_bytes, a row larger than that goes on its own
+    batches = []
+    start, batch_bytes = 0, 0
+    for i, num_bytes in enumerate(row_bytes):
+        if i > start and batch_bytes + num_bytes > max_bytes:
+            batches.append((start, i))
+            start, batch_bytes = i, 0
+        batch_bytes += num_bytes
+    if start < len(row_bytes):
+        batches.append((start, len(row_bytes)))
+    return batches
+
+
+def insert_rows(data, collection_name, partition_name=None):
+    # Blocking insert of one batch after the other, for scripts. The app goes through bulk_insert.bulk_inserter.
+    if partition_name is not None:
+        collection_registry.has_partition(collection_name, partition_name, create=True)
+    collection = collection_registry.get(collection_name, create=True)
+    aligned = align_to_schema(data, collection)
+    for start, end in batch_by_bytes(estimate_row_bytes(aligned, collection)):
+        batch = [column[start:end] for column in aligned]
+        collection_registry.call(collection_name, lambda collection: collection.insert(batch, partition_name=partition_name), create=True)
+
+
+def flush_collection(collection_name):
+    # Seal the growing segments so the server indexes them instead of searching them brute force, and recreate the
+    # index if it was dropped behind our back, sealed segments are only indexed while the collection has one
+    def flush(collection):
+        collection.flush()
+        if not collection.has_index():
+            collection.create_index(field_name="embedding", index_params=INDEX_PARAMS)
+
+    collection_registry.call(collection_name, flush)
+
+
+def delete_file(collection_name, file_id, partition_name=None):
+    # A document with its own partition is removed by dropping the partition
+    if partition_name is not None and collection_registry.has_partition(collection_name, partition_name):
+        def drop(collection):
+            partition = collection.partition(partition_name)
+            num_entities = partition.num_entities
+            partition.release()
+            collection.drop_partition(partition_name)
+            return num_entities
+
+        num_deleted = collection_registry.call(collection_name, drop)
+        collection_registry.state(collection_name).partitions.discard(partition_name)
+        return num_deleted
+
+    # Deleting by an arbitrary expression needs Milvus 2.3, look the primary keys up first so 2.2 servers work too
+    def delete(collection):
+        ids = [row["id"] for row in collection.query(expr=f"file_id == '{file_id}'", output_fields=["id"])]
+        if ids:
+            collection.delete(f"id in {ids}")
+        return len(ids)
+
+    return collection_registry.call(collection_name, delete) or 0
+
+
 async def create_collection_if_missing(collection_name):
-    fields = [
-        # record ID
-        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-        # file ID, used to retrieve all the records which belong to one file
-        FieldSchema(name="file_id", dtype=DataType.VARCHAR, max_length=2000),
-        FieldSchema(name="description", dtype=DataType.VARCHAR, max_length=2000),
-        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=1536),
-        FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=30000),
-        FieldSchema(name="num_tokens", dtype=DataType.INT64, max_length=2000)
-    ]
-
-    schema = CollectionSchema(fields, description="Job Handlers")
-
-    if not utility.has_collection(collection_name):
-        collection = Collection(name=collection_name, schema=schema)
-        print(f"Collection {collection_name} has been created")
-
-        # Create index for vector column
-        collection.create_index(field_name="embedding", index_params={
-            "index_type": "HNSW", 
-            "params": {"M": 16, "efConstruction": 100}, 
-            "metric_type": "L2"
-        })
-
-        # Load collection into memory so that we can query data later
-        collection.load()
+    await asyncio.get_event_loop().run_in_executor(milvus_executor, ensure_collection, collection_name)
 
 
 async def insert_data(data, collection_name):
-    await create_collection_if_missing(collection_name)
-    collection = Collection(collection_name)
-    collection.insert(data) # Milvus will automatically create an index for the newly inserted data
-
-    print("Done insertion and indexing")
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(milvus_executor, insert_rows, data, collection_name)
+    await loop.run_in_executor(milvus_executor, flush_collection, collection_name)
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from wordDoc.milvus.registry import collection_registry
+from dotenv import load_dotenv
+load_dotenv()
+
+
+MILVUS_PARTITION_MEMORY_MB = int(os.getenv("MILVUS_PARTITION_MEMORY_MB", 2048))  # budget for loaded partitions in this process
+MILVUS_ROW_BYTES_ESTIMATE = int(os.getenv("MILVUS_ROW_BYTES_ESTIMATE", 8192))  # 1536 float32 + HNSW links + scalar fields
+DEFAULT_PARTITION = "_default"  # where documents inserted before per-document partitions live
+
+
+def partition_name(file_id):
+    # Partition names may only contain letters, digits and underscores
+    return "doc_" + ''.join(c if c.isalnum() else '_' for c in file_id)
+
+
+class PartitionManager:
+    # Loads a document's partition the first time it is searched and releases the least recently used partitions
+    # once the estimated memory of everything loaded goes over the budget. Partitions being searched are never released.
+
+    def __init__(self, registry=collection_registry, budget_bytes=MILVUS_PARTITION_MEMORY_MB * 1024 * 1024):
+        self.registry = registry
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._loaded = OrderedDict()  # (collection_name, partition_name) -> estimated bytes, oldest first
+        self._in_use = {}
+
+    @contextmanager
+    def acquire(self, collection_name, partition_name):
+        key = (collection_name, partition_name)
+        with self._lock:
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        try:
+            if key not in self._loaded:
+                with load_lock:
+                    if key not in self._loaded:
+                        self._load(collection_name, partition_name)
+            yield
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+
+    def _load(self, collection_name, partition_name):
+        state = self.registry.state(collection_name)
+        if state is None or state.loaded:
+            # A collection loaded as a whole already serves every partition
+            return
+        collection = state.collection
+        collection.load(partition_names=[partition_name])
+        size = collection.partition(partition_name).num_entities * MILVUS_ROW_BYTES_ESTIMATE
+        with self._lock:
+            self._loaded[(collection_name, partition_name)] = size
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if sum(self._loaded.values()) <= self.budget_bytes:
+                    return
+                victim = next((key for key in self._loaded if key not in self._in_use), None)
+                if victim is None:
+                    return
+                del self._loaded[victim]
+            collection_name, partition_name = victim
+            collection = self.registry.get(collection_name)
+            if collection is not None:
+                partition = collection.partition(partition_name)
+                if partition is not None:
+                    partition.release()
+
+    def forget(self, collection_name, partition_name=None):
+        # Called after an error or a drop, the next search loads the partition again
+        with self._lock:
+            for key in list(self._loaded):
+                if key[0] == collection_name and partition_name in (None, key[1]):
+                    del self._loaded[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded_partitions": len(self._loaded),
+                "estimated_bytes": sum(self._loaded.values()),
+                "budget_bytes": self.budget_bytes
+            }
+
+
+partition_manager = PartitionManager()
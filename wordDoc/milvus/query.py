@@ -1,6 +1,13 @@
-from pymilvus import Collection
+import os
+from concurrent.futures import ThreadPoolExecutor
+from wordDoc.milvus.registry import collection_registry
 
-def get_top_n_chunks(collection_name, search_vector, expr, output_fields, limit):
+# pymilvus is synchronous, its calls run on their own bounded pool so they never block the event loop
+MILVUS_SEARCH_CONCURRENCY = int(os.getenv("MILVUS_SEARCH_CONCURRENCY", 8))
+milvus_executor = ThreadPoolExecutor(max_workers=MILVUS_SEARCH_CONCURRENCY, thread_name_prefix="milvus")
+
+
+def get_top_n_chunks(collection_name, search_vector, expr, output_fields, limit, partition_names=None):
     search_params = {
         "metric_type": "L2", 
         "offset": 0, 
@@ -8,16 +15,16 @@ def get_top_n_chunks(collection_name, search_vector, expr, output_fields, limit)
         "params": {"nprobe": 10}
     }
 
-    collection = Collection(collection_name)
     # find the top most relevant chunks based on the search vector generated by the user's question
-    results = collection.search(
+    results = collection_registry.call(collection_name, lambda collection: collection.search(
         data=[search_vector], 
         anns_field="embedding",
         param=search_params,
         expr=expr,
         limit=limit,
-        output_fields=output_fields
-    )
+        output_fields=output_fields,
+        partition_names=partition_names
+    ))
 
-    return results[0]
+    return results[0] if results is not None else []
 
@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+import threading
+from clients import milvus
+from pymilvus import (
+    FieldSchema,
+    CollectionSchema,
+    DataType,
+    Collection,
+    MilvusException,
+    utility
+)
+from dotenv import load_dotenv
+load_dotenv()
+
+MILVUS_MISSING_PARTITION_TTL = float(os.getenv("MILVUS_MISSING_PARTITION_TTL", 10))  # seconds a missing partition is remembered
+logger = logging.getLogger(__name__)
+
+
+def build_schema():
+    fields = [
+        # record ID
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+        # file ID, used to retrieve all the records which belong to one file
+        FieldSchema(name="file_id", dtype=DataType.VARCHAR, max_length=2000),
+        FieldSchema(name="description", dtype=DataType.VARCHAR, max_length=2000),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=1536),
+        FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=30000),
+        FieldSchema(name="num_tokens", dtype=DataType.INT64, max_length=2000),
+        # page the content starts on, 0 if unknown
+        FieldSchema(name="page_number", dtype=DataType.INT64)
+    ]
+
+    return CollectionSchema(fields, description="Job Handlers")
+
+
+INDEX_PARAMS = {
+    "index_type": "HNSW", 
+    "params": {"M": 16, "efConstruction": 100}, 
+    "metric_type": "L2"
+}
+
+
+class CollectionState:
+    def __init__(self, collection):
+        self.collection = collection
+        self.indexed = False
+        # Only true for collections loaded as a whole (created before per-document partitions),
+        # otherwise partitions are loaded and released by the PartitionManager
+        self.loaded = False
+        self.partitions = set()
+        self.missing_partitions = {}  # partition name -> time.monotonic() of the check which did not find it
+
+
+class CollectionRegistry:
+    # Process wide cache of Collection handles. Constructing a Collection fetches its schema from the server and
+    # has_collection / has_partition / load_state are extra round trips, so they are only done the first time a
+    # collection is used (or again after an error, in case the collection was dropped or released behind our back).
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._states = {}
+        self._schema = None
+
+    def _collection_lock(self, collection_name):
+        with self._lock:
+            return self._locks.setdefault(collection_name, threading.Lock())
+
+    def _state(self, collection_name, create):
+        state = self._states.get(collection_name)
+        if state is not None:
+            return state
+
+        with self._collection_lock(collection_name):
+            state = self._states.get(collection_name)
+            if state is not None:
+                return state
+
+            milvus()  # connects the first time
+            if utility.has_collection(collection_name):
+                collection = Collection(collection_name)
+                state = CollectionState(collection)
+                state.indexed = collection.has_index()
+                state.loaded = utility.load_state(collection_name).name == "Loaded"
+            elif create:
+                if self._schema is None:
+                    self._schema = build_schema()
+                collection = Collection(name=collection_name, schema=self._schema)
+                logger.info("Collection %s has been created", collection_name)
+                state = CollectionState(collection)
+            else:
+                return None
+
+            if not state.indexed:
+                # Create index for vector column
+                collection.create_index(field_name="embedding", index_params=INDEX_PARAMS)
+                state.indexed = True
+
+            self._states[collection_name] = state
+            return state
+
+    def get(self, collection_name, create=False):
+        # Returns the cached Collection, or None if it does not exist and create is False
+        state = self._state(collection_name, create)
+        return state.collection if state is not None else None
+
+    def state(self, collection_name, create=False):
+        return self._state(collection_name, create)
+
+    def has_partition(self, collection_name, partition_name, create=False):
+        # Partitions we have seen are remembered, unknown ones are checked (and optionally created) on the server.
+        # A partition found missing is not checked again for MILVUS_MISSING_PARTITION_TTL seconds, so searches of
+        # documents without their own partition (inserted before partitions were used) do not pay the round trip.
+        state = self._state(collection_name, create)
+        if state is None:
+            return False
+        if partition_name in state.partitions:
+            return True
+        checked = state.missing_partitions.get(partition_name)
+        if not create and checked is not None and time.monotonic() - checked < MILVUS_MISSING_PARTITION_TTL:
+            return False
+        with self._collection_lock(collection_name):
+            if state.collection.has_partition(partition_name):
+                state.partitions.add(partition_name)
+            elif create:
+                state.collection.create_partition(partition_name)
+                state.partitions.add(partition_name)
+            if partition_name in state.partitions:
+                state.missing_partitions.pop(partition_name, None)
+            else:
+                now = time.monotonic()
+                if len(state.missing_partitions) >= 1000:
+                    state.missing_partitions = {name: at for name, at in state.missing_partitions.items() if now - at < MILVUS_MISSING_PARTITION_TTL}
+                state.missing_partitions[partition_name] = now
+        return partition_name in state.partitions
+
+    def invalidate(self, collection_name):
+        self._states.pop(collection_name, None)
+
+    def call(self, collection_name, func, create=False):
+        # Run func(collection), refreshing the cached handle and retrying once if Milvus reports an error
+        collection = self.get(collection_name, create)
+        if collection is None:
+            return None
+        try:
+            return func(collection)
+        except MilvusException:
+            self.invalidate(collection_name)
+            collection = self.get(collection_name, create)
+            if collection is None:
+                raise
+            return func(collection)
+
+
+collection_registry = CollectionRegistry()
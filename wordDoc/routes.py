@@ -1,84 +1,221 @@
-from openai import OpenAI
-from pymilvus import connections
-from firebase.connection import bucket, db_ref
-
-
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
 from payload import SplitDocQueryPayload, ChatWithPDFPayload
-from wordDoc.chunking.semantic.word import split_handler
-from wordDoc.utils.process_data import process_csv_for_insert, get_embedding
-from wordDoc.milvus.insert import insert_data
-from wordDoc.milvus.query import get_top_n_chunks
+from wordDoc.utils.process_data import aget_embedding, count_chat_tokens
+from clients import async_openai_client, embedding_cache, segment_cache
+from wordDoc.jobs import ingest_jobs
+from wordDoc.vectorstore.base import get_vector_store
+from wordDoc.storage.base import get_storage, UPLOAD_CHUNK_SIZE
+from wordDoc.utils.context import pack_context, CONTEXT_DEDUPLICATE
+from instrumentation import span, record_usage, record_openai_call
 
 import os
+import json
 import uuid
-import tempfile
+import hashlib
+import asyncio
+from tempfile import SpooledTemporaryFile
+from contextlib import asynccontextmanager
+from multipart.multipart import MultipartParser, parse_options_header
 from dotenv import load_dotenv
 load_dotenv()
 
 
-# Milvus Connection
-connections.connect(
-    host=os.getenv("MILVUS_HOST"),
-    port=os.getenv("MILVUS_PORT")
-)
-openai_client = OpenAI()
+chat_model = "gpt-3.5-turbo"
 router = APIRouter()
 
+# Per-stage limits for chat_with_pdf, so a burst of questions queues up here instead of overwhelming the APIs
+CHAT_STAGE_LIMITS = {
+    'embed': int(os.getenv("CHAT_EMBED_CONCURRENCY", 16)),
+    'completion': int(os.getenv("CHAT_COMPLETION_CONCURRENCY", 16))
+}
+_stage_semaphores = {}
+_upload_locks = {}  # sha256 -> [lock, number of uploads holding or waiting for it]
+
+
+def stage_semaphore(stage):
+    # Created on first use so the semaphores belong to the running event loop
+    if stage not in _stage_semaphores:
+        _stage_semaphores[stage] = asyncio.Semaphore(CHAT_STAGE_LIMITS[stage])
+    return _stage_semaphores[stage]
+
+
+class ReceivedFile:
+    # A file field of a multipart request body, spooled to disk past UPLOAD_CHUNK_SIZE and hashed as it was received
+
+    def __init__(self, filename, content_type):
+        self.filename = filename
+        self.content_type = content_type
+        self.file = SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE)
+        self.sha256 = hashlib.sha256()
+
+    def append(self, data):
+        self.sha256.update(data)
+        self.file.write(data)
+
+
+async def receive_file(request, field):
+    # Parse the multipart body as it streams in and return the ReceivedFile of `field` (None if it is missing), so
+    # the document is hashed on the way in instead of being read again from starlette's spooled copy
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+
+    loop = asyncio.get_event_loop()
+    received, current = None, None
+    headers, header_field, header_value, pending = {}, [], [], []
+
+    def on_part_begin():
+        nonlocal current
+        current = None
+        headers.clear()
+
+    def on_header_field(data, start, end):
+        header_field.append(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.append(data[start:end])
+
+    def on_header_end():
+        headers[b"".join(header_field).lower()] = b"".join(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        nonlocal received, current
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        if received is None and options.get(b"name") == field.encode() and b"filename" in options:
+            received = current = ReceivedFile(options[b"filename"].decode("utf-8", "replace"), headers.get(b"content-type", b"").decode("latin-1") or None)
+
+    def on_part_data(data, start, end):
+        if current is not None:
+            pending.append(data[start:end])
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                data = b"".join(pending)
+                pending.clear()
+                # Hashing and writing to the spooled file (on disk past its max size) block, do them off the event loop
+                await loop.run_in_executor(None, received.append, data)
+        parser.finalize()
+    except BaseException:
+        if received is not None:
+            received.file.close()
+        raise
+    if received is not None:
+        received.file.seek(0)
+    return received
+
+
+@asynccontextmanager
+async def upload_lock(sha256):
+    # Uploads of the same bytes are serialised so that only the first one stores the document
+    entry = _upload_locks.setdefault(sha256, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _upload_locks[sha256]
+
+
+UPLOAD_REQUEST_BODY = {
+    # The body is parsed by receive_file rather than by FastAPI, describe it for the OpenAPI docs
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}
+    }}}
+}
+
+
+@router.post("/api/upload_doc", openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
+async def upload_doc(request: Request):
+    file = await receive_file(request, "file")
+    if file is None:
+        raise HTTPException(status_code=422, detail="No file uploaded")
+    try:
+        _, ext = os.path.splitext(file.filename)
+        if ext.lower() not in ('.docx', '.pdf'):
+            raise HTTPException(status_code=401, detail="File is not a Word or PDF document")
+        return await store_upload(file, ext)
+    finally:
+        file.file.close()
 
-@router.post("/api/upload_doc")
-async def upload_doc(file: UploadFile = File(...)):
-    if not file.filename.endswith('.docx'):
-        raise HTTPException(status_code=401, detail="File is not a Word document")
 
+async def store_upload(file, ext):
     try:
-        # Generate a unique filename
-        file_uuid = str(uuid.uuid4())
-        unique_filename = file_uuid + ".docx"
+        blob_store, document_index = get_storage()
+        sha256 = file.sha256.hexdigest()
 
-        blob = bucket.blob(f'wordDoc/{unique_filename}')
-        blob.upload_from_string(await file.read(), content_type=file.content_type)
+        async with upload_lock(sha256):
+            existing = await document_index.find_by_hash(sha256)
+            if existing is not None:
+                # Already uploaded (and most likely ingested), hand back the same document
+                return {"file_uuid": existing["file_uuid"], "storage_path": existing["storage_path"], "duplicate": True}
 
-        # Get the URL of the uploaded file
-        blob.make_public()
-        file_url = blob.public_url
+            # Generate a unique filename, the extension tells the ingestion job which reader to use
+            file_uuid = str(uuid.uuid4())
+            unique_filename = file_uuid + ext.lower()
+            file_url = await blob_store.upload(f'wordDoc/{unique_filename}', file.file, file.content_type)
 
-        db_ref.child('uploaded_docs').push({
-            'filename': unique_filename,
-            'storage_path': file_url
-        })
+            await document_index.add({
+                'file_uuid': file_uuid,
+                'filename': unique_filename,
+                'storage_path': file_url,
+                'sha256': sha256
+            })
 
-        return { "file_uuid": file_uuid, "storage_path": file_url }
+        return { "file_uuid": file_uuid, "storage_path": file_url, "duplicate": False }
     except Exception as e:
         return {"error": str(e)}
 
 
-@router.post("/api/split_doc")
+@router.post("/api/split_doc", status_code=202)
 async def split_docs(payload: SplitDocQueryPayload):
-    # download document from cloud storage into a tmp dir
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        blob = bucket.blob(payload.doc_path)
-        # Use the filename as the uuid
-        file_name_with_ext = os.path.basename(payload.doc_path)
-        file_uuid, _ = os.path.splitext(file_name_with_ext)
+    # Ingestion runs in the background, poll /api/split_doc/{job_id} for its progress
+    job_id = await ingest_jobs.submit(payload.model_dump())
+    return {
+        'job_id': job_id,
+        'status': 'queued'
+    }
 
-        local_file_path = os.path.join(tmp_dir, "temp_doc.docx")
-        blob.download_to_filename(local_file_path)
 
-        # split the word doc and produce a dataframe
-        await split_handler(tmp_dir, f"{tmp_dir}_out")
+@router.get("/api/split_doc/{job_id}")
+async def split_doc_status(job_id: str):
+    job = await ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-        # insert the dataframe into milvus
-        milvus_data = process_csv_for_insert(os.path.join(f"{tmp_dir}_out", "combined.csv"), file_uuid)
-        await insert_data(milvus_data, payload.collection_name)
 
-    return {
-        'message': 'Records have been inserted'
-    }
+@router.get("/api/embedding_cache_stats")
+async def embedding_cache_stats():
+    return await asyncio.get_event_loop().run_in_executor(None, lambda: embedding_cache().stats())
 
 
-@router.post("/api/chat_with_pdf")
-async def chat_with_pdf(payload: ChatWithPDFPayload):
+@router.get("/api/segment_cache_stats")
+async def segment_cache_stats():
+    return await asyncio.get_event_loop().run_in_executor(None, lambda: segment_cache().stats())
+
+
+def build_system_prompt(context_for_gpt):
+    return "You are a super intelligent agent, who knows the following information: \n\n" + context_for_gpt + "\n\n You will only answer user's question based on these information, and if user's question are unrelated or the answers cannot be found in the context, you will refuse to answer user's question"
+
+
+async def retrieve_chat_context(payload):
+    # Shared by the JSON and the streaming chat endpoints, returns the messages for ChatGPT and the ids of the chunks used
     if not payload.user_question:
         raise HTTPException(status_code=401, detail="Please provide a user question")
     if not payload.user_id:
@@ -87,35 +224,87 @@ async def chat_with_pdf(payload: ChatWithPDFPayload):
         raise HTTPException(status_code=401, detail="File id not found")
     
     # 1. Convert user's query to embeddings
-    search_vector = get_embedding(payload.user_question)
-
-    # 2. look up the top 10 relevant chunks
-    top_10_chunks = get_top_n_chunks(
-        payload.user_id, search_vector, f"file_id == '{payload.pdf_id}'", ["file_id", "content", "num_tokens"], 10
-    )
-
-    # 3. Feed these relevant chunks to ChatGPT
-    context_for_gpt = ''
-    token_count, token_thresh = 0, 10000
-    for chunk in top_10_chunks:
-        entity = chunk.entity
-        token_count += int(entity.get('num_tokens'))
-        if token_count >= token_thresh:
-            break
-        
-        context_for_gpt += entity.get('content')
-        context_for_gpt += "\n"
+    async with stage_semaphore('embed'):
+        with span('embed'):
+            search_vector = await aget_embedding(payload.user_question)
+
+    # 2. look up the top 10 relevant chunks (each vector store backend bounds its own concurrent searches)
+    output_fields = ["file_id", "content", "num_tokens"] + (["embedding"] if CONTEXT_DEDUPLICATE else [])
+    with span('search'):
+        top_10_chunks = await get_vector_store().search(
+            payload.user_id, search_vector, payload.pdf_id, output_fields, 10
+        )
+
+    # 3. Feed the best of these chunks that fit in the token budget to ChatGPT
+    context_for_gpt, chunk_ids, _ = pack_context(top_10_chunks)
+
+    messages = [
+        {"role": "system", "content": build_system_prompt(context_for_gpt)},
+        {"role": "user", "content": "I want to know: " + payload.user_question}
+    ]
+    return messages, chunk_ids
+
+
+@router.post("/api/chat_with_pdf")
+async def chat_with_pdf(payload: ChatWithPDFPayload):
+    messages, _ = await retrieve_chat_context(payload)
 
     # 4. Collate the information from each individual API calls
-    completion = openai_client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a super intelligent agent, who knows the following information: \n\n" + context_for_gpt + "\n\n You will only answer user's question based on these information, and if user's question are unrelated or the answers cannot be found in the context, you will refuse to answer user's question"},
-            {"role": "user", "content": "I want to know: " + payload.user_question}
-        ]
-    )
+    async with stage_semaphore('completion'):
+        with span('completion'):
+            completion = await async_openai_client().chat.completions.create(
+                model=chat_model,
+                messages=messages
+            )
+    record_usage('chat', completion)
 
     return {
         'code': 200,
         'message': completion.choices[0].message.content
-    }
\ No newline at end of file
+    }
+
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+@router.post("/api/chat_with_pdf/stream")
+async def chat_with_pdf_stream(payload: ChatWithPDFPayload):
+    # Same as chat_with_pdf but sends the answer as Server-Sent Events while ChatGPT generates it:
+    # one "data" event per token and a final "done" event with the chunks used and the token counts
+    messages, chunk_ids = await retrieve_chat_context(payload)
+
+    async def generate():
+        answer = []
+        try:
+            async with stage_semaphore('completion'):
+                with span('completion', stream=True):
+                    completion = await async_openai_client().chat.completions.create(
+                        model=chat_model,
+                        messages=messages,
+                        stream=True
+                    )
+                    async for chunk in completion:
+                        if not chunk.choices:
+                            continue
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            answer.append(content)
+                            yield sse_event({'token': content})
+        except Exception as e:
+            yield sse_event({'error': str(e)}, event='error')
+            return
+
+        with span('tokenize'):
+            prompt_tokens, completion_tokens = await asyncio.get_event_loop().run_in_executor(
+                None, count_chat_tokens, messages, ''.join(answer)
+            )
+        record_openai_call('chat', prompt_tokens, completion_tokens)
+        yield sse_event({
+            'chunk_ids': chunk_ids,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens
+        }, event='done')
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={'Cache-Control': 'no-cache'})
@@ -0,0 +1,55 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firebase")  # "firebase" or "local"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # bytes read (and sent) at a time, a multiple of 256KB as Cloud Storage requires
+
+
+class BlobStore:
+    # Where uploaded documents are kept, paths look like "wordDoc/<file_uuid>.docx"
+
+    async def upload(self, path, fileobj, content_type):
+        # Stream fileobj to path in UPLOAD_CHUNK_SIZE chunks, returns the URL of the stored document
+        raise NotImplementedError
+
+    async def download(self, path, local_path):
+        raise NotImplementedError
+
+
+class DocumentIndex:
+    # Records of the uploaded documents, looked up by the sha256 of their content to skip duplicate uploads.
+    # A record is a dict with file_uuid, filename, storage_path and sha256.
+
+    async def find_by_hash(self, sha256):
+        raise NotImplementedError
+
+    async def add(self, record):
+        raise NotImplementedError
+
+
+_storage = None
+
+
+def get_storage():
+    # Returns (blob store, document index), backends are imported on first use so the local one never needs firebase credentials
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "local":
+            from wordDoc.storage.local_storage import LocalBlobStore, LocalDocumentIndex
+            _storage = (LocalBlobStore(), LocalDocumentIndex())
+        elif STORAGE_BACKEND == "firebase":
+            from wordDoc.storage.firebase_storage import FirebaseBlobStore, FirebaseDocumentIndex
+            _storage = (FirebaseBlobStore(), FirebaseDocumentIndex())
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND}, expected 'firebase' or 'local'")
+    return _storage
+
+
+def get_blob_store():
+    return get_storage()[0]
+
+
+def get_document_index():
+    return get_storage()[1]
@@ -0,0 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from clients import firebase
+from wordDoc.storage.base import BlobStore, DocumentIndex, UPLOAD_CHUNK_SIZE
+
+# The firebase SDKs are blocking, their calls run here instead of on the event loop
+firebase_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="firebase")
+
+
+async def _run(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(firebase_executor, func, *args)
+
+
+class FirebaseBlobStore(BlobStore):
+
+    def _upload(self, path, fileobj, content_type):
+        blob = firebase().bucket.blob(path, chunk_size=UPLOAD_CHUNK_SIZE)  # resumable upload, one chunk in memory at a time
+        blob.upload_from_file(fileobj, content_type=content_type, rewind=True)
+        blob.make_public()
+        return blob.public_url
+
+    async def upload(self, path, fileobj, content_type):
+        return await _run(self._upload, path, fileobj, content_type)
+
+    async def download(self, path, local_path):
+        await _run(lambda: firebase().bucket.blob(path).download_to_filename(local_path))
+
+
+class FirebaseDocumentIndex(DocumentIndex):
+    # Records are pushed to uploaded_docs as before and also kept under uploaded_docs_by_hash/<sha256>,
+    # so a duplicate is found with one read and without an .indexOn rule
+
+    async def find_by_hash(self, sha256):
+        return await _run(lambda: firebase().db_ref.child('uploaded_docs_by_hash').child(sha256).get())
+
+    def _add(self, record):
+        db_ref = firebase().db_ref
+        db_ref.child('uploaded_docs').push(record)
+        db_ref.child('uploaded_docs_by_hash').child(record['sha256']).set(record)
+
+    async def add(self, record):
+        await _run(self._add, record)
@@ -0,0 +1,91 @@
+import os
+import time
+import shutil
+import sqlite3
+import asyncio
+import threading
+from wordDoc.storage.base import BlobStore, DocumentIndex, UPLOAD_CHUNK_SIZE
+from dotenv import load_dotenv
+load_dotenv()
+
+
+LOCAL_STORAGE_PATH = os.getenv("LOCAL_STORAGE_PATH", os.path.join(".cache", "storage"))
+
+
+async def _run(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+class LocalBlobStore(BlobStore):
+    # Filesystem stand-in for the Firebase bucket, for tests, benchmarks and offline development
+
+    def __init__(self, path=LOCAL_STORAGE_PATH):
+        self.path = os.path.join(path, "blobs")
+
+    def _local_path(self, path):
+        local_path = os.path.abspath(os.path.join(self.path, path))
+        if not local_path.startswith(os.path.abspath(self.path) + os.sep):
+            raise ValueError(f"Invalid blob path {path}")
+        return local_path
+
+    def _upload(self, path, fileobj, content_type):
+        local_path = self._local_path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        fileobj.seek(0)
+        tmp_path = local_path + ".part"
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(fileobj, f, UPLOAD_CHUNK_SIZE)
+        os.replace(tmp_path, local_path)
+        return "file://" + local_path
+
+    async def upload(self, path, fileobj, content_type):
+        return await _run(self._upload, path, fileobj, content_type)
+
+    async def download(self, path, local_path):
+        await _run(shutil.copyfile, self._local_path(path), local_path)
+
+
+class LocalDocumentIndex(DocumentIndex):
+
+    def __init__(self, path=LOCAL_STORAGE_PATH):
+        self.path = os.path.join(path, "documents.sqlite3")
+        self._local = threading.local()
+        os.makedirs(path, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    sha256 TEXT PRIMARY KEY,
+                    file_uuid TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    storage_path TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _find_by_hash(self, sha256):
+        row = self._connection().execute(
+            "SELECT sha256, file_uuid, filename, storage_path FROM documents WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    async def find_by_hash(self, sha256):
+        return await _run(self._find_by_hash, sha256)
+
+    def _add(self, record):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO documents (sha256, file_uuid, filename, storage_path, created_at) VALUES (?, ?, ?, ?, ?)",
+                (record["sha256"], record["file_uuid"], record["filename"], record["storage_path"], time.time())
+            )
+
+    async def add(self, record):
+        await _run(self._add, record)
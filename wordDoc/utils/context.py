@@ -0,0 +1,67 @@
+import os
+import re
+import numpy as np
+from clients import tokenizer
+from dotenv import load_dotenv
+load_dotenv()
+
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 10000))  # max tokens of retrieved chunks sent to ChatGPT
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", 0.95))  # cosine similarity above which a chunk is a duplicate
+CONTEXT_DEDUPLICATE = os.getenv("CONTEXT_DEDUPLICATE", "1") == "1"  # needs the embeddings returned with the search hits
+MIN_PARTIAL_TOKENS = 100  # a chunk is only trimmed if at least this much of it fits
+
+sentence_end = re.compile(r'(?<=[.!?。])\s+|\n+')
+
+
+def duplicate_mask(embeddings, threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    # duplicates[i] is True if hit i is too similar to a better ranked hit
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = np.triu(vectors @ vectors.T, k=1)  # only compare against the hits ranked above
+    return (similarity >= threshold).any(axis=0)
+
+
+def trim_to_sentences(content, token_limit):
+    # Keep as many whole sentences from the start of content as fit in token_limit
+    sentences = [sentence for sentence in sentence_end.split(content) if sentence]
+    kept, num_tokens = [], 0
+    for sentence, tokens in zip(sentences, tokenizer().encode_batch(sentences, disallowed_special=())):
+        if num_tokens + len(tokens) + 1 > token_limit:
+            break
+        kept.append(sentence)
+        num_tokens += len(tokens) + 1
+    return ' '.join(kept), num_tokens
+
+
+def pack_context(hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    # Build the context for ChatGPT from search hits in rank order. Near duplicates are skipped, a chunk that does
+    # not fit does not stop smaller ones after it, and the last chunk is cut at a sentence boundary to fill the budget.
+    # Returns the context, the ids of the chunks used and the number of tokens used.
+    entities = [hit.entity for hit in hits]
+    skip = [False] * len(hits)
+    embeddings = [entity.get('embedding') for entity in entities]
+    if CONTEXT_DEDUPLICATE and len(hits) > 1 and all(embedding is not None for embedding in embeddings):
+        skip = duplicate_mask(embeddings).tolist()
+
+    parts, chunk_ids = [], []
+    token_count = 0
+    for hit, entity, duplicate in zip(hits, entities, skip):
+        if duplicate:
+            continue
+        remaining = token_budget - token_count
+        if remaining < MIN_PARTIAL_TOKENS:
+            break
+
+        content = entity.get('content')
+        num_tokens = int(entity.get('num_tokens'))
+        if num_tokens > remaining:
+            content, num_tokens = trim_to_sentences(content, remaining)
+            if num_tokens < MIN_PARTIAL_TOKENS:
+                continue
+
+        parts.append(content)
+        chunk_ids.append(hit.id)
+        token_count += num_tokens
+
+    return '\n'.join(parts) + '\n' if parts else '', chunk_ids, token_count
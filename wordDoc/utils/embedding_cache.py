@@ -0,0 +1,116 @@
+import os
+import time
+import hashlib
+from array import array
+from wordDoc.utils.sqlite_cache import SQLiteCache, USAGE_BATCH
+from instrumentation import record_cache
+from dotenv import load_dotenv
+load_dotenv()
+
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 100000))  # ~6KB per ada-002 vector
+EMBEDDING_CACHE_USAGE_INTERVAL = float(os.getenv("EMBEDDING_CACHE_USAGE_INTERVAL", 30))  # seconds between writes of last_used and hits
+
+
+def normalize_text(text):
+    # Whitespace differences (newlines, double spaces) should not produce a different cache entry
+    return ' '.join(text.split())
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(SQLiteCache):
+    # Content addressed embedding cache stored in SQLite, vectors are kept as float32 blobs.
+
+    table = "embeddings"
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 usage_interval=EMBEDDING_CACHE_USAGE_INTERVAL, usage_batch=USAGE_BATCH):
+        # Counters for this process, the totals across all workers are kept in the stats table
+        self.hits = 0
+        self.misses = 0
+        self.api_seconds = 0.0
+        super().__init__(path, max_entries, usage_interval, usage_batch)
+
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+        conn.executemany("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)", [("hits",), ("misses",), ("api_seconds",)])
+
+    def get_many(self, model, texts):
+        # Returns {index in texts: embedding} for the texts which are already cached
+        keys = [cache_key(model, text) for text in texts]
+        unique_keys = list(set(keys))
+        found = {}
+        conn = self._connection()
+        # Stay under SQLite's limit on the number of bound parameters
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for key, blob in conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk):
+                found[key] = array("f", blob).tolist()
+
+        hits = {i: found[key] for i, key in enumerate(keys) if key in found}
+        if hits:
+            with self._lock:
+                self.hits += len(hits)
+            self._record_usage(found, len(hits))
+        record_cache("embedding", len(hits), len(texts) - len(hits))
+        return hits
+
+    def _write_hits(self, conn, hits):
+        conn.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (hits,))
+
+    def put_many(self, model, texts, embeddings, api_seconds=0.0):
+        # Store freshly generated embeddings, api_seconds is the time spent fetching them from the API
+        now = time.time()
+        rows = [(cache_key(model, text), model, array("f", embedding).tobytes(), now) for text, embedding in zip(texts, embeddings)]
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (len(rows),))
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'api_seconds'", (api_seconds,))
+            self._write_usage(conn)  # we hold the write lock anyway, and eviction needs the recent last_used times
+            self._evict(conn, len(rows))
+        with self._lock:
+            self.misses += len(rows)
+            self.api_seconds += api_seconds
+
+    def stats(self):
+        conn = self._connection()
+        with conn:
+            self._write_usage(conn)
+        totals = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries = self._count(conn)
+
+        def summarise(hits, misses, api_seconds):
+            # Every hit is one embedding we did not have to request, estimate the time saved from the average miss
+            avg_latency = api_seconds / misses if misses else 0.0
+            return {
+                "hits": int(hits),
+                "misses": int(misses),
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "api_seconds": api_seconds,
+                "estimated_seconds_saved": hits * avg_latency
+            }
+
+        with self._lock:
+            process = summarise(self.hits, self.misses, self.api_seconds)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "process": process,
+            "total": summarise(totals["hits"], totals["misses"], totals["api_seconds"])
+        }
+
@@ -0,0 +1,84 @@
+import os
+import time
+import asyncio
+from wordDoc.utils.process_data import process_sections_for_insert
+from wordDoc.vectorstore.base import get_vector_store
+from instrumentation import record_stage
+from dotenv import load_dotenv
+load_dotenv()
+
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))  # max sections embedded and inserted together
+
+
+def _no_progress(stage, seconds, num_sections, finished=False):
+    pass
+
+
+async def ingest_sections(sections, file_id, collection_name, batch_size=INGEST_BATCH_SIZE, on_progress=_no_progress):
+    # Stream [documentTitle, referenceMarker, content, pageNumber] rows from an async iterator straight into the vector store.
+    # Segmenting, embedding and inserting run as separate stages connected by bounded queues, so a batch is
+    # searchable as soon as it is inserted and only a few batches are ever held in memory.
+    # on_progress(stage, seconds, num_sections, finished) is called after every unit of work of each stage.
+    section_queue = asyncio.Queue(maxsize=batch_size * 2)
+    insert_queue = asyncio.Queue(maxsize=2)
+    loop = asyncio.get_event_loop()
+    num_inserted = 0
+
+    async def segment():
+        start = time.perf_counter()
+        async for section in sections:
+            on_progress('segment', time.perf_counter() - start, 1)
+            await section_queue.put(section)
+            start = time.perf_counter()
+        on_progress('segment', time.perf_counter() - start, 0, finished=True)
+        await section_queue.put(None)
+
+    async def embed():
+        done = False
+        while not done:
+            # Take whatever is ready (up to batch_size) so batches stay small while the LLM is the bottleneck
+            batch = [await section_queue.get()]
+            while len(batch) < batch_size and not section_queue.empty():
+                batch.append(section_queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                contents = [section[2] for section in batch]
+                page_numbers = [section[3] if len(section) > 3 else None for section in batch]
+                start = time.perf_counter()
+                milvus_data = await loop.run_in_executor(None, process_sections_for_insert, contents, file_id, page_numbers)
+                record_stage('embed', time.perf_counter() - start, sections=len(contents))
+                on_progress('embed', time.perf_counter() - start, len(contents))
+                await insert_queue.put(milvus_data)
+        on_progress('embed', 0, 0, finished=True)
+        await insert_queue.put(None)
+
+    async def insert():
+        nonlocal num_inserted
+        vector_store = get_vector_store()
+        await vector_store.create(collection_name)
+        while True:
+            milvus_data = await insert_queue.get()
+            if milvus_data is None:
+                break
+            start = time.perf_counter()
+            await vector_store.insert(collection_name, milvus_data)
+            record_stage('insert', time.perf_counter() - start, sections=len(milvus_data[0]))
+            num_inserted += len(milvus_data[0])
+            on_progress('insert', time.perf_counter() - start, len(milvus_data[0]))
+        # The document is complete, let the backend index what it buffered
+        start = time.perf_counter()
+        await vector_store.flush(collection_name)
+        on_progress('insert', time.perf_counter() - start, 0, finished=True)
+
+    tasks = [asyncio.ensure_future(stage()) for stage in (segment, embed, insert)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    return num_inserted
@@ -1,47 +1,149 @@
+import os
 import csv
-import tiktoken
-from openai import OpenAI
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from clients import openai_client, async_openai_client, tokenizer, embedding_cache
+from wordDoc.utils.embedding_cache import cache_key
+from instrumentation import span, record_usage
 from dotenv import load_dotenv
 load_dotenv()
 
 
-client = OpenAI()
 gen_model = "gpt-3.5-turbo-16k"
-enc = tiktoken.encoding_for_model(gen_model)  # For counting tokens when feeding the corresponding text into model
+embedding_model = "text-embedding-ada-002"
 
+# Limits for packing several texts into a single embeddings request
+EMBEDDING_BATCH_TOKEN_LIMIT = int(os.getenv("EMBEDDING_BATCH_TOKEN_LIMIT", 50000))
+EMBEDDING_BATCH_SIZE_LIMIT = int(os.getenv("EMBEDDING_BATCH_SIZE_LIMIT", 2048))  # max inputs the API accepts per request
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))  # embeddings requests in flight at once
 
-def get_embedding(text, model="text-embedding-ada-002"):
-   text = text.replace("\n", " ")
-   return client.embeddings.create(input = [text], model=model).data[0].embedding
 
+def get_embedding(text, model=embedding_model):
+   cached = embedding_cache().get_many(model, [text])
+   if cached:
+      return cached[0]
 
-def process_csv_for_insert(csv_filepath, file_id):
-    with open(csv_filepath, mode='r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        next(reader, None)  # Skip the header
+   start = time.perf_counter()
+   response = openai_client().embeddings.create(input = [text.replace("\n", " ")], model=model)
+   record_usage("embeddings", response)
+   embedding = response.data[0].embedding
+   embedding_cache().put_many(model, [text], [embedding], time.perf_counter() - start)
+   return embedding
+
+
+async def aget_embedding(text, model=embedding_model):
+   # Same as get_embedding but never blocks the event loop, the SQLite cache is accessed from a worker thread
+   loop = asyncio.get_event_loop()
+   cached = await loop.run_in_executor(None, lambda: embedding_cache().get_many(model, [text]))
+   if cached:
+      return cached[0]
+
+   start = time.perf_counter()
+   response = await async_openai_client().embeddings.create(input = [text.replace("\n", " ")], model=model)
+   record_usage("embeddings", response)
+   embedding = response.data[0].embedding
+   seconds = time.perf_counter() - start
+   await loop.run_in_executor(None, lambda: embedding_cache().put_many(model, [text], [embedding], seconds))
+   return embedding
+
+
+def count_chat_tokens(messages, answer):
+    # Special token text such as <|endoftext|> in a prompt or answer is counted as plain text instead of raising
+    enc = tokenizer()
+    prompt_tokens = sum(len(enc.encode(message['content'], disallowed_special=())) for message in messages)
+    return prompt_tokens, len(enc.encode(answer, disallowed_special=()))
+
+
+def batch_by_token_limit(token_counts, token_limit=EMBEDDING_BATCH_TOKEN_LIMIT, size_limit=EMBEDDING_BATCH_SIZE_LIMIT):
+    # Group consecutive texts into (start, end) ranges whose total token count stays under token_limit.
+    # A single text larger than the limit is sent on its own.
+    batches = []
+    start, batch_tokens = 0, 0
+    for i, num_tokens in enumerate(token_counts):
+        if i > start and (batch_tokens + num_tokens > token_limit or i - start >= size_limit):
+            batches.append((start, i))
+            start, batch_tokens = i, 0
+        batch_tokens += num_tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def _embed_batch(texts, model):
+    start = time.perf_counter()
+    response = openai_client().embeddings.create(input=[text.replace("\n", " ") for text in texts], model=model)
+    record_usage("embeddings", response)
+    # The API tags every embedding with the index of its input, use it rather than relying on response order
+    embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    embedding_cache().put_many(model, texts, embeddings, time.perf_counter() - start)
+    return embeddings
 
-        # 1. convert CSV file into the specific JSON format which Milvus accepts
-        milvus_data = [[] for i in range(4)]
 
-        for row in reader:
-            if row:
-                # Assuming each row in the CSV file is delimited by comma
-                # each row is in the format of <document_title>, <reference_marker>, <content>, <page_number>
-                content = row[2]
+def get_embeddings(texts, model=embedding_model, token_counts=None):
+    # Embed many texts with as few requests as possible, returning the embeddings in the same order as texts
+    if token_counts is None:
+        with span("tokenize"):
+            token_counts = [len(tokens) for tokens in tokenizer().encode_batch(texts, disallowed_special=())]
 
-                # 2. for each row, get the embeddings via the OpenAI api
-                content_embedding = get_embedding(content)
+    # Only the texts missing from the cache are sent to the API, repeated texts are sent once
+    embeddings = embedding_cache().get_many(model, texts)
+    missing = {}
+    for i, text in enumerate(texts):
+        if i not in embeddings:
+            missing.setdefault(cache_key(model, text), []).append(i)
+    missing_rows = [rows[0] for rows in missing.values()]
+    missing_texts = [texts[i] for i in missing_rows]
 
-                # 3. Get the number of tokens for that chunk, in case it goes out of GPT's limit during RAG implemenetation
-                num_tokens = len(enc.encode(content))
+    batches = batch_by_token_limit([token_counts[i] for i in missing_rows])
+    with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+        # executor.map yields results in submission order, so the rows stay in order
+        results = executor.map(lambda batch: _embed_batch(missing_texts[batch[0]:batch[1]], model), batches)
+        missing_embeddings = []
+        for batch_embeddings in results:
+            missing_embeddings.extend(batch_embeddings)
 
-                # 4. Prepare the data in this sequence
-                milvus_data[0].append(file_id)
+    for rows, embedding in zip(missing.values(), missing_embeddings):
+        for i in rows:
+            embeddings[i] = embedding
+    return [embeddings[i] for i in range(len(texts))]
+
+
+def process_sections_for_insert(contents, file_id, page_numbers=None):
+    # 1. Get the number of tokens for every chunk in one pass, in case it goes out of GPT's limit during RAG implemenetation
+    with span("tokenize"):
+        token_counts = [len(tokens) for tokens in tokenizer().encode_batch(contents, disallowed_special=())]
+
+    # 2. get the embeddings via the OpenAI api, packing many rows into each request
+    content_embeddings = get_embeddings(contents, token_counts=token_counts)
+
+    # 3. convert the rows into the columns (in the order of wordDoc.vectorstore.base.FIELDS) which the vector store accepts
+    if page_numbers is None:
+        page_numbers = [None] * len(contents)
+    milvus_data = [[] for i in range(5)]
+    for content, content_embedding, num_tokens, page_number in zip(contents, content_embeddings, token_counts, page_numbers):
+        # Prepare the data in this sequence
+        milvus_data[0].append(file_id)
+
+        # TODO: new column called description (generated by openai from the content)
+
+        milvus_data[1].append(content_embedding)
+        milvus_data[2].append(content)
+        milvus_data[3].append(num_tokens)
+        milvus_data[4].append(int(page_number) if page_number not in (None, '') else 0)  # 0 when the page is unknown (eg. Word documents)
+
+    return milvus_data
+
+
+def process_csv_for_insert(csv_filepath, file_id):
+    with open(csv_filepath, mode='r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Skip the header
 
-                # TODO: new column called description (generated by openai from the content)
-                
-                milvus_data[1].append(content_embedding)
-                milvus_data[2].append(content)
-                milvus_data[3].append(num_tokens)
+        # Assuming each row in the CSV file is delimited by comma
+        # each row is in the format of <document_title>, <reference_marker>, <content>, <page_number>
+        rows = [row for row in reader if row]
 
-        return milvus_data
\ No newline at end of file
+    contents = [row[2] for row in rows]
+    page_numbers = [row[3] if len(row) > 3 else None for row in rows]
+    return process_sections_for_insert(contents, file_id, page_numbers)
@@ -0,0 +1,101 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+USAGE_BATCH = 1000  # hit keys which trigger the write of their last_used times before usage_interval is over
+EVICT_TO = 0.9  # eviction goes down to this fraction of max_entries, so the next one is max_entries / 10 inserts away
+
+
+class SQLiteCache:
+    # Least recently used cache kept in one SQLite table with a `key` and a `last_used` column, shared by the embedding
+    # and segment caches. SQLite in WAL mode lets every uvicorn worker process read and write the same file,
+    # each thread gets its own connection since sqlite3 connections cannot be shared across threads.
+    # Lookups only read: the last_used times and hit counts they produce are kept in memory and written in one
+    # transaction every usage_interval seconds (or usage_batch keys), so readers do not queue for SQLite's write lock.
+    # Subclasses set `table` and create their tables in _create_tables.
+
+    table = None
+
+    def __init__(self, path, max_entries, usage_interval, usage_batch=USAGE_BATCH):
+        self.path = path
+        self.max_entries = max_entries
+        self.usage_interval = usage_interval
+        self.usage_batch = usage_batch
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._used = {}  # key -> last time it was hit, not written yet
+        self._unwritten_hits = 0
+        self._usage_written = time.monotonic()
+        self._entries = None  # rows in the table as far as this process knows, counted again before evicting
+        self._inserted = 0  # rows this process inserted since it last counted them
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            self._create_tables(conn)
+
+    def _create_tables(self, conn):
+        raise NotImplementedError
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _record_usage(self, keys, hits):
+        # Remember that keys were hit (hits times in all), they are written once enough of them or enough time went by
+        now = time.time()
+        with self._lock:
+            self._unwritten_hits += hits
+            self._used.update((key, now) for key in keys)
+            due = len(self._used) >= self.usage_batch or time.monotonic() - self._usage_written >= self.usage_interval
+        if due:
+            conn = self._connection()
+            with conn:
+                self._write_usage(conn)
+
+    def _write_usage(self, conn):
+        # Write the last_used times and hit count gathered since the last call, inside the caller's transaction
+        with self._lock:
+            used, hits = self._used, self._unwritten_hits
+            self._used, self._unwritten_hits = {}, 0
+            self._usage_written = time.monotonic()
+        if used:
+            conn.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", [(now, key) for key, now in used.items()])
+        if hits:
+            self._write_hits(conn, hits)
+
+    def _write_hits(self, conn, hits):
+        # Caches keeping totals across processes add the hits to them here
+        pass
+
+    def _evict(self, conn, inserted):
+        # Drop the least recently used entries once the cache grows past max_entries. The table is only counted when
+        # this process' own tally goes over the limit or every max_entries / 10 of its inserts, to see the other workers'.
+        with self._lock:
+            if self._entries is not None:
+                self._entries += inserted
+            self._inserted += inserted
+            due = self._entries is None or self._entries > self.max_entries or self._inserted >= self.max_entries * (1 - EVICT_TO)
+        if not due:
+            return
+        count = self._count(conn)
+        if count > self.max_entries:
+            keep = int(self.max_entries * EVICT_TO)
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)",
+                (count - keep,)
+            )
+            count = keep
+        with self._lock:
+            self._entries, self._inserted = count, 0
+
+    def _count(self, conn):
+        return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
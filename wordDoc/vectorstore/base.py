@@ -0,0 +1,60 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "milvus")  # "milvus" or "local"
+
+# Column order of the data passed to VectorStore.insert, as produced by process_sections_for_insert
+FIELDS = ["file_id", "embedding", "content", "num_tokens", "page_number"]
+
+
+class Hit:
+    # Search result with the same attributes as a pymilvus hit: id, distance and entity.get(field)
+
+    def __init__(self, id, distance, entity):
+        self.id = id
+        self.distance = distance
+        self.entity = entity
+
+    def __repr__(self):
+        return f"Hit(id={self.id}, distance={self.distance})"
+
+
+class VectorStore:
+    # Interface shared by the Milvus server and the embedded local engine.
+    # data is a list of columns in the order of FIELDS, searches are restricted to one file_id unless it is None.
+
+    async def create(self, collection_name):
+        raise NotImplementedError
+
+    async def insert(self, collection_name, data):
+        raise NotImplementedError
+
+    async def flush(self, collection_name):
+        # Called once a batch of inserts (eg. a whole document) is done, for backends which buffer or index lazily
+        pass
+
+    async def search(self, collection_name, vector, file_id, output_fields, limit):
+        raise NotImplementedError
+
+    async def delete(self, collection_name, file_id):
+        raise NotImplementedError
+
+
+_vector_store = None
+
+
+def get_vector_store():
+    # Backends are imported on first use so that the local engine never needs pymilvus or a Milvus server
+    global _vector_store
+    if _vector_store is None:
+        if VECTOR_STORE == "local":
+            from wordDoc.vectorstore.local_store import LocalVectorStore
+            _vector_store = LocalVectorStore()
+        elif VECTOR_STORE == "milvus":
+            from wordDoc.vectorstore.milvus_store import MilvusVectorStore
+            _vector_store = MilvusVectorStore()
+        else:
+            raise ValueError(f"Unknown VECTOR_STORE {VECTOR_STORE}, expected 'milvus' or 'local'")
+    return _vector_store
@@ -0,0 +1,317 @@
+import os
+import fcntl
+import sqlite3
+import asyncio
+import threading
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from wordDoc.vectorstore.base import VectorStore, Hit
+from dotenv import load_dotenv
+load_dotenv()
+
+
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", os.path.join(".cache", "vectors"))
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")  # float32, float16 or int8 (with a scale per vector)
+LOCAL_IVF_MIN_ROWS = int(os.getenv("LOCAL_IVF_MIN_ROWS", 20000))  # searches over more rows than this go through the IVF index
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", 8))  # number of IVF lists scanned per search
+LOCAL_VECTOR_STORE_WORKERS = int(os.getenv("LOCAL_VECTOR_STORE_WORKERS", 4))
+EMBEDDING_DIM = 1536
+INITIAL_CAPACITY = 1024
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def sanitise_collection_name(collection_name):
+    return ''.join(e for e in collection_name if e.isalnum() or e == '_')
+
+
+def quantize(vectors, dtype):
+    # Returns the stored representation, the per-vector scales and the squared norms of what is actually stored
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        stored = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        restored = stored.astype(np.float32) * scales[:, None]
+    else:
+        scales = np.ones(len(vectors), dtype=np.float32)
+        stored = vectors.astype(DTYPES[dtype])
+        restored = stored.astype(np.float32)
+    return stored, scales.astype(np.float32), np.einsum('ij,ij->i', restored, restored)
+
+
+def kmeans(vectors, num_lists, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        for i in range(num_lists):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+    return centroids
+
+
+def nearest_centroids(vectors, centroids, k=1):
+    distances = np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2 * vectors @ centroids.T
+    if k == 1:
+        return distances.argmin(axis=1)
+    return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+
+class LocalCollection:
+    # One collection on disk: vectors, scales and norms in memory-mapped .npy files indexed by row position,
+    # the other fields in SQLite. Writers from different processes are serialised with a file lock.
+
+    def __init__(self, path, dtype=LOCAL_VECTOR_DTYPE, dim=EMBEDDING_DIM):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._arrays = None
+        self._positions = {}
+        self._positions_version = None
+        self._ivf = None
+
+        conn = self._connection()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS records (pos INTEGER PRIMARY KEY, file_id TEXT NOT NULL, content TEXT NOT NULL, num_tokens INTEGER NOT NULL, page_number INTEGER NOT NULL DEFAULT 0)")
+            if "page_number" not in [row[1] for row in conn.execute("PRAGMA table_info(records)")]:
+                conn.execute("ALTER TABLE records ADD COLUMN page_number INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS records_file_id ON records (file_id, pos)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # An existing collection keeps the format it was created with
+            conn.executemany("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", [
+                ("dtype", dtype), ("dim", str(dim)), ("count", "0"), ("capacity", "0"), ("version", "0"), ("ivf_count", "0")
+            ])
+        self.dtype = self._meta("dtype")
+        self.dim = int(self._meta("dim"))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "records.sqlite3"), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, key):
+        return self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock, open(self._file("write.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open_arrays(self):
+        # (Re)map the .npy files, another process may have grown them since we last looked
+        capacity = int(self._meta("capacity"))
+        if self._arrays is None or self._arrays[0] != capacity:
+            if capacity == 0:
+                return None
+            self._arrays = (
+                capacity,
+                np.load(self._file("vectors.npy"), mmap_mode="r"),
+                np.load(self._file("scales.npy"), mmap_mode="r"),
+                np.load(self._file("norms.npy"), mmap_mode="r")
+            )
+        return self._arrays
+
+    def _grow(self, count, needed):
+        # Copy into bigger files and swap them in, readers holding the old mapping keep a valid (old) view
+        capacity = int(self._meta("capacity"))
+        if needed <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity * 2, needed)
+        old = self._open_arrays()
+        specs = [("vectors.npy", DTYPES[self.dtype], (new_capacity, self.dim)), ("scales.npy", np.float32, (new_capacity,)), ("norms.npy", np.float32, (new_capacity,))]
+        for i, (name, dtype, shape) in enumerate(specs):
+            tmp_path = self._file(name + ".tmp")
+            array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+            if old is not None:
+                array[:count] = old[i + 1][:count]
+            array.flush()
+            del array
+            os.replace(tmp_path, self._file(name))
+        with self._connection() as conn:
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'capacity'", (str(new_capacity),))
+
+    def insert(self, data):
+        file_ids, embeddings, contents, num_tokens = data[:4]
+        page_numbers = data[4] if len(data) > 4 else [0] * len(file_ids)
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        stored, scales, norms = quantize(vectors, self.dtype)
+
+        with self._write_lock():
+            count = int(self._meta("count"))
+            self._grow(count, count + len(vectors))
+            for name, values in (("vectors.npy", stored), ("scales.npy", scales), ("norms.npy", norms)):
+                array = np.load(self._file(name), mmap_mode="r+")
+                array[count:count + len(values)] = values
+                array.flush()
+                del array
+
+            # The rows only become visible once count and the records are committed
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO records (pos, file_id, content, num_tokens, page_number) VALUES (?, ?, ?, ?, ?)",
+                    [(count + i, file_ids[i], contents[i], int(num_tokens[i]), int(page_numbers[i])) for i in range(len(vectors))]
+                )
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'count'", (str(count + len(vectors)),))
+                conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+        return len(vectors)
+
+    def delete(self, file_id):
+        # Rows are dropped from the records table, their vectors are never read again
+        with self._write_lock():
+            conn = self._connection()
+            with conn:
+                deleted = conn.execute("DELETE FROM records WHERE file_id = ?", (file_id,)).rowcount
+                conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+        return deleted
+
+    def _candidate_positions(self, file_id):
+        # Row positions of a file (or of the whole collection for file_id=None), cached until the next write
+        version = self._meta("version")
+        with self._cache_lock:
+            if version != self._positions_version:
+                self._positions = {}
+                self._positions_version = version
+            if file_id in self._positions:
+                return self._positions[file_id]
+
+        if file_id is None:
+            rows = self._connection().execute("SELECT pos FROM records ORDER BY pos")
+        else:
+            rows = self._connection().execute("SELECT pos FROM records WHERE file_id = ? ORDER BY pos", (file_id,))
+        positions = np.fromiter((row[0] for row in rows), dtype=np.int64)
+        with self._cache_lock:
+            if version == self._positions_version:
+                self._positions[file_id] = positions
+        return positions
+
+    def _ivf_index(self, arrays):
+        # Build (or reload) an IVF index over the first ivf_count rows, rebuilt once the collection doubles.
+        # Rows added after the build are always scanned exactly.
+        count = int(self._meta("count"))
+        ivf_count = int(self._meta("ivf_count"))
+        if ivf_count * 2 < count:
+            with self._write_lock():
+                ivf_count = int(self._meta("ivf_count"))
+                if ivf_count * 2 < count:
+                    ivf_count = self._build_ivf(arrays, count)
+        if self._ivf is None or self._ivf[0] != ivf_count:
+            self._ivf = (ivf_count, np.load(self._file("ivf_centroids.npy")), np.load(self._file("ivf_assignments.npy"), mmap_mode="r"))
+        return self._ivf
+
+    def _build_ivf(self, arrays, count):
+        num_lists = int(min(1024, max(16, np.sqrt(count))))
+        _, vectors, scales, _ = arrays
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(count, min(count, num_lists * 50), replace=False))
+        centroids = kmeans(vectors[sample].astype(np.float32) * scales[sample, None], num_lists)
+        assignments = np.empty(count, dtype=np.int32)
+        for start in range(0, count, 65536):
+            end = min(start + 65536, count)
+            block = vectors[start:end].astype(np.float32) * scales[start:end, None]
+            assignments[start:end] = nearest_centroids(block, centroids)
+        np.save(self._file("ivf_centroids.npy"), centroids)
+        np.save(self._file("ivf_assignments.npy"), assignments)
+        with self._connection() as conn:
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'ivf_count'", (str(count),))
+        return count
+
+    def _distances(self, arrays, positions, query):
+        _, vectors, scales, norms = arrays
+        # Files are inserted in batches, so their rows form a few contiguous runs. Slicing each run out of
+        # the mapping is much cheaper than gathering rows one by one.
+        breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        if len(breaks) < 64:
+            runs = [slice(run[0], run[-1] + 1) for run in np.split(positions, breaks)]
+        else:
+            runs = [positions]
+        distances = []
+        for rows in runs:
+            dots = vectors[rows].astype(np.float32, copy=False) @ query
+            if self.dtype == "int8":
+                dots *= scales[rows]
+            distances.append(norms[rows] - 2 * dots)
+        return np.concatenate(distances) + query @ query
+
+    def search(self, vector, file_id, output_fields, limit):
+        positions = self._candidate_positions(file_id)
+        arrays = self._open_arrays()
+        if arrays is None or not len(positions):
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+
+        if len(positions) > LOCAL_IVF_MIN_ROWS:
+            ivf_count, centroids, assignments = self._ivf_index(arrays)
+            probe = nearest_centroids(query[None, :], centroids, min(LOCAL_IVF_NPROBE, len(centroids)))[0]
+            indexed = positions[positions < ivf_count]
+            positions = np.concatenate([indexed[np.isin(assignments[indexed], probe)], positions[positions >= ivf_count]])
+            if not len(positions):
+                return []
+
+        distances = self._distances(arrays, positions, query)
+        k = min(limit, len(positions))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+
+        selected = [int(pos) for pos in positions[top]]
+        placeholders = ",".join("?" * len(selected))
+        records = {
+            row[0]: {"file_id": row[1], "content": row[2], "num_tokens": row[3], "page_number": row[4]}
+            for row in self._connection().execute(f"SELECT pos, file_id, content, num_tokens, page_number FROM records WHERE pos IN ({placeholders})", selected)
+        }
+
+        hits = []
+        _, vectors, scales, _ = arrays
+        for pos, distance in zip(selected, distances[top]):
+            entity = {"id": pos}
+            for field in output_fields:
+                if field == "embedding":
+                    entity[field] = (vectors[pos].astype(np.float32) * scales[pos]).tolist()
+                elif field in records[pos]:
+                    entity[field] = records[pos][field]
+            hits.append(Hit(pos, float(distance), entity))
+        return hits
+
+
+class LocalVectorStore(VectorStore):
+    # Embedded engine for small deployments and CI, collections live under LOCAL_VECTOR_STORE_PATH
+
+    def __init__(self, path=LOCAL_VECTOR_STORE_PATH):
+        self.path = path
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=LOCAL_VECTOR_STORE_WORKERS, thread_name_prefix="local-vectors")
+
+    def collection(self, collection_name):
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = LocalCollection(os.path.join(self.path, sanitise_collection_name(collection_name)))
+            return self._collections[collection_name]
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    async def create(self, collection_name):
+        await self._run(self.collection, collection_name)
+
+    async def insert(self, collection_name, data):
+        return await self._run(lambda: self.collection(collection_name).insert(data))
+
+    async def search(self, collection_name, vector, file_id, output_fields, limit):
+        return await self._run(lambda: self.collection(collection_name).search(vector, file_id, output_fields, limit))
+
+    async def delete(self, collection_name, file_id):
+        return await self._run(lambda: self.collection(collection_name).delete(file_id))
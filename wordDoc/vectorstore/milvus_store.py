@@ -0,0 +1,76 @@
+import time
+import asyncio
+from pymilvus import MilvusException
+from wordDoc.vectorstore.base import VectorStore
+from wordDoc.milvus.insert import ensure_collection, delete_file
+from wordDoc.milvus.bulk_insert import bulk_inserter
+from wordDoc.milvus.query import get_top_n_chunks, milvus_executor
+from wordDoc.milvus.registry import collection_registry
+from wordDoc.milvus.partitions import partition_manager, partition_name, DEFAULT_PARTITION
+from instrumentation import milvus_rpc_seconds, retries
+
+
+class MilvusVectorStore(VectorStore):
+    # Wraps the existing pymilvus helpers, every call runs on the bounded Milvus executor.
+    # Each document goes into its own partition, so a search only touches (and only needs to load) that document.
+
+    async def _run(self, operation, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(milvus_executor, self._timed, operation, func, *args)
+
+    @staticmethod
+    def _timed(operation, func, *args):
+        # Timed on the executor thread, so the time spent queueing for a free thread is not counted
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            milvus_rpc_seconds.observe(time.perf_counter() - start, operation=operation)
+
+    async def create(self, collection_name):
+        await self._run("create", ensure_collection, collection_name)
+
+    async def insert(self, collection_name, data):
+        # Rows are grouped by file_id, normally a batch only holds one document. The bulk inserter splits them into
+        # requests by size and times them, see bulk_insert.py.
+        rows_by_file = {}
+        for i, file_id in enumerate(data[0]):
+            rows_by_file.setdefault(file_id, []).append(i)
+        await asyncio.gather(*(
+            bulk_inserter.insert(collection_name, data if len(rows_by_file) == 1 else [[column[i] for i in rows] for column in data], partition_name(file_id))
+            for file_id, rows in rows_by_file.items()
+        ))
+
+    async def flush(self, collection_name):
+        await bulk_inserter.flush(collection_name)
+
+    def _search(self, collection_name, vector, file_id, output_fields, limit):
+        if file_id is None:
+            # Whole collection, only the partitions currently loaded are searched
+            return get_top_n_chunks(collection_name, vector, None, output_fields, limit)
+
+        partition, expr = partition_name(file_id), None
+        if not collection_registry.has_partition(collection_name, partition):
+            # Documents inserted before per-document partitions are in the default partition
+            partition, expr = DEFAULT_PARTITION, f"file_id == '{file_id}'"
+
+        for attempt in range(2):
+            try:
+                with partition_manager.acquire(collection_name, partition):
+                    return get_top_n_chunks(collection_name, vector, expr, output_fields, limit, [partition])
+            except MilvusException:
+                # The partition may have been released by another process, load it again
+                partition_manager.forget(collection_name, partition)
+                if attempt:
+                    raise
+                retries.inc(operation="milvus_search")
+
+    async def search(self, collection_name, vector, file_id, output_fields, limit):
+        return await self._run("search", self._search, collection_name, vector, file_id, output_fields, limit)
+
+    def _delete(self, collection_name, file_id):
+        partition = partition_name(file_id)
+        partition_manager.forget(collection_name, partition)
+        return delete_file(collection_name, file_id, partition)
+
+    async def delete(self, collection_name, file_id):
+        return await self._run("delete", self._delete, collection_name, file_id)